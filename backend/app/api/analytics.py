@@ -1,4 +1,5 @@
 from fastapi import APIRouter, Depends, Query
+from fastapi.responses import ORJSONResponse
 from sqlmodel.ext.asyncio.session import AsyncSession
 from sqlmodel import select, func
 from datetime import date
@@ -6,7 +7,7 @@ from pydantic import BaseModel
 from typing import List
 
 # Importiamo la TUA sessione e i TUOI modelli
-from app.db.database import get_db_session
+from app.db.database import get_read_db_session
 from app.db.models import Receipt, User
 
 # NOTA: Assumo che tu abbia una funzione per ottenere l'utente corrente dal token.
@@ -33,7 +34,7 @@ class AnalyticsResponse(BaseModel):
 async def get_analytics(
     start_date: date = Query(..., description="Inizio del range (YYYY-MM-DD)"),
     end_date: date = Query(..., description="Fine del range (YYYY-MM-DD)"),
-    session: AsyncSession = Depends(get_db_session),
+    session: AsyncSession = Depends(get_read_db_session),
     # current_user: User = Depends(get_current_user) # Scommenta quando hai la dipendenza di auth!
 ):
     # TEMPORANEO: finché non scommenti get_current_user, simuliamo l'utente 1
@@ -99,8 +100,10 @@ async def get_analytics(
             )
         )
 
-    return AnalyticsResponse(
+    analytics = AnalyticsResponse(
         total_spent=round(float(total_spent), 2),
         spending_over_time=spending_over_time,
         top_categories=top_categories
-    )
\ No newline at end of file
+    )
+    # Il modello è già validato: serializziamo direttamente invece di rivalidarlo col response_model
+    return ORJSONResponse(analytics.model_dump())
\ No newline at end of file
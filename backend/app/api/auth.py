@@ -1,21 +1,28 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Request
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Response, BackgroundTasks
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
 from sqlmodel.ext.asyncio.session import AsyncSession
 from sqlmodel import select
+from sqlalchemy import update
 import os
 import jwt
+import logging
+from datetime import datetime, timedelta
 from pydantic import BaseModel
 from app.db.database import get_db_session
-from app.db.models import User, UserSession, Receipt
+from app.db.models import User, UserSession, AccountDeletionJob
 from app.schemas.user import UserCreate, UserResponse, TokenResponse
-from app.core.security import get_password_hash, verify_password, create_access_token, create_refresh_token
+from app.core.security import hash_password_async, verify_and_update_password, create_access_token, create_refresh_token
+from app.core.security import hash_refresh_token, REFRESH_TOKEN_EXPIRE_DAYS
 from app.core.limiter import limiter
 from app.schemas.user import ForgotPasswordRequest, ResetPasswordRequest, LogoutOtherDevicesRequest, RefreshTokenRequest
 from app.core.security import create_password_reset_token, verify_password_reset_token
 from app.services.email import send_reset_password_email
 from app.core.security import create_access_token
+from app.core.session_cache import session_cache, revoke
+from app.services.account_deletion import run_account_deletion
 
 router = APIRouter(prefix="/auth", tags=["Authentication"])
+logger = logging.getLogger(__name__)
 
 class LogoutRequest(BaseModel):
     refresh_token: str
@@ -42,10 +49,20 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession
     except jwt.InvalidTokenError:
         raise credentials_exception
         
+    # --- CACHE IN-PROCESS ---
+    # Sessione già verificata di recente e non revocata: zero query sul DB.
+    # Le revoche arrivano a tutti i worker via pub/sub, quindi il blocco resta istantaneo.
+    cached_user = session_cache.get(int(session_id), int(user_id))
+    if cached_user is not None:
+        # merge(load=False) attacca alla sessione di QUESTA richiesta una copia dell'utente, senza SELECT
+        return await db.merge(cached_user, load=False)
+
+    generation = session_cache.generation
+
     # --- IL BLOCCO ISTANTANEO (STATEFUL) ---
     # Controlliamo nel DB se questa SPECIFICA sessione è ancora viva
     session = await db.get(UserSession, session_id)
-    if not session or not session.is_active:
+    if not session or not session.is_active or session.user_id != int(user_id):
         raise credentials_exception
         
     # Se la sessione è viva, recuperiamo l'utente
@@ -54,6 +71,8 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession
     
     if user is None:
         raise credentials_exception
+
+    session_cache.put(int(session_id), user, generation)
         
     return user
 
@@ -62,6 +81,7 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession
 @limiter.limit("3/minute") # Massimo 3 registrazioni al minuto per IP (Anti-Bot)
 async def register_user(
     request: Request, # <-- Richiesto da SlowAPI
+    response: Response, # <-- SlowAPI ci scrive gli header X-RateLimit-*
     user_data: UserCreate, 
     db: AsyncSession = Depends(get_db_session)
 ):
@@ -73,7 +93,7 @@ async def register_user(
     new_user = User(
         email=user_data.email,
         full_name=user_data.full_name, # Salviamo il nome!
-        hashed_password=get_password_hash(user_data.password)
+        hashed_password=await hash_password_async(user_data.password)
     )
     db.add(new_user)
     await db.commit()
@@ -84,19 +104,30 @@ async def register_user(
 @limiter.limit("5/minute") # Massimo 5 tentativi di login al minuto per IP (Anti Brute-Force)
 async def login_user(
     request: Request, # <-- Ci serve per l'IP e il Browser!
+    response: Response,
     form_data: OAuth2PasswordRequestForm = Depends(),
     db: AsyncSession = Depends(get_db_session)
 ):
     query = select(User).where(User.email == form_data.username)
     result = await db.execute(query)
     user = result.scalar_one_or_none()
+
+    # bcrypt/argon2 girano nel pool dedicato: l'event loop resta libero per le altre richieste
+    password_ok, upgraded_hash = (False, None)
+    if user and user.is_active: # Account disattivati (es. cancellazione in corso) non entrano
+        password_ok, upgraded_hash = await verify_and_update_password(form_data.password, user.hashed_password)
     
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    if not password_ok:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+
+    # Hash con schema/costo vecchio: lo aggiorniamo ora che conosciamo la password in chiaro
+    # (viene salvato dallo stesso commit della nuova sessione)
+    if upgraded_hash:
+        user.hashed_password = upgraded_hash
     
     access_token = create_access_token(subject=user.id)
     refresh_token = create_refresh_token(subject=user.id)
@@ -108,7 +139,8 @@ async def login_user(
 
     new_session = UserSession(
         user_id=user.id,
-        refresh_token=refresh_token,
+        refresh_token_hash=hash_refresh_token(refresh_token),
+        expires_at=datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS),
         ip_address=client_ip,
         user_agent=user_agent
     )
@@ -132,7 +164,7 @@ async def logout_user(
     # Cerchiamo esattamente la sessione legata a questo refresh_token
     query = select(UserSession).where(
         (UserSession.user_id == current_user.id) & 
-        (UserSession.refresh_token == logout_req.refresh_token) &
+        (UserSession.refresh_token_hash == hash_refresh_token(logout_req.refresh_token)) &
         (UserSession.is_active == True)
     )
     result = await db.execute(query)
@@ -141,6 +173,8 @@ async def logout_user(
     # Se la troviamo, spegniamo SOLO quella
     if session:
         session.is_active = False
+        # Avvisiamo tutti i worker: la cache non deve più riconoscere questa sessione
+        await revoke(db, session_ids=[session.id])
         await db.commit()
         
     return {"message": "Successfully logged out from this device"}
@@ -149,6 +183,7 @@ async def logout_user(
 @limiter.limit("3/minute") # Massimo 3 richieste al minuto per IP
 async def forgot_password(
     request: Request, 
+    response: Response,
     request_data: ForgotPasswordRequest,
     db: AsyncSession = Depends(get_db_session)
 ):
@@ -160,7 +195,7 @@ async def forgot_password(
     # 2. Se l'utente esiste, generiamo il token e inviamo l'email
     if user:
         reset_token = create_password_reset_token(email=user.email)
-        # Eseguiamo l'invio dell'email in modo sincrono (o con BackgroundTasks in futuro)
+        # L'email viene solo accodata: la invia il MailSender in background con connessioni SMTP riusate
         send_reset_password_email(to_email=user.email, token=reset_token)
         
     # 3. Rispondiamo SEMPRE con successo per sicurezza (Anti-Enumeration)
@@ -170,6 +205,7 @@ async def forgot_password(
 @limiter.limit("5/minute") # Massimo 5 tentativi di reset al minuto
 async def reset_password(
     request: Request,
+    response: Response,
     request_data: ResetPasswordRequest,
     db: AsyncSession = Depends(get_db_session)
 ):
@@ -190,14 +226,15 @@ async def reset_password(
         raise HTTPException(status_code=404, detail="User not found")
         
     # 3. Aggiorniamo la password!
-    user.hashed_password = get_password_hash(request_data.new_password)
+    user.hashed_password = await hash_password_async(request_data.new_password)
     
     # 4. Spegniamo TUTTE le sessioni attive (sicurezza: se perdi la password, buttiamo fuori i dispositivi)
     session_query = select(UserSession).where((UserSession.user_id == user.id) & (UserSession.is_active == True))
     active_sessions = (await db.execute(session_query)).scalars().all()
     for session in active_sessions:
         session.is_active = False
-        
+
+    await revoke(db, user_id=user.id)
     await db.commit()
     
     return {"message": "Password successfully reset. All devices have been logged out."}
@@ -224,14 +261,18 @@ async def logout_other_devices(
     result = await db.execute(query)
     active_sessions = result.scalars().all()
     
-    devices_logged_out = 0
+    current_token_hash = hash_refresh_token(data.refresh_token)
+    revoked_ids = []
     
     # 2. Le spegniamo tutte, tranne quella che corrisponde al token corrente
     for session in active_sessions:
-        if session.refresh_token != data.refresh_token:
+        if session.refresh_token_hash != current_token_hash:
             session.is_active = False
-            devices_logged_out += 1
-            
+            revoked_ids.append(session.id)
+    devices_logged_out = len(revoked_ids)
+
+    if revoked_ids:
+        await revoke(db, session_ids=revoked_ids)
     await db.commit()
     
     return {
@@ -244,13 +285,16 @@ async def refresh_access_token(
     data: RefreshTokenRequest, 
     db: AsyncSession = Depends(get_db_session)
 ):
-    # 1. Cerchiamo la sessione nel DB usando il refresh_token
-    query = select(UserSession).where(UserSession.refresh_token == data.refresh_token)
+    # 1. Cerchiamo la sessione nel DB usando l'hash del refresh_token (indice parziale sulle sessioni attive)
+    query = select(UserSession).where(
+        (UserSession.refresh_token_hash == hash_refresh_token(data.refresh_token)) &
+        (UserSession.is_active == True)
+    )
     result = await db.execute(query)
     session = result.scalar_one_or_none()
     
-    # 2. IL MOMENTO DELLA VERITA': La sessione esiste ed è attiva?
-    if not session or not session.is_active:
+    # 2. IL MOMENTO DELLA VERITA': La sessione esiste, è attiva e non è scaduta?
+    if not session or session.expires_at < datetime.utcnow():
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Session expired, revoked, or invalid"
@@ -262,45 +306,62 @@ async def refresh_access_token(
     
     return {"access_token": new_access_token, "token_type": "bearer"}
 
-@router.delete("/me")
+@router.delete("/me", status_code=status.HTTP_202_ACCEPTED)
 async def delete_my_account(
+    background_tasks: BackgroundTasks,
     current_user: User = Depends(get_current_user), 
     db: AsyncSession = Depends(get_db_session)
 ):
     """
-    Elimina permanentemente l'utente, tutti i suoi scontrini, gli item e le sessioni attive.
+    Avvia la cancellazione permanente dell'utente, dei suoi scontrini, item, chat, sessioni e file.
+    L'account viene bloccato subito; il lavoro pesante gira in background e lo stato
+    si legge da GET /auth/deletion-status/{job_id}.
     """
     # SALVATAGGIO SICURO: Salviamo l'ID prima di interagire con il DB
     # Questo previene l'errore 'MissingGreenlet' in caso di rollback!
     safe_user_id = current_user.id 
 
     try:
-        # 1. Eliminiamo tutti gli scontrini dell'utente
-        receipts_query = select(Receipt).where(Receipt.user_id == safe_user_id)
-        result = await db.execute(receipts_query)
-        receipts = result.scalars().all()
-        
-        for receipt in receipts:
-            await db.delete(receipt)
-            
-        # 2. Eliminiamo tutte le sessioni attive dell'utente
-        sessions_query = select(UserSession).where(UserSession.user_id == safe_user_id)
-        sess_result = await db.execute(sessions_query)
-        sessions = sess_result.scalars().all()
-        
-        for session in sessions:
-            await db.delete(session)
-            
-        # 3. Infine, eliminiamo l'utente stesso
-        await db.delete(current_user)
-        
-        # Confermiamo le modifiche al database
+        # 1. Blocchiamo l'account: niente più login né richieste con i token esistenti
+        current_user.is_active = False
+        await db.execute(
+            update(UserSession)
+            .where((UserSession.user_id == safe_user_id) & (UserSession.is_active == True))
+            .values(is_active=False)
+        )
+        await revoke(db, user_id=safe_user_id)
+
+        # 2. Registriamo il job, così il client può seguirne l'avanzamento
+        job = AccountDeletionJob(user_id=safe_user_id)
+        db.add(job)
         await db.commit()
         
-        return {"message": "Account and all associated data permanently deleted."}
-        
-    except Exception as e:
+    except Exception:
         await db.rollback() # Se qualcosa va storto, annulliamo
         # Usiamo safe_user_id che è un semplice numero (int), quindi niente crash!
-        print(f"Error deleting user {safe_user_id}: {str(e)}")
-        raise HTTPException(status_code=500, detail="Failed to delete account. Please try again.")
\ No newline at end of file
+        logger.exception("Account deletion request failed", extra={"user_id": safe_user_id})
+        raise HTTPException(status_code=500, detail="Failed to delete account. Please try again.")
+
+    # 3. File e righe vengono cancellati in background con operazioni set-based
+    background_tasks.add_task(run_account_deletion, job.id, safe_user_id)
+
+    return {
+        "message": "Account deletion started. All associated data will be permanently deleted.",
+        "job_id": job.id,
+        "status_url": f"/auth/deletion-status/{job.id}",
+    }
+
+@router.get("/deletion-status/{job_id}")
+async def get_deletion_status(job_id: str, db: AsyncSession = Depends(get_db_session)):
+    """Stato della cancellazione. Niente autenticazione: a fine job l'utente non esiste più, l'UUID fa da chiave."""
+    job = await db.get(AccountDeletionJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Deletion job not found")
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "objects_deleted": job.objects_deleted,
+        "rows_deleted": job.rows_deleted,
+        "error": "Deletion failed, our team has been notified." if job.error else None,
+        "updated_at": job.updated_at.isoformat(),
+    }
@@ -1,19 +1,34 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query, Request, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy import delete
+from sqlalchemy import delete, func, tuple_
 from sqlalchemy.orm import selectinload # <-- NUOVO: Serve per caricare gli item degli scontrini
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
-from typing import List, Optional
-from google import genai
-from google.genai import types
+from typing import Optional
+import os
 import uuid
+import base64
+import logging
+from datetime import datetime
 
 from app.api.auth import get_current_user
-from app.db.database import get_db_session
+from app.db.database import get_db_session, get_read_db_session
 from app.db.models import User, Receipt, ChatSession, ChatMessage
+from app.services.gemini import get_client, governor, estimate_tokens, PRIORITY_INTERACTIVE
+from app.services.chat_summary import HISTORY_MAX, needs_refresh, refresh_session_summary
+from app.services.model_router import route_chat_model
+from app.core.limiter import limiter, get_user_or_ip_key
+from app.core.conditional import data_etag, etag_matches, not_modified, cache_headers
 
 router = APIRouter(prefix="/ai", tags=["AI Chat"])
+logger = logging.getLogger(__name__)
+
+CHAT_RATE_LIMIT = os.getenv("CHAT_RATE_LIMIT", "20/minute")
+# Memoria globale: quante sessioni precedenti e, per quelle senza riassunto, quanti dei loro ultimi messaggi
+GLOBAL_MEMORY_SESSIONS = int(os.getenv("CHAT_GLOBAL_MEMORY_SESSIONS", 5))
+GLOBAL_MEMORY_MESSAGES = int(os.getenv("CHAT_GLOBAL_MEMORY_MESSAGES", 4))
+GLOBAL_MEMORY_MESSAGE_CHARS = 300
 
 class ChatRequest(BaseModel):
     message: str = ""
@@ -45,21 +60,105 @@ USER RECEIPTS DATA:
 ---
 PREVIOUS CHAT CONTEXT (Global Memory):
 {global_memory}
+
+---
+EARLIER IN THIS CONVERSATION (Summary of older messages):
+{session_summary}
 """
 
+# --- PAGINAZIONE KEYSET ---
+# Il cursore è opaco per il client: "timestamp|id" in base64. L'id fa da spareggio
+# quando due righe hanno lo stesso timestamp, così nessuna riga viene saltata o ripetuta.
+
+def _encode_cursor(ts: datetime, row_id: str) -> str:
+    return base64.urlsafe_b64encode(f"{ts.isoformat()}|{row_id}".encode()).decode()
+
+def _decode_cursor(cursor: str) -> tuple[datetime, str]:
+    try:
+        ts, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+        return datetime.fromisoformat(ts), row_id
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 @router.get("/sessions")
-async def get_sessions(current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db_session)):
-    query = select(ChatSession).where(ChatSession.user_id == current_user.id).order_by(ChatSession.updated_at.desc())
-    result = await db.execute(query)
-    sessions = result.scalars().all()
-    return [{"id": s.id, "title": s.title, "created_at": s.created_at.isoformat()} for s in sessions]
+async def get_sessions(
+    request: Request,
+    limit: int = Query(30, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="next_cursor della pagina precedente"),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db_session)
+):
+    """Sessioni dalla più recente, una pagina alla volta (indice user_id + updated_at + id)."""
+    etag = await data_etag(request, db, current_user.id)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    query = select(
+        ChatSession.id, ChatSession.title, ChatSession.created_at, ChatSession.updated_at,
+        ChatSession.message_count, ChatSession.last_message_at
+    ).where(ChatSession.user_id == current_user.id)
+    if cursor:
+        updated_at, last_id = _decode_cursor(cursor)
+        query = query.where(tuple_(ChatSession.updated_at, ChatSession.id) < tuple_(updated_at, last_id))
+    query = query.order_by(ChatSession.updated_at.desc(), ChatSession.id.desc()).limit(limit + 1)
+
+    rows = (await db.execute(query)).all()
+    page = rows[:limit]
+    return ORJSONResponse({
+        "items": [
+            {
+                "id": s.id,
+                "title": s.title,
+                "created_at": s.created_at.isoformat(),
+                "updated_at": s.updated_at.isoformat(),
+                "message_count": s.message_count,
+                "last_message_at": s.last_message_at.isoformat() if s.last_message_at else None,
+            }
+            for s in page
+        ],
+        "next_cursor": _encode_cursor(page[-1].updated_at, page[-1].id) if len(rows) > limit else None,
+    }, headers=cache_headers(etag))
 
 @router.get("/sessions/{session_id}")
-async def get_session_messages(session_id: str, current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db_session)):
-    query = select(ChatMessage).where(ChatMessage.session_id == session_id).order_by(ChatMessage.created_at.asc())
-    result = await db.execute(query)
-    messages = result.scalars().all()
-    return [{"id": m.id, "role": "user" if m.role == "user" else "assistant", "content": m.content} for m in messages]
+async def get_session_messages(
+    request: Request,
+    session_id: str,
+    limit: int = Query(50, ge=1, le=200),
+    before: Optional[str] = Query(None, description="Cursore per caricare i messaggi più vecchi"),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db_session)
+):
+    """
+    Ultimi `limit` messaggi della sessione, in ordine cronologico. I più vecchi si caricano
+    on demand passando `before`. La JOIN su ChatSession verifica la proprietà nella stessa query.
+    """
+    # L'ETag è legato all'utente: un 304 non rivela nulla su sessioni altrui
+    etag = await data_etag(request, db, current_user.id)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    query = (
+        select(ChatMessage)
+        .join(ChatSession, ChatSession.id == ChatMessage.session_id)
+        .where(ChatMessage.session_id == session_id, ChatSession.user_id == current_user.id)
+    )
+    if before:
+        created_at, first_id = _decode_cursor(before)
+        query = query.where(tuple_(ChatMessage.created_at, ChatMessage.id) < tuple_(created_at, first_id))
+    query = query.order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc()).limit(limit + 1)
+
+    rows = (await db.execute(query)).scalars().all()
+    if not rows and not before:
+        # Nessun messaggio: distinguiamo "sessione vuota" da "sessione non tua / inesistente"
+        owner_query = select(ChatSession.id).where(ChatSession.id == session_id, ChatSession.user_id == current_user.id)
+        if (await db.execute(owner_query)).scalar_one_or_none() is None:
+            raise HTTPException(status_code=404, detail="Session not found")
+
+    page = list(reversed(rows[:limit]))
+    return ORJSONResponse({
+        "items": [{"id": m.id, "role": "user" if m.role == "user" else "assistant", "content": m.content} for m in page],
+        "next_cursor": _encode_cursor(page[0].created_at, page[0].id) if len(rows) > limit else None,
+    }, headers=cache_headers(etag))
 
 @router.delete("/sessions/{session_id}")
 async def delete_session(session_id: str, current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db_session)):
@@ -73,57 +172,75 @@ async def delete_session(session_id: str, current_user: User = Depends(get_curre
     return {"success": True}
 
 @router.post("/chat")
+@limiter.limit(CHAT_RATE_LIMIT, key_func=get_user_or_ip_key) # Ogni turno costa una chiamata al modello
 async def ai_chat(
-    request: ChatRequest,
+    request: Request, # <-- Richiesto da SlowAPI
+    response: Response,
+    chat_request: ChatRequest,
+    background_tasks: BackgroundTasks,
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db_session)
 ):
     try:
-        session_id = request.session_id
+        session_id = chat_request.session_id
         if not session_id:
             session_id = str(uuid.uuid4())
-            title = request.message[:20] + "..." if len(request.message) > 20 else request.message
-            new_session = ChatSession(id=session_id, user_id=current_user.id, title=title)
-            db.add(new_session)
+            title = chat_request.message[:20] + "..." if len(chat_request.message) > 20 else chat_request.message
+            chat_session = ChatSession(id=session_id, user_id=current_user.id, title=title)
+            db.add(chat_session)
             await db.commit()
+        else:
+            # Carichiamo la sessione verificando che sia dell'utente (ci serve anche il riassunto)
+            session_query = select(ChatSession).where(ChatSession.id == session_id, ChatSession.user_id == current_user.id)
+            chat_session = (await db.execute(session_query)).scalar_one_or_none()
+            if not chat_session:
+                raise HTTPException(status_code=404, detail="Session not found")
 
         # --- 1. LOGICA DI MODIFICA (EDIT) ---
-        if request.edit_message_id:
-            msg_query = select(ChatMessage).where(ChatMessage.id == request.edit_message_id, ChatMessage.session_id == session_id)
+        if chat_request.edit_message_id:
+            msg_query = select(ChatMessage).where(ChatMessage.id == chat_request.edit_message_id, ChatMessage.session_id == session_id)
             msg_result = await db.execute(msg_query)
             target_msg = msg_result.scalar_one_or_none()
             if target_msg:
                 # Aggiorniamo il testo del messaggio ESISTENTE
-                target_msg.content = request.message
+                target_msg.content = chat_request.message
                 # Cancelliamo solo la vecchia risposta dell'IA (quella successiva a questo messaggio)
                 del_query = delete(ChatMessage).where(
                     ChatMessage.session_id == session_id, 
                     ChatMessage.created_at > target_msg.created_at # Nota: Usa il simbolo Maggiore (>)
                 )
-                await db.execute(del_query)
+                deleted = await db.execute(del_query)
+                chat_session.message_count = max(0, chat_session.message_count - (deleted.rowcount or 0))
+                # Se la modifica tocca messaggi già riassunti, il riassunto non è più valido
+                if chat_session.summarized_until and target_msg.created_at <= chat_session.summarized_until:
+                    chat_session.summary = None
+                    chat_session.summarized_until = None
                 await db.commit()
 
         # --- 2. LOGICA DI RIGENERAZIONE ---
-        elif request.regenerate: # Nota: Aggiunto 'elif'
+        elif chat_request.regenerate: # Nota: Aggiunto 'elif'
             last_msg_query = select(ChatMessage).where(ChatMessage.session_id == session_id).order_by(ChatMessage.created_at.desc()).limit(1)
             last_msg_result = await db.execute(last_msg_query)
             last_msg = last_msg_result.scalar_one_or_none()
             
             if last_msg and last_msg.role == "model":
                 await db.delete(last_msg)
+                chat_session.message_count = max(0, chat_session.message_count - 1)
                 await db.commit()
                 
             new_last_query = select(ChatMessage).where(ChatMessage.session_id == session_id).order_by(ChatMessage.created_at.desc()).limit(1)
             new_last_result = await db.execute(new_last_query)
             user_msg_record = new_last_result.scalar_one_or_none()
             if user_msg_record:
-                request.message = user_msg_record.content
+                chat_request.message = user_msg_record.content
 
         # --- 3. NUOVO MESSAGGIO NORMALE ---
         else:
             # Creiamo un nuovo messaggio SOLO se non stiamo modificando né rigenerando
-            user_msg = ChatMessage(id=str(uuid.uuid4()), session_id=session_id, role="user", content=request.message)
+            user_msg = ChatMessage(id=str(uuid.uuid4()), session_id=session_id, role="user", content=chat_request.message)
             db.add(user_msg)
+            chat_session.message_count += 1
+            chat_session.last_message_at = user_msg.created_at
             await db.commit()
 
         # --- CARICHIAMO SCONTRINI E GLI OGGETTI COMPRATI (ITEMS) ---
@@ -142,18 +259,40 @@ async def ai_chat(
                 user_data_string += f"- Date: {date_str} | Store: {r.store_name} | Total: {r.total_amount} {r.currency} | Items bought: {items_str}\n"
 
         global_memory_string = "No global memory requested."
-        if request.use_global_memory:
-            mem_query = select(ChatMessage).where(
-                ChatMessage.session_id != session_id,
-                ChatMessage.session.has(user_id=current_user.id)
-            ).order_by(ChatMessage.created_at.desc()).limit(10)
-            mem_result = await db.execute(mem_query)
-            old_messages = mem_result.scalars().all()
-            if old_messages:
-                old_messages.reverse()
-                global_memory_string = "\n".join([f"{m.role.upper()}: {m.content}" for m in old_messages])
-            else:
-                global_memory_string = "No previous conversations found."
+        if chat_request.use_global_memory:
+            # Memoria globale dalle ultime sessioni: il riassunto salvato quando c'è, altrimenti
+            # (sessioni brevi, mai riassunte) il titolo e gli ultimi messaggi. Due query su poche righe
+            # invece di scandire tutti i messaggi dell'utente
+            mem_query = select(ChatSession.id, ChatSession.title, ChatSession.summary).where(
+                ChatSession.user_id == current_user.id,
+                ChatSession.id != session_id,
+            ).order_by(ChatSession.updated_at.desc()).limit(GLOBAL_MEMORY_SESSIONS)
+            old_sessions = (await db.execute(mem_query)).all()
+
+            recent_by_session = {}
+            unsummarized = [s.id for s in old_sessions if not s.summary]
+            if unsummarized:
+                position = func.row_number().over(
+                    partition_by=ChatMessage.session_id, order_by=ChatMessage.created_at.desc()
+                ).label("position")
+                recent = select(ChatMessage.session_id, ChatMessage.role, ChatMessage.content, ChatMessage.created_at, position).where(
+                    ChatMessage.session_id.in_(unsummarized)
+                ).subquery()
+                recent_query = select(recent.c.session_id, recent.c.role, recent.c.content).where(
+                    recent.c.position <= GLOBAL_MEMORY_MESSAGES
+                ).order_by(recent.c.session_id, recent.c.created_at)
+                for row in (await db.execute(recent_query)).all():
+                    recent_by_session.setdefault(row.session_id, []).append(
+                        f"{row.role}: {row.content[:GLOBAL_MEMORY_MESSAGE_CHARS]}"
+                    )
+
+            memories = []
+            for s in old_sessions:
+                if s.summary:
+                    memories.append(f"- {s.title}: {s.summary}")
+                elif s.id in recent_by_session:
+                    memories.append(f"- {s.title}: " + " | ".join(recent_by_session[s.id]))
+            global_memory_string = "\n".join(memories) if memories else "No previous conversations found."
 
         tone_map = {
             "professional": "Act as a strict, objective, and highly professional accountant. Focus strictly on numbers and facts.",
@@ -169,23 +308,33 @@ async def ai_chat(
         dynamic_system_prompt = BASE_SYSTEM_PROMPT.format(
             user_data=user_data_string, 
             global_memory=global_memory_string,
-            tone_instruction=tone_map.get(request.tone, tone_map["professional"]),
-            format_instruction=format_map.get(request.format, format_map["text"])
+            session_summary=chat_session.summary or "Nothing before the messages below.",
+            tone_instruction=tone_map.get(chat_request.tone, tone_map["professional"]),
+            format_instruction=format_map.get(chat_request.format, format_map["text"])
         )
 
-        chat_history_query = select(ChatMessage).where(ChatMessage.session_id == session_id).order_by(ChatMessage.created_at.asc())
+        # Vanno al modello parola per parola tutti i messaggi non ancora riassunti (+ quello corrente):
+        # quelli prima di summarized_until sono già condensati in chat_session.summary.
+        # Il tetto conta solo se il riassunto in background continua a fallire
+        chat_history_query = select(ChatMessage).where(ChatMessage.session_id == session_id)
+        if chat_session.summarized_until:
+            chat_history_query = chat_history_query.where(ChatMessage.created_at > chat_session.summarized_until)
+        chat_history_query = chat_history_query.order_by(ChatMessage.created_at.desc()).limit(HISTORY_MAX + 1)
         history_result = await db.execute(chat_history_query)
-        history_msgs = history_result.scalars().all()
+        history_msgs = list(reversed(history_result.scalars().all()))
 
-        client = genai.Client()
-        target_model = 'gemini-3-pro-preview' if request.model == 'gemini-3-pro' else 'gemini-3-flash-preview'
+        from google.genai import types # Import pigro: vedi app.services.gemini.init_client
+        client = get_client()
+        # Le domande di puro aggregato ("quanto ho speso a marzo?") non hanno bisogno del Pro
+        target_model = route_chat_model(chat_request.model, chat_request.message)
         
         history = [
             types.Content(role=m.role, parts=[types.Part.from_text(text=m.content)]) 
             for m in history_msgs[:-1]
         ]
 
-        chat = client.chats.create(
+        # Client asincrono: la chiamata al modello non blocca più l'event loop
+        chat = client.aio.chats.create(
             model=target_model,
             history=history,
             config=types.GenerateContentConfig(
@@ -194,19 +343,41 @@ async def ai_chat(
             )
         )
         
-        response = chat.send_message(request.message)
+        # La chat è interattiva: ha la precedenza sui job OCR in coda
+        prompt_texts = [dynamic_system_prompt, *[m.content for m in history_msgs]]
+        ai_response = await governor.run(
+            lambda: chat.send_message(chat_request.message),
+            user_id=current_user.id,
+            priority=PRIORITY_INTERACTIVE,
+            estimated_tokens=estimate_tokens(*prompt_texts),
+            call_type="chat",
+            model=target_model,
+            request_bytes=sum(len(t.encode()) for t in prompt_texts),
+        )
         
-        ai_msg = ChatMessage(id=str(uuid.uuid4()), session_id=session_id, role="model", content=response.text)
+        ai_msg = ChatMessage(id=str(uuid.uuid4()), session_id=session_id, role="model", content=ai_response.text)
         db.add(ai_msg)
+        chat_session.message_count += 1
+        chat_session.last_message_at = ai_msg.created_at
+        chat_session.updated_at = ai_msg.created_at
         await db.commit()
+
+        # Conteggio economico (indice session_id + created_at) dei messaggi non ancora riassunti
+        pending_query = select(func.count()).select_from(ChatMessage).where(ChatMessage.session_id == session_id)
+        if chat_session.summarized_until:
+            pending_query = pending_query.where(ChatMessage.created_at > chat_session.summarized_until)
+        if needs_refresh((await db.execute(pending_query)).scalar_one()):
+            background_tasks.add_task(refresh_session_summary, session_id, current_user.id)
         
         return {
-            "reply": response.text, 
+            "reply": ai_response.text, 
             "session_id": session_id,
-            "title": request.message[:20] + "..." if len(request.message) > 20 else request.message
+            "title": chat_request.message[:20] + "..." if len(chat_request.message) > 20 else chat_request.message
         }
 
-    except Exception as e:
+    except HTTPException:
+        raise
+    except Exception:
         await db.rollback()
-        print(f"Chat Error: {e}")
+        logger.exception("Chat request failed", extra={"user_id": current_user.id})
         raise HTTPException(status_code=500, detail="Failed to connect to SpendScope AI.")
\ No newline at end of file
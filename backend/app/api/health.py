@@ -0,0 +1,31 @@
+# app/api/health.py
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+from app.db.database import ping_database
+
+router = APIRouter(tags=["Health"])
+
+# Diventa True a fine lifespan (client creati, pool caldi) e torna False allo spegnimento,
+# così il load balancer smette di mandare traffico prima che chiudiamo le connessioni.
+_ready = False
+
+def set_ready(ready: bool):
+    global _ready
+    _ready = ready
+
+
+@router.get("/healthz")
+async def healthz():
+    """Liveness: il processo risponde. Nessuna dipendenza esterna, così un DB lento non fa riavviare il pod."""
+    return {"status": "ok"}
+
+
+@router.get("/readyz")
+async def readyz():
+    """Readiness: avvio completato e database raggiungibile."""
+    if not _ready:
+        return JSONResponse(status_code=503, content={"status": "starting"})
+    if not await ping_database():
+        return JSONResponse(status_code=503, content={"status": "database unavailable"})
+    return {"status": "ready"}
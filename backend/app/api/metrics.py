@@ -0,0 +1,125 @@
+from fastapi import APIRouter, Depends, HTTPException, Header, Query
+from fastapi.responses import PlainTextResponse
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlmodel import select, func
+from datetime import datetime, timedelta
+from typing import Optional
+import os
+
+from app.db.database import get_db_session
+from app.db.models import ModelCall
+from app.services.gemini import governor
+from app.services.model_metrics import recorder
+from app.services.model_router import routing_stats
+from app.core.metrics import registry
+
+router = APIRouter(prefix="/metrics", tags=["Metrics"])
+
+# Le metriche espongono dati di tutti gli utenti: servono solo a chi gestisce il servizio.
+# Se METRICS_TOKEN non è configurato gli endpoint semplicemente non esistono (404).
+# Prometheus può mandare il token anche come "Authorization: Bearer ..." (authorization.credentials).
+def require_metrics_token(
+    x_metrics_token: Optional[str] = Header(default=None),
+    authorization: Optional[str] = Header(default=None),
+):
+    expected = os.getenv("METRICS_TOKEN")
+    if not expected:
+        raise HTTPException(status_code=404, detail="Not Found")
+    bearer = authorization[7:] if authorization and authorization.lower().startswith("bearer ") else None
+    if expected not in (x_metrics_token, bearer):
+        raise HTTPException(status_code=403, detail="Invalid metrics token")
+
+
+@router.get("", dependencies=[Depends(require_metrics_token)], response_class=PlainTextResponse)
+async def get_prometheus_metrics():
+    """Metriche di questo processo in formato testo Prometheus (HTTP, DB pool, S3, Gemini, OCR)."""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@router.get("/models", dependencies=[Depends(require_metrics_token)])
+async def get_model_metrics():
+    """Istogrammi in memoria di questo processo + stato attuale del governatore."""
+    return {
+        "governor": governor.stats(),
+        "calls": recorder.snapshot(),
+        "routing": routing_stats.snapshot(),
+    }
+
+
+@router.get("/models/report", dependencies=[Depends(require_metrics_token)])
+async def get_model_report(
+    hours: int = Query(24, ge=1, le=24 * 90, description="Finestra temporale in ore"),
+    limit: int = Query(10, ge=1, le=100),
+    db: AsyncSession = Depends(get_db_session),
+):
+    """Report aggregato (da DB, tutti i worker): chi consuma, quali prompt pesano, quali chiamate sono lente."""
+    since = datetime.utcnow() - timedelta(hours=hours)
+    window = ModelCall.created_at >= since
+
+    # --- Aggregati per tipo di chiamata e modello ---
+    by_type_query = (
+        select(
+            ModelCall.call_type,
+            ModelCall.model,
+            func.count().label("calls"),
+            func.count(ModelCall.error).label("errors"),
+            func.sum(ModelCall.prompt_tokens).label("prompt_tokens"),
+            func.sum(ModelCall.completion_tokens).label("completion_tokens"),
+            func.sum(ModelCall.request_bytes).label("request_bytes"),
+            func.sum(ModelCall.cost_usd).label("cost_usd"),
+            func.percentile_cont(0.5).within_group(ModelCall.latency_ms).label("p50_ms"),
+            func.percentile_cont(0.95).within_group(ModelCall.latency_ms).label("p95_ms"),
+        )
+        .where(window)
+        .group_by(ModelCall.call_type, ModelCall.model)
+        .order_by(func.sum(ModelCall.cost_usd).desc())
+    )
+    by_type = (await db.execute(by_type_query)).all()
+
+    # --- Utenti che generano più carico ---
+    top_users_query = (
+        select(
+            ModelCall.user_id,
+            func.count().label("calls"),
+            func.sum(ModelCall.prompt_tokens + ModelCall.completion_tokens).label("tokens"),
+            func.sum(ModelCall.cost_usd).label("cost_usd"),
+        )
+        .where(window, ModelCall.user_id.is_not(None))
+        .group_by(ModelCall.user_id)
+        .order_by(func.sum(ModelCall.cost_usd).desc())
+        .limit(limit)
+    )
+    top_users = (await db.execute(top_users_query)).all()
+
+    # --- Singole chiamate peggiori ---
+    slowest = (await db.execute(
+        select(ModelCall).where(window).order_by(ModelCall.latency_ms.desc()).limit(limit)
+    )).scalars().all()
+    most_expensive = (await db.execute(
+        select(ModelCall).where(window).order_by(ModelCall.cost_usd.desc()).limit(limit)
+    )).scalars().all()
+
+    return {
+        "since": since.isoformat(),
+        "by_call_type": [
+            {
+                "call_type": row.call_type,
+                "model": row.model,
+                "calls": row.calls,
+                "errors": row.errors,
+                "prompt_tokens": int(row.prompt_tokens or 0),
+                "completion_tokens": int(row.completion_tokens or 0),
+                "request_bytes": int(row.request_bytes or 0),
+                "cost_usd": round(float(row.cost_usd or 0), 4),
+                "p50_ms": round(float(row.p50_ms or 0), 1),
+                "p95_ms": round(float(row.p95_ms or 0), 1),
+            }
+            for row in by_type
+        ],
+        "top_users": [
+            {"user_id": row.user_id, "calls": row.calls, "tokens": int(row.tokens or 0), "cost_usd": round(float(row.cost_usd or 0), 4)}
+            for row in top_users
+        ],
+        "slowest_calls": [c.model_dump() for c in slowest],
+        "most_expensive_calls": [c.model_dump() for c in most_expensive],
+    }
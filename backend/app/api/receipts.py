@@ -1,67 +1,223 @@
-from fastapi import APIRouter, Depends, UploadFile, File, BackgroundTasks, HTTPException, status
+from fastapi import APIRouter, Depends, UploadFile, File, BackgroundTasks, HTTPException, status, Request, Response
 from sqlmodel.ext.asyncio.session import AsyncSession
 from sqlmodel import select
-from sqlalchemy.orm import selectinload
-from app.db.database import get_db_session
+from sqlalchemy import delete, func, insert, update
+from app.db.database import get_db_session, get_read_db_session
 from app.db.models import Receipt, ReceiptStatus, ExpenseItem, User # User importato
-from app.core.storage import upload_file_to_s3
+from app.core.storage import upload_file_to_s3, generate_download_url, download_file
+from app.services.derivatives import (
+    compute_image_hash, generate_receipt_derivatives, supports_derivatives, DERIVATIVE_RESPONSE_CACHE_CONTROL
+)
+from app.services.duplicates import duplicate_index, find_duplicate, to_db_hash, DUPLICATE_SKIP_OCR
 from app.services.ocr import process_receipt_image
-import boto3
-from botocore.client import Config
 import os
 from app.api.auth import get_current_user
+from app.core.limiter import limiter, get_user_or_ip_key
+from app.core.metrics import ocr_jobs_in_progress, ocr_jobs_total
+from app.core.tracing import span
+from app.core.archive import ZipStream
+from app.core.conditional import data_etag, etag_matches, not_modified, cache_headers, bump_data_version
+from app.schemas.receipt import ReceiptResponse, RECEIPT_FIELDS, ITEM_FIELDS, receipts_from_rows
+import asyncio
 import csv
+import re
+from collections import deque
+from datetime import date, datetime, timedelta
+from typing import List, Optional
 import io
-from fastapi.responses import StreamingResponse
+import logging
+from fastapi.responses import StreamingResponse, ORJSONResponse
 
 router = APIRouter(prefix="/receipts", tags=["Receipts"])
+logger = logging.getLogger(__name__)
 
-async def extract_and_save_data(receipt_id: int, file_url: str, db: AsyncSession):
+UPLOAD_RATE_LIMIT = os.getenv("UPLOAD_RATE_LIMIT", "30/minute")
+ARCHIVE_RATE_LIMIT = os.getenv("ARCHIVE_RATE_LIMIT", "10/hour")
+# Download dal bucket in volo durante l'export ZIP: la memoria è al più questo numero di originali
+ARCHIVE_FETCH_CONCURRENCY = int(os.getenv("ARCHIVE_FETCH_CONCURRENCY", 4))
+# asyncpg accetta al massimo 32767 parametri per statement: 1000 voci x 5 colonne stanno larghe
+ITEM_INSERT_CHUNK = 1000
+
+async def extract_and_save_data(receipt_id: int, file_url: str, db: AsyncSession, user_id: int | None = None):
     """
     Background task: Runs the OCR processing and updates the database.
+    Gira nel contesto della richiesta di upload: il suo span è figlio di quello dell'upload.
+    """
+    ocr_jobs_in_progress.inc()
+    try:
+        with span("receipt.ocr_job", receipt_id=receipt_id, user_id=user_id):
+            await _extract_and_save(receipt_id, file_url, db, user_id)
+    finally:
+        ocr_jobs_in_progress.dec()
+
+
+async def _claim_ocr_run(db: AsyncSession, receipt_id: int, user_id: int | None):
+    """
+    Apre una nuova esecuzione OCR sullo scontrino (ocr_run + 1, stato PROCESSING) e la committa subito.
+    Restituisce (ocr_run, user_id), o None se lo scontrino non esiste più.
+    """
+    conditions = [Receipt.id == receipt_id]
+    if user_id is not None:
+        conditions.append(Receipt.user_id == user_id) # Chiave di partizione: una sola partizione toccata
+    claimed = (await db.execute(
+        update(Receipt)
+        .where(*conditions)
+        .values(ocr_run=Receipt.ocr_run + 1, status=ReceiptStatus.PROCESSING, updated_at=datetime.utcnow())
+        .returning(Receipt.ocr_run, Receipt.user_id)
+    )).first()
+    if claimed:
+        await bump_data_version(db, claimed.user_id)
+    await db.commit()
+    return claimed
+
+
+async def _save_extracted(db: AsyncSession, receipt_id: int, user_id: int, run: int, extracted_data: dict) -> bool:
+    """
+    Scrive il risultato dell'OCR in una transazione: UPDATE dello scontrino, DELETE delle voci
+    precedenti e INSERT multi-riga di quelle nuove. Rilanciarla sostituisce le voci invece di
+    accodarle. Se nel frattempo è partita un'esecuzione più recente (o lo scontrino è stato
+    cancellato) l'UPDATE non trova righe e non si scrive nulla. Restituisce True se ha scritto.
+    """
+    updated = (await db.execute(
+        update(Receipt)
+        .where(Receipt.id == receipt_id, Receipt.user_id == user_id, Receipt.ocr_run == run)
+        .values(
+            store_name=extracted_data.get("store_name"),
+            receipt_date=extracted_data.get("receipt_date"),
+            total_amount=extracted_data.get("total_amount", 0.0),
+            # --- SALVATAGGIO MULTI-VALUTA E NAZIONE ---
+            currency=extracted_data.get("currency", "USD"),
+            country=extracted_data.get("country", "Unknown"),
+            status=ReceiptStatus.COMPLETED,
+            updated_at=datetime.utcnow(),
+        )
+        .returning(Receipt.id)
+    )).first()
+    if not updated:
+        await db.rollback()
+        return False
+
+    await db.execute(delete(ExpenseItem).where(ExpenseItem.user_id == user_id, ExpenseItem.receipt_id == receipt_id))
+    rows = [
+        {
+            "receipt_id": receipt_id,
+            "user_id": user_id,
+            "description": item_data["description"],
+            "amount": item_data["amount"],
+            "category": item_data["category"],
+        }
+        for item_data in extracted_data.get("items", [])
+    ]
+    for start in range(0, len(rows), ITEM_INSERT_CHUNK):
+        await db.execute(insert(ExpenseItem).values(rows[start:start + ITEM_INSERT_CHUNK]))
+
+    # Statement set-based: niente flush, l'ETag della lista va invalidato a mano
+    await bump_data_version(db, user_id)
+    await db.commit()
+    return True
+
+
+async def _check_duplicate(db: AsyncSession, receipt_id: int, user_id: int, run: int, file_url: str, file_bytes: bytes) -> bool:
+    """
+    Calcola il dHash dai byte già scaricati, cerca un quasi-duplicato prima di pagare l'OCR e salva
+    hash e duplicate_of. Non dipende dai derivati, che girano in parallelo.
+    Restituisce True se l'OCR va saltato (DUPLICATE_SKIP_OCR): lo scontrino resta senza voci,
+    così la stessa spesa non viene contata due volte nelle analytics.
     """
+    if not supports_derivatives(file_url):
+        return False # PDF e formati che Pillow non apre: niente hash
     try:
+        image_hash = await compute_image_hash(file_bytes)
+        duplicate = await find_duplicate(db, receipt_id, user_id, image_hash)
+    except Exception:
+        # Il controllo è un risparmio, non un requisito: se fallisce l'OCR parte comunque
+        logger.warning("Duplicate lookup failed", extra={"receipt_id": receipt_id, "user_id": user_id}, exc_info=True)
+        await db.rollback()
+        return False
+
+    # L'hash va salvato anche senza duplicati: è contro di lui che si confrontano i prossimi upload
+    values = {"image_hash": to_db_hash(image_hash)}
+    if duplicate:
+        values["duplicate_of"] = duplicate["receipt_id"]
+        if DUPLICATE_SKIP_OCR:
+            values.update(status=ReceiptStatus.DUPLICATE, updated_at=datetime.utcnow())
+    result = await db.execute(
+        update(Receipt)
+        .where(Receipt.id == receipt_id, Receipt.user_id == user_id, Receipt.ocr_run == run)
+        .values(**values)
+    )
+    if duplicate:
+        await bump_data_version(db, user_id)
+    await db.commit()
+    if result.rowcount:
+        # Dopo il lookup: se l'albero è stato appena caricato dal DB, questo hash non c'era ancora
+        duplicate_index.remember(user_id, receipt_id, image_hash)
+    if not duplicate:
+        return False
+
+    logger.info("Likely duplicate receipt", extra={
+        "receipt_id": receipt_id, "user_id": user_id,
+        "duplicate_of": duplicate["receipt_id"], "distance": duplicate["distance"],
+    })
+    return DUPLICATE_SKIP_OCR
+
+
+async def _extract_and_save(receipt_id: int, file_url: str, db: AsyncSession, user_id: int | None):
+    # NB: dall'upload arriva la sessione della richiesta, già chiusa dalla dependency quando il task parte.
+    # Una AsyncSession chiusa si può riusare (prende una nuova connessione), ma qui non teniamo oggetti
+    # ORM tra un commit e l'altro: solo statement, così non dipendiamo dallo stato dell'identity map.
+    claimed = await _claim_ocr_run(db, receipt_id, user_id)
+    if not claimed:
+        return # Receipt was deleted before processing started
+    run, user_id = claimed
+
+    try:
+        # Un solo download: lo usano sia l'hash dei duplicati sia l'OCR
+        file_bytes = await asyncio.to_thread(download_file, file_url)
+        if await _check_duplicate(db, receipt_id, user_id, run, file_url, file_bytes):
+            ocr_jobs_total.inc(outcome="duplicate")
+            return
+
         # 1. Run the OCR extraction
-        extracted_data = await process_receipt_image(file_url)
-        
-        # 2. Fetch the pending receipt from the database
-        receipt = await db.get(Receipt, receipt_id)
-        if not receipt:
-            return # Receipt was deleted before processing finished
-        
-        # 3. Update metadata and change status to COMPLETED
-        receipt.store_name = extracted_data.get("store_name")
-        receipt.receipt_date = extracted_data.get("receipt_date")
-        receipt.total_amount = extracted_data.get("total_amount", 0.0)
-        
-        # --- SALVATAGGIO MULTI-VALUTA E NAZIONE ---
-        receipt.currency = extracted_data.get("currency", "USD")
-        receipt.country = extracted_data.get("country", "Unknown")
-        
-        receipt.status = ReceiptStatus.COMPLETED
-        
-        # 4. Create and attach the individual expense items
-        for item_data in extracted_data.get("items", []):
-            expense_item = ExpenseItem(
-                receipt_id=receipt.id,
-                description=item_data["description"],
-                amount=item_data["amount"],
-                category=item_data["category"]
-            )
-            db.add(expense_item)
-            
+        extracted_data = await process_receipt_image(file_url, user_id=user_id, file_bytes=file_bytes)
+
+        # 2. Scontrino, voci e versione dei dati in una sola transazione
+        if await _save_extracted(db, receipt_id, user_id, run, extracted_data):
+            ocr_jobs_total.inc(outcome="completed")
+        else:
+            ocr_jobs_total.inc(outcome="superseded")
+
+    except Exception:
+        logger.exception("Receipt processing failed", extra={"receipt_id": receipt_id, "user_id": user_id})
+        ocr_jobs_total.inc(outcome="failed")
+        await db.rollback()
+        # Solo se nessuna esecuzione più recente ha già preso in carico lo scontrino
+        await db.execute(
+            update(Receipt)
+            .where(Receipt.id == receipt_id, Receipt.user_id == user_id, Receipt.ocr_run == run)
+            .values(status=ReceiptStatus.FAILED, updated_at=datetime.utcnow())
+        )
+        await bump_data_version(db, user_id)
         await db.commit()
-        
-    except Exception as e:
-        print(f"Error processing receipt {receipt_id}: {e}")
-        receipt = await db.get(Receipt, receipt_id)
-        if receipt:
-            receipt.status = ReceiptStatus.FAILED
-            await db.commit()
+
+
+async def process_uploaded_receipt(receipt_id: int, file_url: str, db: AsyncSession, user_id: int):
+    """
+    Background task dell'upload: OCR e derivati in parallelo. I background task di Starlette girano
+    uno dopo l'altro, quindi in sequenza il resize ritarderebbe ogni risultato OCR (o viceversa le thumbnail).
+    Entrambi gestiscono i propri errori; il resize sta nel pool di processi e non tiene l'event loop.
+    """
+    await asyncio.gather(
+        extract_and_save_data(receipt_id, file_url, db, user_id),
+        generate_receipt_derivatives(receipt_id, file_url, user_id),
+    )
 
 
 @router.post("/upload", status_code=status.HTTP_202_ACCEPTED)
+@limiter.limit(UPLOAD_RATE_LIMIT, key_func=get_user_or_ip_key) # Ogni upload = storage + OCR
 async def upload_receipt(
+    request: Request, # <-- Richiesto da SlowAPI
+    response: Response,
     background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     db: AsyncSession = Depends(get_db_session),
@@ -89,8 +245,8 @@ async def upload_receipt(
     await db.commit()
     await db.refresh(new_receipt)
     
-    # 3. Hand off the heavy lifting to the background task
-    background_tasks.add_task(extract_and_save_data, new_receipt.id, file_url, db)
+    # 3. Hand off the heavy lifting to the background tasks.
+    background_tasks.add_task(process_uploaded_receipt, new_receipt.id, file_url, db, current_user.id)
     
     # 4. Return immediately! 
     return {
@@ -99,24 +255,40 @@ async def upload_receipt(
         "status": new_receipt.status
     }
 
-@router.get("")
+# Colonne nell'ordine dei campi dello schema: le righe diventano JSON senza passare dall'ORM
+RECEIPT_COLUMNS = tuple(getattr(Receipt, name) for name in RECEIPT_FIELDS)
+ITEM_COLUMNS = tuple(getattr(ExpenseItem, name) for name in ITEM_FIELDS)
+
+@router.get("", response_model=List[ReceiptResponse])
 async def get_all_receipts(
-    db: AsyncSession = Depends(get_db_session),
+    request: Request,
+    db: AsyncSession = Depends(get_read_db_session),
     current_user: User = Depends(get_current_user)
 ):
-    query = (
-        select(Receipt)
-        .where(Receipt.user_id == current_user.id) 
-        .options(selectinload(Receipt.items))
+    # Il poll della dashboard: se non è cambiato nulla rispondiamo 304 prima delle query vere
+    etag = await data_etag(request, db, current_user.id)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    # Tuple di colonne invece di oggetti Receipt + model_dump(): niente identity map,
+    # niente validazione, e orjson serializza datetime ed enum da solo
+    receipts_query = (
+        select(*RECEIPT_COLUMNS)
+        .where(Receipt.user_id == current_user.id)
         .order_by(Receipt.created_at.desc())
     )
-    result = await db.execute(query)
-    receipts = result.scalars().all()
-    
-    return [
-        {**r.model_dump(), "items": [i.model_dump() for i in r.items]}
-        for r in receipts
-    ]
+    # Gli item filtrati per user_id: niente IN (...) lungo quanto la lista degli scontrini,
+    # niente JOIN, e con le tabelle partizionate si legge una sola partizione
+    items_query = (
+        select(*ITEM_COLUMNS)
+        .where(ExpenseItem.user_id == current_user.id)
+        .order_by(ExpenseItem.id)
+    )
+    receipt_rows = (await db.execute(receipts_query)).tuples().all()
+    item_rows = (await db.execute(items_query)).tuples().all() if receipt_rows else []
+
+    # Response già pronta: FastAPI salta jsonable_encoder e la validazione del response_model
+    return ORJSONResponse(receipts_from_rows(receipt_rows, item_rows), headers=cache_headers(etag))
 
 @router.get("/{receipt_id}/download")
 async def get_receipt_download_url(
@@ -125,42 +297,64 @@ async def get_receipt_download_url(
     current_user: User = Depends(get_current_user) # <-- FIX SICUREZZA
 ):
     """Genera un link temporaneo Cloudflare R2 (S3v4) per visualizzare l'immagine originale."""
-    receipt = await db.get(Receipt, receipt_id)
+    # Filtro anche su user_id: proprietà verificata nella query e, se partizionata, una sola partizione
+    query = select(Receipt.file_url).where(Receipt.id == receipt_id, Receipt.user_id == current_user.id)
+    file_url = (await db.execute(query)).scalar_one_or_none()
     
     # Assicuriamoci che lo scontrino esista e appartenga all'utente loggato!
-    if not receipt or receipt.user_id != current_user.id:
+    if file_url is None:
         raise HTTPException(status_code=404, detail="Scontrino non trovato o accesso negato")
 
-    bucket_name = os.getenv("S3_BUCKET_NAME")
-    file_key = receipt.file_url.split(f"/{bucket_name}/")[-1]
+    # Client di firma condiviso: prima se ne creava uno nuovo a ogni richiesta
+    return {"url": generate_download_url(file_url)}
 
-    s3_client = boto3.client(
-        's3',
-        endpoint_url=os.getenv("S3_ENDPOINT_URL"),
-        aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-        aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
-        region_name="auto",
-        config=Config(signature_version='s3v4')
-    )
+# Varianti servibili -> colonna di Receipt che ne contiene l'URL
+IMAGE_VARIANTS = {"thumb": Receipt.thumbnail_url, "preview": Receipt.preview_url}
 
-    presigned_url = s3_client.generate_presigned_url(
-        'get_object',
-        Params={'Bucket': bucket_name, 'Key': file_key},
-        ExpiresIn=3600
-    )
-    
-    return {"url": presigned_url}
+@router.get("/{receipt_id}/image/{variant}")
+async def get_receipt_image(
+    receipt_id: int,
+    variant: str,
+    request: Request,
+    db: AsyncSession = Depends(get_read_db_session),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Thumbnail o preview WebP dello scontrino, passati dall'API (il bucket è privato) con cache di un anno:
+    la chiave di un derivato non cambia mai contenuto. 404 finché non è pronto: il client usa l'originale.
+    """
+    column = IMAGE_VARIANTS.get(variant)
+    if column is None:
+        raise HTTPException(status_code=404, detail="Unknown image variant")
+    query = select(column).where(Receipt.id == receipt_id, Receipt.user_id == current_user.id)
+    image_url = (await db.execute(query)).scalar_one_or_none()
+    if image_url is None:
+        raise HTTPException(status_code=404, detail="Image not available")
+
+    etag = f'"{image_url.rsplit("/", 1)[-1]}"' # Il nome del file basta: il contenuto non cambia
+    headers = {"Cache-Control": DERIVATIVE_RESPONSE_CACHE_CONTROL, "ETag": etag}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    content = await asyncio.to_thread(download_file, image_url)
+    return Response(content=content, media_type="image/webp", headers=headers)
 
 @router.get("/export")
 async def export_receipts_csv(
     current_user: User = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db_session)
+    db: AsyncSession = Depends(get_read_db_session)
 ):
     """Genera e scarica un file CSV con tutti gli scontrini dell'utente."""
     
-    query = select(Receipt).where(Receipt.user_id == current_user.id).order_by(Receipt.receipt_date.desc())
-    result = await db.execute(query)
-    receipts = result.scalars().all()
+    # Solo le colonne che finiscono nel CSV, come tuple
+    query = (
+        select(
+            Receipt.id, Receipt.store_name, Receipt.receipt_date, Receipt.country,
+            Receipt.currency, Receipt.total_amount, Receipt.status, Receipt.created_at,
+        )
+        .where(Receipt.user_id == current_user.id)
+        .order_by(Receipt.receipt_date.desc())
+    )
+    rows = (await db.execute(query)).tuples().all()
 
     stream = io.StringIO()
     writer = csv.writer(stream)
@@ -168,16 +362,16 @@ async def export_receipts_csv(
     # --- AGGIUNTE COLONNE MULTI-VALUTA AL CSV ---
     writer.writerow(["ID", "Store Name", "Date", "Country", "Currency", "Total Amount", "Status", "Uploaded At"])
 
-    for r in receipts:
+    for receipt_id, store_name, receipt_date, country, currency, total_amount, receipt_status, created_at in rows:
         writer.writerow([
-            r.id,
-            r.store_name or "N/A",
-            r.receipt_date.strftime("%Y-%m-%d") if r.receipt_date else "N/A",
-            r.country or "Unknown", # Nazione estrattata
-            r.currency or "USD",    # Valuta estratta
-            f"{r.total_amount:.2f}" if r.total_amount else "0.00",
-            r.status or "N/A",
-            r.created_at.strftime("%Y-%m-%d %H:%M:%S") if r.created_at else "N/A"
+            receipt_id,
+            store_name or "N/A",
+            receipt_date.strftime("%Y-%m-%d") if receipt_date else "N/A",
+            country or "Unknown", # Nazione estrattata
+            currency or "USD",    # Valuta estratta
+            f"{total_amount:.2f}" if total_amount else "0.00",
+            receipt_status or "N/A",
+            created_at.strftime("%Y-%m-%d %H:%M:%S") if created_at else "N/A"
         ])
 
     stream.seek(0)
@@ -185,4 +379,102 @@ async def export_receipts_csv(
     response = StreamingResponse(iter([stream.getvalue()]), media_type="text/csv")
     response.headers["Content-Disposition"] = "attachment; filename=spendscope_export.csv"
     
-    return response
\ No newline at end of file
+    return response
+
+def _archive_name(receipt_id: int, store_name: Optional[str], day: datetime, file_url: str) -> str:
+    """2025-03/2025-03-14_esselunga_1234.jpg: una cartella per mese, ordinabile per data."""
+    slug = re.sub(r"[^a-z0-9]+", "-", (store_name or "receipt").lower()).strip("-")[:40] or "receipt"
+    extension = file_url.rsplit(".", 1)[-1].lower() if "." in file_url.rsplit("/", 1)[-1] else "bin"
+    return f"{day:%Y-%m}/{day:%Y-%m-%d}_{slug}_{receipt_id}.{extension}"
+
+
+async def _stream_archive(rows):
+    """
+    Scarica gli originali con al più ARCHIVE_FETCH_CONCURRENCY download in volo, nell'ordine delle righe,
+    e scrive ogni voce appena il suo file è arrivato. Un file mancante nel bucket non interrompe
+    l'archivio: finisce nel manifest come "missing".
+    """
+    archive = ZipStream()
+    manifest = io.StringIO()
+    writer = csv.writer(manifest)
+    writer.writerow(["ID", "File", "Store Name", "Date", "Country", "Currency", "Total Amount", "Status", "Uploaded At", "Archive Status"])
+
+    async def fetch(file_url: str):
+        try:
+            return await asyncio.to_thread(download_file, file_url)
+        except Exception:
+            logger.warning("Archive: original not found", extra={"file_url": file_url}, exc_info=True)
+            return None
+
+    pending = deque()
+    rows = iter(rows)
+    for row in rows:
+        pending.append((row, asyncio.create_task(fetch(row.file_url))))
+        if len(pending) >= ARCHIVE_FETCH_CONCURRENCY:
+            break
+    try:
+        while pending:
+            row, task = pending.popleft()
+            next_row = next(rows, None)
+            if next_row is not None:
+                pending.append((next_row, asyncio.create_task(fetch(next_row.file_url))))
+
+            body = await task
+            day = row.day
+            name = _archive_name(row.id, row.store_name, day, row.file_url)
+            if body is not None:
+                yield await asyncio.to_thread(archive.add, name, body, day)
+            writer.writerow([
+                row.id, name if body is not None else "", row.store_name or "N/A", day.strftime("%Y-%m-%d"),
+                row.country or "Unknown", row.currency or "USD", f"{row.total_amount:.2f}" if row.total_amount else "0.00",
+                row.status.value if row.status else "N/A", row.created_at.strftime("%Y-%m-%d %H:%M:%S"),
+                "ok" if body is not None else "missing",
+            ])
+
+        yield await asyncio.to_thread(archive.add, "manifest.csv", manifest.getvalue().encode("utf-8"), None, True)
+        yield await asyncio.to_thread(archive.close)
+    finally:
+        # Client disconnesso a metà: niente download orfani
+        for _, task in pending:
+            task.cancel()
+
+
+@router.get("/archive")
+@limiter.limit(ARCHIVE_RATE_LIMIT, key_func=get_user_or_ip_key) # Ogni archivio = un GET sul bucket per scontrino
+async def export_receipts_archive(
+    request: Request,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    db: AsyncSession = Depends(get_read_db_session),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    ZIP degli originali (immagini e PDF) degli scontrini tra start ed end inclusi, con manifest.csv.
+    Data dello scontrino, o di upload se l'OCR non l'ha trovata. Lo ZIP è generato in streaming:
+    niente file temporanei e memoria costante anche per archivi di diversi GB.
+    """
+    if start and end and start > end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+
+    day = func.coalesce(Receipt.receipt_date, Receipt.created_at)
+    query = (
+        select(
+            Receipt.id, Receipt.file_url, Receipt.store_name, day.label("day"), Receipt.country,
+            Receipt.currency, Receipt.total_amount, Receipt.status, Receipt.created_at,
+        )
+        .where(Receipt.user_id == current_user.id, Receipt.file_url.not_like("import://%")) # Import CSV: nessun originale
+        .order_by(day, Receipt.id)
+    )
+    if start:
+        query = query.where(day >= datetime.combine(start, datetime.min.time()))
+    if end:
+        query = query.where(day < datetime.combine(end + timedelta(days=1), datetime.min.time()))
+    # Le righe si leggono tutte prima di rispondere: la sessione non resta aperta per tutto lo stream
+    rows = (await db.execute(query)).all()
+
+    label = f"{start or 'all'}_{end or 'all'}"
+    return StreamingResponse(
+        _stream_archive(rows),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename=spendscope_originals_{label}.zip"},
+    )
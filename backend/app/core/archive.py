@@ -0,0 +1,55 @@
+# app/core/archive.py
+"""
+ZIP scritto in streaming: zipfile scrive su un buffer che svuotiamo dopo ogni voce, quindi
+in memoria c'è al più una voce alla volta e i primi byte escono subito. Lo stream non è seekable:
+zipfile usa i data descriptor al posto di riscrivere gli header, e i record zip64 quando una voce
+o l'archivio superano i 4 GB.
+"""
+import zipfile
+from datetime import datetime
+from typing import List, Optional
+
+
+class _Sink:
+    """File solo in scrittura: niente tell()/seek(), così zipfile lo tratta come uno stream."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class ZipStream:
+    """
+    `add()` e `close()` restituiscono i byte pronti da spedire. Sono bloccanti (CRC e, per le
+    voci compresse, deflate): dal codice async si chiamano con asyncio.to_thread, una alla volta.
+    """
+
+    def __init__(self):
+        self._sink = _Sink()
+        self._zip = zipfile.ZipFile(self._sink, "w", allowZip64=True)
+
+    def add(self, name: str, data: bytes, modified: Optional[datetime] = None, compress: bool = False) -> bytes:
+        # Il formato ZIP non rappresenta date prima del 1980
+        modified = max(modified or datetime.utcnow(), datetime(1980, 1, 1))
+        info = zipfile.ZipInfo(name, date_time=modified.timetuple()[:6])
+        # Immagini e PDF sono già compressi: stored costa zero CPU e non perde nulla
+        info.compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+        info.external_attr = 0o644 << 16
+        self._zip.writestr(info, data)
+        return self._sink.drain()
+
+    def close(self) -> bytes:
+        """Central directory (ed end record zip64 se serve): l'ultimo pezzo dell'archivio."""
+        self._zip.close()
+        return self._sink.drain()
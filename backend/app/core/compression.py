@@ -0,0 +1,149 @@
+# app/core/compression.py
+"""
+Compressione negoziata delle risposte (Accept-Encoding): brotli se il pacchetto è installato
+e il client lo accetta, altrimenti gzip. Sotto COMPRESSION_MIN_SIZE il body esce così com'è:
+per poche centinaia di byte la CPU spesa vale più della banda risparmiata.
+"""
+import os
+import zlib
+from typing import Optional
+
+try:
+    import brotli # Opzionale: senza, si negozia solo gzip
+except ImportError:
+    brotli = None
+
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", 1024))
+# Livelli "da risposta dinamica": quasi tutto il guadagno a una frazione del costo dei massimi
+GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", 5))
+BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", 4))
+
+# Immagini, PDF e zip sono già compressi: li lasciamo stare
+COMPRESSIBLE_TYPES = ("application/json", "text/", "application/javascript", "application/xml", "image/svg+xml")
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """Sceglie "br" o "gzip" rispettando i q-value (q=0 significa "no"); None se nessuno va bene."""
+    accepted = {}
+    for part in accept_encoding.lower().split(","):
+        coding, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        if coding:
+            accepted[coding] = q
+    wildcard = accepted.get("*", 0.0)
+    candidates = (["br"] if brotli is not None else []) + ["gzip"]
+    scored = [(accepted.get(coding, wildcard), coding) for coding in candidates]
+    best_q, best = max(scored, key=lambda pair: pair[0]) # max stabile: a parità vince br
+    return best if best_q > 0 else None
+
+
+class _Compressor:
+    def __init__(self, encoding: str):
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=BROTLI_QUALITY)
+            self._zlib = None
+        else:
+            self._brotli = None
+            self._zlib = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31) # wbits 31 = header gzip
+
+    def compress(self, data: bytes) -> bytes:
+        return self._brotli.process(data) if self._brotli else self._zlib.compress(data)
+
+    def finish(self) -> bytes:
+        return self._brotli.finish() if self._brotli else self._zlib.flush()
+
+
+class CompressionMiddleware:
+    """
+    ASGI puro, come ObservabilityMiddleware. Body in un solo messaggio (il caso JSON): si decide
+    sulla dimensione reale. Body a pezzi (StreamingResponse, es. export CSV): si comprime
+    in streaming e si toglie Content-Length, che non sarebbe più vero.
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        accept_encoding = ""
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                accept_encoding = value.decode("latin-1")
+                break
+        encoding = negotiate_encoding(accept_encoding) if accept_encoding else None
+        if encoding is None:
+            return await self.app(scope, receive, send)
+
+        start_message = None
+        compressor: Optional[_Compressor] = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start_message, compressor, passthrough
+            if passthrough:
+                return await send(message)
+
+            if message["type"] == "http.response.start":
+                headers = {name.lower(): value for name, value in message.get("headers", [])}
+                content_type = headers.get(b"content-type", b"").decode("latin-1")
+                if (
+                    message["status"] in (204, 304)
+                    or b"content-encoding" in headers
+                    or not content_type.startswith(COMPRESSIBLE_TYPES)
+                ):
+                    passthrough = True
+                    return await send(message)
+                start_message = message # Aspettiamo il primo chunk per decidere
+                return
+
+            if message["type"] != "http.response.body":
+                return await send(message)
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if compressor is None:
+                if not more_body and len(body) < self.minimum_size:
+                    start_message["headers"] = _with_vary(start_message.get("headers", []))
+                    passthrough = True
+                    await send(start_message)
+                    return await send(message)
+                compressor = _Compressor(encoding)
+                payload = compressor.compress(body)
+                if not more_body:
+                    payload += compressor.finish()
+                start_message["headers"] = _compressed_headers(
+                    start_message.get("headers", []), encoding, None if more_body else len(payload)
+                )
+                await send(start_message)
+                return await send({"type": "http.response.body", "body": payload, "more_body": more_body})
+
+            payload = compressor.compress(body)
+            if not more_body:
+                payload += compressor.finish()
+            await send({"type": "http.response.body", "body": payload, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
+
+
+def _with_vary(headers):
+    # Le cache devono tenere versioni diverse per Accept-Encoding diversi
+    vary = [value for name, value in headers if name.lower() == b"vary"]
+    if any(b"accept-encoding" in value.lower() for value in vary):
+        return list(headers)
+    return [*headers, (b"vary", b"Accept-Encoding")]
+
+
+def _compressed_headers(headers, encoding: str, content_length: Optional[int]):
+    headers = [(name, value) for name, value in _with_vary(headers) if name.lower() != b"content-length"]
+    headers.append((b"content-encoding", encoding.encode()))
+    if content_length is not None:
+        headers.append((b"content-length", str(content_length).encode()))
+    return headers
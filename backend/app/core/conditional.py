@@ -0,0 +1,81 @@
+# app/core/conditional.py
+"""
+GET condizionali per gli endpoint di lettura (ETag / If-None-Match -> 304).
+
+L'ETag non è un hash del body: nasce da users.data_version, che sale a ogni flush che tocca
+scontrini, item o chat dell'utente. Verificarlo costa una lettura per chiave primaria, quindi
+il polling della dashboard riceve un 304 senza rieseguire la query principale.
+"""
+import hashlib
+import os
+from itertools import chain
+
+from fastapi import Request, Response
+from sqlalchemy import event, or_, select, update
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.db.models import ChatMessage, ChatSession, ExpenseItem, Receipt, User
+
+# Da cambiare quando cambia il formato di una risposta: invalida gli ETag già nelle cache dei browser
+ETAG_SALT = os.getenv("ETAG_SALT", "1")
+# no-cache = "puoi tenerla, ma chiedi sempre": ogni poll diventa una richiesta condizionale
+CACHE_CONTROL = "private, no-cache"
+
+
+def _bump_data_versions(session, flush_context):
+    # In after_flush new/dirty/deleted mostrano ancora lo stato prima del flush
+    user_ids, chat_session_ids = set(), set()
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, (Receipt, ExpenseItem, ChatSession)):
+            user_ids.add(obj.user_id)
+        elif isinstance(obj, ChatMessage):
+            chat_session_ids.add(obj.session_id)
+
+    conditions = []
+    if user_ids:
+        conditions.append(User.id.in_(user_ids))
+    if chat_session_ids:
+        conditions.append(User.id.in_(select(ChatSession.user_id).where(ChatSession.id.in_(chat_session_ids))))
+    if conditions:
+        # Stessa transazione della scrittura: versione e dati diventano visibili insieme
+        session.connection().execute(
+            update(User).where(or_(*conditions)).values(data_version=User.data_version + 1)
+        )
+
+
+# Le DELETE/UPDATE set-based non passano dal flush: chi le usa chiama bump_data_version
+event.listen(AsyncSession.sync_session_class, "after_flush", _bump_data_versions)
+
+
+async def bump_data_version(db: AsyncSession, user_id: int):
+    await db.execute(update(User).where(User.id == user_id).values(data_version=User.data_version + 1))
+
+
+async def data_etag(request: Request, db: AsyncSession, user_id: int) -> str:
+    """
+    ETag debole per (utente, versione dei dati, path + query). Va letto PRIMA della query principale:
+    se nel frattempo arriva una scrittura il body è più nuovo dell'ETag, e il poll successivo
+    riceve comunque un 200. Il contrario (ETag più nuovo del body) non può succedere.
+    """
+    version = (await db.execute(select(User.data_version).where(User.id == user_id))).scalar_one_or_none() or 0
+    key = f"{ETAG_SALT}|{user_id}|{version}|{request.url.path}|{request.url.query}"
+    return f'W/"{version}-{hashlib.blake2b(key.encode(), digest_size=8).hexdigest()}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # Confronto debole: la compressione cambia i byte, non il contenuto
+    candidates = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return etag.removeprefix("W/") in candidates
+
+
+def cache_headers(etag: str) -> dict:
+    return {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers=cache_headers(etag))
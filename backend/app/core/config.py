@@ -1,6 +1,13 @@
 # app/core/config.py
+from typing import Optional
+
+from dotenv import load_dotenv
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
+# Unico caricamento del .env per tutto il processo: i moduli che leggono os.getenv
+# all'import lo trovano già in os.environ perché app.db.database importa questo modulo per primo.
+load_dotenv()
+
 class Settings(BaseSettings):
     """
     Validates and loads environment variables.
@@ -13,8 +20,33 @@ class Settings(BaseSettings):
     AWS_ACCESS_KEY_ID: str
     AWS_SECRET_ACCESS_KEY: str
 
+    # --- Pool di connessioni del primario ---
+    # Con N worker uvicorn le connessioni massime sono N * (DB_POOL_SIZE + DB_MAX_OVERFLOW):
+    # devono stare sotto max_connections del database (o del pooler, es. PgBouncer/Neon).
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30.0   # Secondi di attesa per una connessione libera prima dell'errore
+    DB_POOL_RECYCLE: int = 300      # Ricrea le connessioni più vecchie di così (proxy che chiudono gli idle)
+    DB_POOL_PRE_PING: bool = True
+    DB_ECHO: bool = False
+
+    # --- Replica di sola lettura (opzionale) ---
+    # Se impostata, le GET "pesanti" (lista scontrini, analytics, storico chat, export) leggono da qui.
+    DATABASE_READ_URL: Optional[str] = None
+    DB_READ_POOL_SIZE: int = 5
+    DB_READ_MAX_OVERFLOW: int = 10
+    # Dopo una scrittura, per quanti secondi le letture dello stesso utente restano sul primario
+    # (la replica è asincrona: senza questa finestra l'utente potrebbe non vedere i propri dati)
+    READ_YOUR_WRITES_SECONDS: float = 5.0
+
+    # --- Avvio ---
+    # Connessioni aperte in anticipo nel lifespan (per pool), così le prime richieste non pagano l'handshake
+    DB_POOL_WARMUP: int = 2
+    # Timeout del ping al DB usato da /readyz
+    READINESS_DB_TIMEOUT: float = 2.0
+
     # Tells Pydantic to read from the .env file
-    model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8")
+    model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8", extra="ignore")
 
 # Create a global instance to use throughout the app
-settings = Settings()
\ No newline at end of file
+settings = Settings()
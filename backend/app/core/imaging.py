@@ -0,0 +1,86 @@
+# app/core/imaging.py
+"""
+Rendering dei derivati WebP di uno scontrino e del suo hash percettivo. Gira nei processi del pool di
+app.services.derivatives: qui solo Pillow, niente import dell'app (il worker parte con spawn).
+"""
+import io
+import os
+from typing import Dict, Tuple
+
+# Nome -> (lato lungo in px, qualità WebP)
+DERIVATIVE_SIZES: Dict[str, Tuple[int, int]] = {
+    "thumb": (int(os.getenv("THUMBNAIL_SIZE", 320)), int(os.getenv("THUMBNAIL_QUALITY", 70))),
+    "preview": (int(os.getenv("PREVIEW_SIZE", 1280)), int(os.getenv("PREVIEW_QUALITY", 80))),
+}
+# dHash 8x8 = 64 bit: sta in un BIGINT ed è robusto a resize, ricompressione e piccoli cambi di luce
+HASH_SIZE = 8
+# Foto da 50 MP sono già tante; oltre è più probabile un file malevolo (decompression bomb)
+MAX_IMAGE_PIXELS = int(os.getenv("DERIVATIVE_MAX_PIXELS", 60_000_000))
+
+
+def difference_hash(image) -> int:
+    """dHash: per ogni riga, 1 se un pixel è più chiaro del vicino a destra. Due foto dello stesso foglio distano pochi bit."""
+    from PIL import Image
+
+    small = image.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(HASH_SIZE):
+        for col in range(HASH_SIZE):
+            left = pixels[row * (HASH_SIZE + 1) + col]
+            value = (value << 1) | (left > pixels[row * (HASH_SIZE + 1) + col + 1])
+    return value
+
+
+def _open_oriented(original, largest: int):
+    """Decodifica (ridotta se JPEG), rotazione EXIF e modo colore: il punto di partenza di derivati e hash."""
+    from PIL import ImageOps
+
+    # JPEG: decodifica direttamente a 1/2, 1/4 o 1/8 se basta per il derivato più grande
+    original.draft("RGB", (largest, largest))
+    image = ImageOps.exif_transpose(original) # Le foto da telefono arrivano ruotate via EXIF
+    has_alpha = "A" in image.getbands() or "transparency" in image.info
+    return image.convert("RGBA" if has_alpha else "RGB")
+
+
+def _by_size_desc():
+    # Dal più grande al più piccolo: ogni riduzione parte dalla precedente, non dall'originale
+    return sorted(DERIVATIVE_SIZES.items(), key=lambda item: -item[1][0])
+
+
+def render_derivatives(data: bytes) -> Tuple[Dict[str, bytes], int]:
+    """
+    Originale (JPEG, PNG, WebP...) -> ({nome: bytes WebP}, dHash a 64 bit senza segno).
+    Solleva se Pillow non sa aprirlo.
+    """
+    from PIL import Image
+
+    Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+    largest = max(edge for edge, _ in DERIVATIVE_SIZES.values())
+    rendered = {}
+    with Image.open(io.BytesIO(data)) as original:
+        image = _open_oriented(original, largest)
+        for name, (edge, quality) in _by_size_desc():
+            image.thumbnail((edge, edge), Image.Resampling.LANCZOS)
+            buffer = io.BytesIO()
+            image.save(buffer, "WEBP", quality=quality, method=4)
+            rendered[name] = buffer.getvalue()
+        # Dal derivato più piccolo, già in memoria: costa meno di un millisecondo
+        image_hash = difference_hash(image)
+    return rendered, image_hash
+
+
+def perceptual_hash(data: bytes) -> int:
+    """
+    Solo il dHash, senza codificare i WebP: lo usa l'OCR per cercare i duplicati senza aspettare
+    i derivati. Stesse riduzioni di render_derivatives, quindi lo stesso hash bit per bit.
+    """
+    from PIL import Image
+
+    Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+    largest = max(edge for edge, _ in DERIVATIVE_SIZES.values())
+    with Image.open(io.BytesIO(data)) as original:
+        image = _open_oriented(original, largest)
+        for _, (edge, _quality) in _by_size_desc():
+            image.thumbnail((edge, edge), Image.Resampling.LANCZOS)
+        return difference_hash(image)
@@ -0,0 +1,166 @@
+# app/core/instrumentation.py
+"""
+Aggancia metriche e tracing ai punti caldi senza toccare gli endpoint:
+- ObservabilityMiddleware: latenza per route, richieste in corso, span SERVER per richiesta,
+  statement SQL per richiesta e N+1 (app.core.query_stats), Server-Timing in sviluppo
+- instrument_engine: durata di ogni statement SQL (+ span se l'export è attivo)
+- instrument_s3_client: latenza delle chiamate boto3 tramite il suo sistema di eventi
+"""
+import time
+
+from sqlalchemy import event
+
+from app.core import query_stats, tracing
+from app.core.metrics import (
+    http_request_duration, http_requests_in_flight, db_query_duration, s3_request_duration,
+    db_pool_size, db_pool_checked_out, db_pool_overflow,
+)
+
+
+class ObservabilityMiddleware:
+    """
+    ASGI puro: niente task aggiuntivi per richiesta. Latenza e span si chiudono quando parte
+    l'ultimo chunk del body, quindi i background task (es. OCR) non gonfiano la latenza della route;
+    restano però nel contesto della richiesta e i loro span diventano figli di quello della richiesta.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope["headers"])
+        request_span = tracing.start_span(
+            f"{scope['method']} {scope['path']}",
+            kind=tracing.KIND_SERVER,
+            traceparent=headers.get(b"traceparent", b"").decode(),
+            **{"http.method": scope["method"], "http.target": scope["path"]},
+        )
+        token = tracing.activate(request_span)
+        started = time.perf_counter()
+        status_code = 500
+        finished = False
+        http_requests_in_flight.inc()
+        stats = query_stats.QueryStats()
+        stats_token = query_stats.activate(stats)
+
+        def finish():
+            nonlocal finished
+            if finished:
+                return
+            finished = True
+            http_requests_in_flight.dec()
+            # Il template ("/receipts/{receipt_id}/download") e non il path: cardinalità limitata
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            http_request_duration.observe(
+                time.perf_counter() - started, method=scope["method"], route=route, status=str(status_code)
+            )
+            request_span.name = f"{scope['method']} {route}"
+            request_span.set_attribute("http.route", route)
+            request_span.set_attribute("http.status_code", status_code)
+            request_span.set_attribute("db.queries", stats.count)
+            request_span.set_attribute("db.time_ms", round(stats.seconds * 1000, 1))
+            request_span.end()
+            query_stats.report(route, stats)
+
+        async def send_and_observe(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = [*message["headers"], (b"traceparent", request_span.traceparent.encode())]
+                if query_stats.SERVER_TIMING:
+                    timing = f"{stats.server_timing()}, app;dur={(time.perf_counter() - started) * 1000:.1f}"
+                    message["headers"].append((b"server-timing", timing.encode()))
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body"):
+                finish()
+
+        try:
+            await self.app(scope, receive, send_and_observe)
+        except BaseException as e:
+            request_span.record_error(e)
+            raise
+        finally:
+            finish()
+            query_stats.deactivate(stats_token)
+            tracing.deactivate(token)
+
+
+def instrument_engine(async_engine, pool_name: str = "primary"):
+    sync_engine = async_engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        if context is None:
+            return
+        context._spendscope_started = time.perf_counter()
+        if tracing.exporter.enabled:
+            context._spendscope_span = tracing.start_span(
+                "db.query", kind=tracing.KIND_CLIENT,
+                **{"db.system": "postgresql", "db.pool": pool_name, "db.statement": statement[:500]},
+            )
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        if context is None:
+            return
+        started = getattr(context, "_spendscope_started", None)
+        if started is not None:
+            elapsed = time.perf_counter() - started
+            db_query_duration.observe(elapsed, pool=pool_name, operation=_operation(statement))
+            query_stats.record(statement, elapsed)
+        query_span = getattr(context, "_spendscope_span", None)
+        if query_span is not None:
+            query_span.end()
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _error(exception_context):
+        query_span = getattr(exception_context.execution_context, "_spendscope_span", None)
+        if query_span is not None:
+            query_span.record_error(exception_context.original_exception)
+            query_span.end()
+
+    pool = sync_engine.pool
+    db_pool_size.add_callback(lambda: pool.size(), pool=pool_name)
+    db_pool_checked_out.add_callback(lambda: pool.checkedout(), pool=pool_name)
+    # QueuePool.overflow() parte da -pool_size: sotto zero significa "nessuna connessione extra"
+    db_pool_overflow.add_callback(lambda: max(0, pool.overflow()), pool=pool_name)
+
+
+def _operation(statement: str) -> str:
+    head = statement.lstrip().split(None, 1)
+    operation = head[0].upper() if head else "UNKNOWN"
+    return operation if operation in {"SELECT", "INSERT", "UPDATE", "DELETE", "WITH"} else "OTHER"
+
+
+def instrument_s3_client(client):
+    """Registra latenza ed esito di ogni chiamata S3 fatta con `client` (anche dai worker thread)."""
+
+    def _before_call(model, context, **kwargs):
+        context["spendscope_started"] = time.perf_counter()
+        context["spendscope_span"] = tracing.start_span(
+            f"s3.{model.name}", kind=tracing.KIND_CLIENT, **{"rpc.service": "s3", "rpc.method": model.name}
+        )
+
+    def _after_call(model, context, http_response=None, **kwargs):
+        started = context.pop("spendscope_started", None)
+        if started is None:
+            return
+        ok = http_response is not None and http_response.status_code < 400
+        s3_request_duration.observe(time.perf_counter() - started, operation=model.name, outcome="ok" if ok else "error")
+        call_span = context.pop("spendscope_span", None)
+        if call_span is not None:
+            if not ok:
+                call_span.error = f"HTTP {getattr(http_response, 'status_code', 'error')}"
+            call_span.end()
+
+    def _after_call_error(model, context, exception=None, **kwargs):
+        _after_call(model, context)
+
+    client.meta.events.register("before-call.s3", _before_call)
+    client.meta.events.register("after-call.s3", _after_call)
+    client.meta.events.register("after-call-error.s3", _after_call_error)
+    return client
@@ -1,6 +1,39 @@
 # app/core/limiter.py
+import os
+import jwt
+from fastapi import Request
 from slowapi import Limiter
 from slowapi.util import get_remote_address
 
-# Questo limiter usa l'indirizzo IP dell'utente per contare le sue richieste
-limiter = Limiter(key_func=get_remote_address)
\ No newline at end of file
+# Storage condiviso tra tutti i worker/nodi, es: redis://localhost:6379/0
+# (o qualunque server compatibile: Valkey, KeyDB, Dragonfly...). Senza variabile si resta
+# in memoria, che va bene solo con un singolo processo (sviluppo locale, test).
+RATE_LIMIT_STORAGE_URI = os.getenv("RATE_LIMIT_STORAGE_URI", "memory://")
+
+def get_user_or_ip_key(request: Request) -> str:
+    """
+    Chiave per utente quando la richiesta ha un access token valido, altrimenti per IP.
+    Decodifichiamo solo il JWT (niente DB): l'autenticazione vera la fa get_current_user.
+    """
+    auth_header = request.headers.get("authorization", "")
+    if auth_header.lower().startswith("bearer "):
+        try:
+            payload = jwt.decode(auth_header[7:], os.getenv("SECRET_KEY"), algorithms=["HS256"])
+            if payload.get("sub"):
+                return f"user:{payload['sub']}"
+        except jwt.InvalidTokenError:
+            pass
+    return f"ip:{get_remote_address(request)}"
+
+# Questo limiter usa l'indirizzo IP dell'utente per contare le sue richieste (per default).
+# - moving-window: finestra scorrevole vera, niente raffiche doppie a cavallo del minuto
+# - headers_enabled: X-RateLimit-* e Retry-After su ogni risposta limitata
+# - in_memory_fallback: se lo storage condiviso cade, ogni worker continua a limitare da solo
+limiter = Limiter(
+    key_func=get_remote_address,
+    storage_uri=RATE_LIMIT_STORAGE_URI,
+    strategy="moving-window",
+    headers_enabled=True,
+    in_memory_fallback_enabled=RATE_LIMIT_STORAGE_URI != "memory://",
+    key_prefix="spendscope",
+)
@@ -0,0 +1,74 @@
+# app/core/log.py
+"""
+Log strutturati: una riga JSON per evento, con trace_id/span_id dello span corrente.
+I campi extra si passano con `logger.info("msg", extra={"receipt_id": 42})`.
+LOG_FORMAT=text per una console leggibile in sviluppo.
+"""
+import json
+import logging
+import os
+import sys
+from datetime import datetime, timezone
+
+from app.core.tracing import current_span
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+
+# Attributi standard di LogRecord: tutto il resto arriva da `extra`
+_RESERVED = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "trace_id", "span_id"}
+
+
+class _TraceContextFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        current = current_span()
+        record.trace_id = current.trace_id if current else None
+        record.span_id = current.span_id if current else None
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.trace_id:
+            entry["trace_id"] = record.trace_id
+            entry["span_id"] = record.span_id
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        extras = " ".join(
+            f"{key}={value}" for key, value in record.__dict__.items()
+            if key not in _RESERVED and not key.startswith("_")
+        )
+        trace = f" [{record.trace_id[:8]}]" if record.trace_id else ""
+        line = f"{record.levelname:<7}{trace} {record.name}: {record.getMessage()}"
+        if extras:
+            line += f"  {extras}"
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+def configure_logging():
+    """Configura il logger root una volta sola (chiamata all'import di app.main)."""
+    root = logging.getLogger()
+    if any(getattr(handler, "_spendscope", False) for handler in root.handlers):
+        return
+    handler = logging.StreamHandler(sys.stdout)
+    handler._spendscope = True
+    handler.addFilter(_TraceContextFilter())
+    handler.setFormatter(TextFormatter() if LOG_FORMAT == "text" else JsonFormatter())
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
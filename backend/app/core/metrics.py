@@ -0,0 +1,209 @@
+# app/core/metrics.py
+"""
+Metriche di processo in formato testo Prometheus (esposte da GET /metrics).
+Niente librerie esterne: contatori e istogrammi sono dizionari in memoria, un'osservazione
+costa un bisect e due somme. Con più worker ogni processo espone i propri valori.
+"""
+import bisect
+import math
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Secondi, pensati per richieste HTTP e query: da 5 ms a 30 s
+DEFAULT_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+# Le chiamate al modello stanno tra mezzo secondo e un minuto
+MODEL_BUCKETS = [0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0, 64.0]
+# Statement SQL per richiesta: una route sana ne fa pochi, un N+1 ne fa decine
+QUERY_COUNT_BUCKETS = [1, 2, 3, 5, 8, 13, 21, 34, 55, 89]
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = labels
+        registry.register(self)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+            for key, value in sorted(self._values.copy().items())
+        ]
+
+
+class Gauge(_Metric):
+    """Valore impostato a mano (inc/dec/set) oppure letto al momento dello scrape da `callback`."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, callback: Optional[Callable[[], float]] = None):
+        super().__init__(name, help_text)
+        self._value = 0.0
+        self._callback = callback
+
+    def inc(self, amount: float = 1.0):
+        self._value += amount
+
+    def dec(self, amount: float = 1.0):
+        self._value -= amount
+
+    def set(self, value: float):
+        self._value = value
+
+    def render(self) -> List[str]:
+        value = self._value
+        if self._callback is not None:
+            try:
+                value = self._callback()
+            except Exception:
+                return [] # Sorgente non ancora pronta (es. pool non creato): meglio nessun valore che uno falso
+        return [f"{self.name} {_format_value(value)}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (), buckets: List[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = sorted(buckets)
+        # Per ogni combinazione di label: [conteggi per bucket..., +Inf], somma
+        self._series: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = ([0] * (len(self.buckets) + 1), [0.0])
+        counts, total = series
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    def render(self) -> List[str]:
+        lines = []
+        for key, (counts, total) in sorted(self._series.copy().items()):
+            running = 0
+            for bound, n in zip([*self.buckets, math.inf], counts):
+                running += n
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {running}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(round(total[0], 6))}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {running}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric):
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.header())
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+class CallbackGauge(_Metric):
+    """Gauge con label, una callback per serie (es. una per pool di connessioni)."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...]):
+        super().__init__(name, help_text, labels)
+        self._callbacks: Dict[LabelValues, Callable[[], float]] = {}
+
+    def add_callback(self, callback: Callable[[], float], **labels):
+        self._callbacks[self._key(labels)] = callback
+
+    def render(self) -> List[str]:
+        lines = []
+        for key, callback in sorted(self._callbacks.items()):
+            try:
+                value = callback()
+            except Exception:
+                continue
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}")
+        return lines
+
+
+# --- METRICHE DELL'APPLICAZIONE ---
+
+http_request_duration = Histogram(
+    "spendscope_http_request_duration_seconds", "HTTP request latency until the last body byte is sent",
+    labels=("method", "route", "status"),
+)
+http_requests_in_flight = Gauge("spendscope_http_requests_in_flight", "HTTP requests currently being served")
+
+db_query_duration = Histogram(
+    "spendscope_db_query_duration_seconds", "SQL statement execution time", labels=("pool", "operation"),
+)
+db_queries_per_request = Histogram(
+    "spendscope_db_queries_per_request", "SQL statements issued while serving one request",
+    labels=("route",), buckets=QUERY_COUNT_BUCKETS,
+)
+db_repeated_queries_total = Counter(
+    "spendscope_db_repeated_queries_total", "Requests that repeated the same statement shape (possible N+1)",
+    labels=("route",),
+)
+db_pool_size = CallbackGauge("spendscope_db_pool_size", "Connections kept open by the pool", labels=("pool",))
+db_pool_checked_out = CallbackGauge("spendscope_db_pool_checked_out", "Connections currently in use", labels=("pool",))
+db_pool_overflow = CallbackGauge("spendscope_db_pool_overflow", "Connections opened beyond pool_size", labels=("pool",))
+
+s3_request_duration = Histogram(
+    "spendscope_s3_request_duration_seconds", "Object storage API call latency", labels=("operation", "outcome"),
+)
+
+model_request_duration = Histogram(
+    "spendscope_model_request_duration_seconds", "Gemini call latency (one observation per attempt)",
+    labels=("call_type", "model", "outcome"), buckets=MODEL_BUCKETS,
+)
+
+ocr_jobs_in_progress = Gauge("spendscope_ocr_jobs_in_progress", "Receipts currently going through OCR")
+ocr_jobs_total = Counter("spendscope_ocr_jobs_total", "Finished OCR jobs", labels=("outcome",))
+
+
+def register_gauge(name: str, help_text: str, callback: Callable[[], float]) -> Gauge:
+    """Gauge letta allo scrape: per valori che vivono altrove (pool del DB, code, governatore)."""
+    return Gauge(name, help_text, callback=callback)
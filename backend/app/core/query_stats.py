@@ -0,0 +1,118 @@
+# app/core/query_stats.py
+"""
+Conteggio degli statement SQL per richiesta. instrument_engine chiama record() dopo ogni
+statement; ObservabilityMiddleware apre un QueryStats per richiesta (ContextVar, come lo span
+corrente: i greenlet di SQLAlchemy la vedono) e alla fine:
+- osserva spendscope_db_queries_per_request per route,
+- segnala gli statement ripetuti con la stessa forma (il classico N+1: una query per riga),
+- con SERVER_TIMING=true aggiunge l'header Server-Timing (DevTools > Network > Timing).
+
+Server-Timing rivela tempi interni: va acceso solo in sviluppo. I test usano app.testing.
+"""
+import logging
+import os
+import re
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, List, Optional, Tuple
+
+from app.core.metrics import db_queries_per_request, db_repeated_queries_total
+
+logger = logging.getLogger(__name__)
+
+SERVER_TIMING = os.getenv("SERVER_TIMING", "false").lower() == "true"
+# Stessa forma di statement ripetuta almeno tante volte in una richiesta = probabile N+1
+QUERY_REPEAT_THRESHOLD = int(os.getenv("QUERY_REPEAT_THRESHOLD", 5))
+
+_current: ContextVar[Optional["QueryStats"]] = ContextVar("spendscope_query_stats", default=None)
+# Chiamati a fine richiesta con (route, stats): li usa app.testing, da qualunque thread giri l'app
+_observers: List[Callable[[str, "QueryStats"], None]] = []
+
+_WHITESPACE = re.compile(r"\s+")
+# Parametri asyncpg ($1, $2::INTEGER) e psycopg (%(name)s), e numeri letterali
+_PARAM = re.compile(r"\$\d+(?:::\w+(?:\[\])?)?|%\(\w+\)s|\b\d+\b")
+# IN (?, ?, ...) cambia lunghezza con i dati ma è lo stesso statement
+_PARAM_LIST = re.compile(r"\(\?(?:, ?\?)*\)")
+
+
+def statement_shape(statement: str) -> str:
+    """Statement senza parametri, liste IN e spazi: due esecuzioni della stessa query hanno la stessa forma."""
+    shape = _PARAM.sub("?", _WHITESPACE.sub(" ", statement).strip())
+    return _PARAM_LIST.sub("(...)", shape)
+
+
+class QueryStats:
+    __slots__ = ("count", "seconds", "shapes", "closed")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.shapes: Counter = Counter()
+        # Dopo la risposta i background task (OCR, derivati) girano ancora nello stesso contesto:
+        # le loro query non appartengono alla richiesta
+        self.closed = False
+
+    def record(self, statement: str, seconds: float):
+        self.count += 1
+        self.seconds += seconds
+        self.shapes[statement_shape(statement)] += 1
+
+    def repeated(self, threshold: int = QUERY_REPEAT_THRESHOLD) -> List[Tuple[str, int]]:
+        """[(forma, esecuzioni)] delle forme eseguite almeno `threshold` volte, dalla più ripetuta."""
+        return [(shape, n) for shape, n in self.shapes.most_common() if n >= threshold]
+
+    def server_timing(self) -> str:
+        return f'db;dur={self.seconds * 1000:.1f};desc="{self.count} queries"'
+
+
+def record(statement: str, seconds: float):
+    stats = _current.get()
+    if stats is not None and not stats.closed:
+        stats.record(statement, seconds)
+
+
+def activate(stats: QueryStats):
+    """Rende `stats` il contatore corrente; restituisce il token per deactivate."""
+    return _current.set(stats)
+
+
+def deactivate(token):
+    _current.reset(token)
+
+
+@contextmanager
+def collect():
+    """`with collect() as stats:` conta gli statement eseguiti nel blocco (e nei task che ne ereditano il contesto)."""
+    stats = QueryStats()
+    token = activate(stats)
+    try:
+        yield stats
+    finally:
+        stats.closed = True
+        deactivate(token)
+
+
+def add_observer(callback: Callable[[str, QueryStats], None]):
+    _observers.append(callback)
+
+
+def remove_observer(callback: Callable[[str, QueryStats], None]):
+    if callback in _observers:
+        _observers.remove(callback)
+
+
+def report(route: str, stats: QueryStats):
+    """Fine richiesta: metriche, avviso N+1 e osservatori (test). Da qui in poi stats non conta più."""
+    stats.closed = True
+    db_queries_per_request.observe(stats.count, route=route)
+    repeated = stats.repeated()
+    if repeated:
+        db_repeated_queries_total.inc(route=route)
+        shape, times = repeated[0]
+        logger.warning(
+            "Repeated SQL statement (possible N+1)",
+            extra={"route": route, "times": times, "queries": stats.count, "statement": shape[:300]},
+        )
+    for callback in list(_observers):
+        callback(route, stats)
@@ -0,0 +1,262 @@
+# app/core/receipt_text.py
+"""
+OCR locale (Tesseract) e parser a regole per scontrini stampati. Gira nei processi del pool di
+app.services.local_ocr: qui solo Pillow, pytesseract e stdlib, niente import dell'app (spawn).
+
+Il risultato ha la stessa forma di app.services.ocr.ReceiptData, più un punteggio di confidenza
+in [0, 1]: chi chiama decide se fidarsi o passare a Gemini.
+"""
+import io
+import os
+import re
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+LOCAL_OCR_LANG = os.getenv("LOCAL_OCR_LANG", "ita+eng")
+# Binario di Tesseract se non è nel PATH (es. /usr/local/bin/tesseract)
+TESSERACT_CMD = os.getenv("TESSERACT_CMD", "tesseract")
+# Tesseract legge bene attorno ai 300 DPI: le foto con il lato corto sotto questa soglia vengono ingrandite
+LOCAL_OCR_MIN_WIDTH = int(os.getenv("LOCAL_OCR_MIN_WIDTH", 1000))
+# Stesse tolleranze di app.services.model_router.validate_receipt
+TOTAL_TOLERANCE_ABS = 0.05
+TOTAL_TOLERANCE_REL = 0.02
+
+# Importo in fondo alla riga: 1.234,56 / 1,234.56 / 12,50 / -3.00, con eventuale simbolo di valuta
+_AMOUNT = re.compile(r"(-)?\s*[€$£]?\s*(\d{1,3}(?:[.,']\d{3})+|\d+)[.,](\d{2})\s*[€$£]?\s*[A-Z]?\s*$")
+# ISO (anno davanti) non è mai ambigua; nn/nn/aaaa e nn/nn/aa possono essere giorno/mese o mese/giorno
+_ISO_DATE = re.compile(r"\b(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})\b")
+_SHORT_DATES = (
+    re.compile(r"\b(\d{1,2})[-/.](\d{1,2})[-/.](\d{4})\b"),
+    re.compile(r"\b(\d{1,2})[-/.](\d{1,2})[-/.](\d{2})\b"),
+)
+_TOTAL = re.compile(r"\b(totale|total|tot\.?|importo pagato|amount due|balance due|gesamt|summe|montant)\b", re.I)
+_NOT_TOTAL = re.compile(r"\b(sub\s*-?\s*tot\w*|iva|vat|tax|tva|mwst|ust|imponibile|netto)\b", re.I)
+# Righe che hanno un importo ma non sono voci di spesa
+_NOT_ITEM = re.compile(
+    r"\b(resto|change|contanti|cash|carta|card|bancomat|visa|mastercard|pagamento|payment|"
+    r"iva|vat|tax|tva|mwst|imponibile|netto|totale|total|sub\s*-?\s*tot\w*|tel|p\.?\s*iva|c\.?f\.?)\b",
+    re.I,
+)
+_NOT_STORE = re.compile(r"\b(via|viale|piazza|street|st\.|road|tel|fax|p\.?\s*iva|vat|www\.|http|scontrino|receipt|documento)\b", re.I)
+
+CURRENCY_SYMBOLS = {"€": "EUR", "£": "GBP", "$": "USD"}
+# Come la valuta è spesso stampata per esteso ("TOTALE EURO")
+CURRENCY_ALIASES = {"EURO": "EUR", "EUROS": "EUR"}
+CURRENCY_CODES = ("EUR", "USD", "GBP", "CHF", "JPY", "CAD", "AUD", "SEK", "NOK", "DKK", "PLN", "CZK", "HUF")
+# Paese dedotto dalla valuta o dai termini fiscali stampati (come chiede il prompt di Gemini)
+CURRENCY_COUNTRIES = {"GBP": "United Kingdom", "USD": "United States", "CHF": "Switzerland", "JPY": "Japan",
+                      "CAD": "Canada", "AUD": "Australia", "SEK": "Sweden", "NOK": "Norway", "DKK": "Denmark",
+                      "PLN": "Poland", "CZK": "Czech Republic", "HUF": "Hungary"}
+# Paesi che scrivono le date mese/giorno, e quelli dove si trovano entrambi gli ordini
+MONTH_FIRST_COUNTRIES = ("United States",)
+MIXED_DATE_COUNTRIES = ("Canada",)
+# Una data che può essere letta in due modi non deve evitare Gemini: confidenza al più questa
+AMBIGUOUS_DATE_MAX_CONFIDENCE = 0.5
+TAX_COUNTRIES = ((re.compile(r"p\.?\s*iva|partita iva|\bc\.?f\.?\b", re.I), "Italy"),
+                 (re.compile(r"\b(siret|tva)\b", re.I), "France"),
+                 (re.compile(r"\b(mwst|ust-?id|steuer)\b", re.I), "Germany"),
+                 (re.compile(r"\b(nif|cif)\b", re.I), "Spain"))
+CATEGORY_KEYWORDS = (
+    ("TRANSPORTATION", re.compile(r"benzina|gasolio|diesel|carburante|fuel|petrol|taxi|uber|treno|train|biglietto|ticket|parcheggio|parking|autostrada|toll", re.I)),
+    ("HEALTHCARE", re.compile(r"farmacia|pharmacy|parafarmacia|medic|ticket sanitario|tachipirina|ibuprofen|vitamin", re.I)),
+    ("UTILITIES", re.compile(r"bolletta|luce|energia|electric|gas naturale|acqua|water bill|internet|telefonia|ricarica", re.I)),
+    ("ENTERTAINMENT", re.compile(r"cinema|teatro|concerto|museo|netflix|spotify|biglietto evento|game|libro|book", re.I)),
+    ("FOOD_AND_GROCERIES", re.compile(r"supermercato|market|alimentari|pane|latte|frutta|verdura|pasta|carne|pesce|caff|bar|ristorante|pizzeria|trattoria|coop|conad|esselunga|lidl|carrefour|tesco|aldi|spar", re.I)),
+)
+
+
+def init_worker(tesseract_cmd: str = TESSERACT_CMD):
+    """Initializer dei processi del pool: pytesseract cerca "tesseract" nel PATH se non glielo diciamo."""
+    try:
+        import pytesseract
+    except ImportError:
+        return # Un initializer che solleva rompe il pool: l'errore lo riporta extract_receipt
+    pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+
+
+def recognize(data: bytes, lang: str = LOCAL_OCR_LANG) -> Tuple[List[str], float]:
+    """Immagine -> (righe di testo, confidenza media di Tesseract in [0, 1])."""
+    import pytesseract
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as original:
+        image = ImageOps.exif_transpose(original).convert("L")
+    if image.width < LOCAL_OCR_MIN_WIDTH:
+        scale = LOCAL_OCR_MIN_WIDTH / image.width
+        image = image.resize((LOCAL_OCR_MIN_WIDTH, round(image.height * scale)), Image.Resampling.LANCZOS)
+    image = ImageOps.autocontrast(image)
+
+    # psm 6: un blocco di testo uniforme, quello che è uno scontrino
+    words = pytesseract.image_to_data(image, lang=lang, config="--psm 6", output_type=pytesseract.Output.DICT)
+    lines: Dict[Tuple[int, int, int], List[str]] = {}
+    confidences = []
+    for i, text in enumerate(words["text"]):
+        text = text.strip()
+        conf = float(words["conf"][i])
+        if not text or conf < 0:
+            continue
+        confidences.append(conf)
+        lines.setdefault((words["block_num"][i], words["par_num"][i], words["line_num"][i]), []).append(text)
+    ocr_confidence = sum(confidences) / len(confidences) / 100 if confidences else 0.0
+    return [" ".join(tokens) for _, tokens in sorted(lines.items())], ocr_confidence
+
+
+def parse_amount(line: str) -> Optional[float]:
+    match = _AMOUNT.search(line)
+    if not match:
+        return None
+    sign, integer, cents = match.groups()
+    value = float(re.sub(r"[.,']", "", integer) + "." + cents)
+    return -value if sign else value
+
+
+def _as_date(year: int, month: int, day: int) -> Optional[str]:
+    try:
+        return datetime(year, month, day).strftime("%Y-%m-%d")
+    except ValueError:
+        return None # 31/02, o un numero di telefono che sembrava una data
+
+
+def month_first_for(country: Optional[str]) -> Optional[bool]:
+    """Ordine delle date per il paese dello scontrino: True mese/giorno, False giorno/mese, None non si sa."""
+    if not country or country in MIXED_DATE_COUNTRIES:
+        return None
+    return country in MONTH_FIRST_COUNTRIES
+
+
+def parse_date(text: str, month_first: Optional[bool] = None) -> Tuple[Optional[str], bool]:
+    """
+    -> (YYYY-MM-DD o None, ambigua). Per nn/nn/aaaa decide `month_first` (da month_first_for); senza
+    indicazione si prova giorno/mese, e la data è ambigua se anche mese/giorno è valida e diversa (03/04).
+    """
+    for match in _ISO_DATE.finditer(text):
+        parsed = _as_date(*(int(g) for g in match.groups()))
+        if parsed:
+            return parsed, False
+    for pattern in _SHORT_DATES:
+        for match in pattern.finditer(text):
+            first, second, year = (int(g) for g in match.groups())
+            year = year if year > 99 else 2000 + year
+            day_first, month_first_date = _as_date(year, second, first), _as_date(year, first, second)
+            preferred = (month_first_date, day_first) if month_first else (day_first, month_first_date)
+            valid = [d for d in preferred if d]
+            if not valid:
+                continue
+            # Con l'ordine del paese noto vale quello (se la data è valida); altrimenti due letture diverse = ambigua
+            return valid[0], month_first is None and len(set(valid)) > 1
+    return None, False
+
+
+def parse_currency(text: str) -> Optional[str]:
+    upper = text.upper()
+    for code in CURRENCY_CODES:
+        if re.search(rf"\b{code}\b", upper):
+            return code
+    for alias, code in CURRENCY_ALIASES.items():
+        if re.search(rf"\b{alias}\b", upper):
+            return code
+    for symbol, code in CURRENCY_SYMBOLS.items():
+        if symbol in text:
+            return code
+    return None
+
+
+def guess_country(text: str, currency: Optional[str]) -> Optional[str]:
+    if currency in CURRENCY_COUNTRIES:
+        return CURRENCY_COUNTRIES[currency]
+    for pattern, country in TAX_COUNTRIES:
+        if pattern.search(text):
+            return country
+    return None
+
+
+def guess_category(description: str, store_name: str) -> str:
+    for category, pattern in CATEGORY_KEYWORDS:
+        if pattern.search(description):
+            return category
+    # La voce da sola non dice nulla: decide il tipo di negozio
+    for category, pattern in CATEGORY_KEYWORDS:
+        if pattern.search(store_name):
+            return category
+    return "OTHER"
+
+
+def parse_receipt_lines(lines: List[str]) -> Tuple[Dict, bool]:
+    """
+    Righe OCR -> (dizionario con la forma di ReceiptData, data ambigua). I campi non trovati restano None.
+    """
+    text = "\n".join(lines)
+
+    store_name, store_index = None, -1
+    for index, line in enumerate(lines[:6]):
+        letters = sum(c.isalpha() for c in line)
+        if letters >= 3 and letters >= len(line.replace(" ", "")) / 2 and not _NOT_STORE.search(line):
+            store_name, store_index = line.strip(" *-=").title(), index
+            break
+
+    total_index, total_amount = None, None
+    for index, line in enumerate(lines):
+        if _TOTAL.search(line) and not _NOT_TOTAL.search(line):
+            amount = parse_amount(line)
+            if amount is not None and amount > 0:
+                total_index, total_amount = index, amount
+                break # Il primo TOTALE: quelli dopo sono pagato/resto/IVA
+
+    items = []
+    # Le voci stanno tra l'intestazione del negozio e la riga del totale
+    for line in lines[store_index + 1:total_index if total_index is not None else len(lines)]:
+        amount = parse_amount(line)
+        if amount is None or _NOT_ITEM.search(line):
+            continue
+        description = _AMOUNT.sub("", line).strip(" .:*-")
+        if sum(c.isalpha() for c in description) < 2:
+            continue
+        items.append({"description": description, "amount": amount, "category": guess_category(description, store_name or "")})
+
+    currency = parse_currency(text)
+    country = guess_country(text, currency)
+    receipt_date, date_ambiguous = parse_date(text, month_first_for(country))
+    return {
+        "store_name": store_name,
+        "receipt_date": receipt_date,
+        "total_amount": total_amount,
+        "currency": currency,
+        "country": country,
+        "items": items,
+    }, date_ambiguous
+
+
+def totals_reconcile(receipt: Dict) -> bool:
+    total = receipt.get("total_amount") or 0
+    if total <= 0 or not receipt.get("items"):
+        return False
+    items_sum = sum(item["amount"] for item in receipt["items"])
+    return abs(items_sum - total) <= max(TOTAL_TOLERANCE_ABS, total * TOTAL_TOLERANCE_REL)
+
+
+def score_receipt(receipt: Dict, ocr_confidence: float, date_ambiguous: bool = False) -> float:
+    """
+    Confidenza in [0, 1]: 40% qualità del testo (Tesseract), 30% campi trovati, 30% somma delle voci
+    uguale al totale. Senza totale o senza voci che tornano il punteggio non supera 0.7; con una data
+    ambigua (03/04 senza indizi sul paese) non supera AMBIGUOUS_DATE_MAX_CONFIDENCE.
+    """
+    fields = ("store_name", "receipt_date", "total_amount", "currency")
+    found = sum(1 for name in fields if receipt.get(name)) + (1 if receipt.get("items") else 0)
+    score = 0.4 * ocr_confidence + 0.3 * found / (len(fields) + 1) + (0.3 if totals_reconcile(receipt) else 0.0)
+    if date_ambiguous:
+        score = min(score, AMBIGUOUS_DATE_MAX_CONFIDENCE)
+    return round(score, 3)
+
+
+def extract_receipt(data: bytes) -> Dict:
+    """
+    Entry point del worker: {"receipt": {...}, "confidence": float, "lines": int}.
+    Non solleva mai: alcune eccezioni (es. TesseractNotFoundError) non si possono serializzare verso
+    il processo padre e romperebbero il pool. In caso di errore "receipt" è None e "error" lo descrive.
+    """
+    try:
+        lines, ocr_confidence = recognize(data)
+        receipt, date_ambiguous = parse_receipt_lines(lines)
+    except Exception as e:
+        return {"receipt": None, "confidence": 0.0, "lines": 0, "error": f"{type(e).__name__}: {e}"[:500]}
+    return {"receipt": receipt, "confidence": score_receipt(receipt, ocr_confidence, date_ambiguous), "lines": len(lines)}
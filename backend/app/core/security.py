@@ -1,6 +1,11 @@
 import os
+import uuid
+import hashlib
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Tuple
 import jwt
 from passlib.context import CryptContext
 
@@ -10,8 +15,46 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 REFRESH_TOKEN_EXPIRE_DAYS = 7
 
-# Password hashing context
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# --- PASSWORD HASHING ---
+# Schema e costo configurabili: cambiandoli, gli hash esistenti restano validi e vengono
+# aggiornati al login successivo (passlib li marca come "deprecated" -> needs_update).
+PASSWORD_HASH_SCHEME = os.getenv("PASSWORD_HASH_SCHEME", "bcrypt") # "bcrypt" oppure "argon2" (richiede argon2-cffi)
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+ARGON2_TIME_COST = int(os.getenv("ARGON2_TIME_COST", 3))
+ARGON2_MEMORY_COST = int(os.getenv("ARGON2_MEMORY_COST", 65536)) # KiB
+# bcrypt e argon2 rilasciano il GIL: un pool di thread basta per non bloccare l'event loop
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", os.cpu_count() or 2))
+# Oltre questa coda rispondiamo 503 invece di accumulare login che andranno comunque in timeout
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", 64))
+
+_hash_schemes = list(dict.fromkeys([PASSWORD_HASH_SCHEME, "bcrypt"]))
+_argon2_settings = (
+    {"argon2__type": "ID", "argon2__time_cost": ARGON2_TIME_COST, "argon2__memory_cost": ARGON2_MEMORY_COST}
+    if "argon2" in _hash_schemes else {}
+)
+pwd_context = CryptContext(
+    schemes=_hash_schemes,
+    default=PASSWORD_HASH_SCHEME,
+    deprecated="auto",
+    bcrypt__rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS, # Hash con un costo più basso -> needs_update al login
+    **_argon2_settings,
+)
+
+class PasswordHashingBusy(Exception):
+    """Too many hashing jobs queued: the caller should retry later."""
+
+_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="pwd-hash")
+_hash_slots = threading.BoundedSemaphore(PASSWORD_HASH_WORKERS + PASSWORD_HASH_MAX_QUEUE)
+
+async def _run_hashing(func, *args):
+    """Runs a CPU-heavy passlib call on the hashing pool, rejecting work when the queue is full."""
+    if not _hash_slots.acquire(blocking=False):
+        raise PasswordHashingBusy()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_hash_executor, func, *args)
+    finally:
+        _hash_slots.release()
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verifies a plain password against the hashed version."""
@@ -21,6 +64,20 @@ def get_password_hash(password: str) -> str:
     """Hashes a plain text password."""
     return pwd_context.hash(password)
 
+async def hash_password_async(password: str) -> str:
+    """Hashes a password off the event loop."""
+    return await _run_hashing(pwd_context.hash, password)
+
+async def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    Verifies a password off the event loop.
+    Returns (valid, new_hash): new_hash is set when the stored hash uses an old scheme or cost.
+    """
+    return await _run_hashing(pwd_context.verify_and_update, plain_password, hashed_password)
+
+def shutdown_hashing_pool():
+    _hash_executor.shutdown(wait=False, cancel_futures=True)
+
 def create_access_token(subject: str | int, session_id: int | None = None) -> str:
     # Usiamo 30 minuti di default (ora non ci importa più, il blocco è istantaneo)
     expire_mins = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
@@ -37,10 +94,15 @@ def create_access_token(subject: str | int, session_id: int | None = None) -> st
 def create_refresh_token(subject: str | int) -> str:
     """Generates a long-lived JWT refresh token."""
     expire = datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
-    to_encode = {"exp": expire, "sub": str(subject), "type": "refresh"}
+    # jti casuale: due login nello stesso secondo non devono produrre lo stesso token (indice unico)
+    to_encode = {"exp": expire, "sub": str(subject), "type": "refresh", "jti": uuid.uuid4().hex}
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def hash_refresh_token(token: str) -> bytes:
+    """Fixed-length (32 byte) digest stored in place of the refresh token itself."""
+    return hashlib.sha256(token.encode()).digest()
+
 def create_password_reset_token(email: str) -> str:
     """Crea un token valido solo per 15 minuti per il reset della password."""
     expire = datetime.utcnow() + timedelta(minutes=15)
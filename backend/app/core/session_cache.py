@@ -0,0 +1,204 @@
+# app/core/session_cache.py
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Optional, Iterable
+
+from sqlalchemy import text, event
+from sqlalchemy.orm import make_transient_to_detached
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.db.models import User
+
+logger = logging.getLogger(__name__)
+
+# Quanto a lungo una sessione verificata resta valida senza tornare sul DB.
+# La revoca NON aspetta il TTL: arriva subito via pub/sub. Il TTL è solo una rete di sicurezza.
+SESSION_CACHE_TTL_SECONDS = float(os.getenv("SESSION_CACHE_TTL_SECONDS", 60))
+SESSION_CACHE_MAX_ENTRIES = int(os.getenv("SESSION_CACHE_MAX_ENTRIES", 10_000))
+# "postgres" (LISTEN/NOTIFY, multi-worker) oppure "local" (un solo processo, utile in sviluppo)
+SESSION_REVOCATION_BACKEND = os.getenv("SESSION_REVOCATION_BACKEND", "postgres")
+REVOCATION_CHANNEL = "spendscope_session_revoked"
+
+
+class _Entry:
+    __slots__ = ("user_id", "user", "expires_at")
+
+    def __init__(self, user_id: int, user: User, expires_at: float):
+        self.user_id = user_id
+        self.user = user
+        self.expires_at = expires_at
+
+
+class SessionCache:
+    """
+    Cache in-process: session_id -> utente già verificato.
+    L'oggetto User in cache è staccato da qualsiasi sessione DB e non viene mai
+    restituito così com'è: ogni richiesta riceve una copia con `db.merge(load=False)`.
+    """
+
+    def __init__(self, ttl: float = SESSION_CACHE_TTL_SECONDS, max_entries: int = SESSION_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        # Incrementata a ogni revoca: una lettura dal DB iniziata prima di una revoca
+        # non può più finire in cache (evita di "resuscitare" una sessione appena chiusa)
+        self.generation = 0
+        # Se il canale di revoca non è attivo la cache è spenta: meglio lenti che insicuri
+        self.enabled = False
+
+    def get(self, session_id: int, user_id: int) -> Optional[User]:
+        if not self.enabled:
+            return None
+        entry = self._entries.get(session_id)
+        if entry is None:
+            return None
+        if entry.expires_at < time.monotonic() or entry.user_id != user_id:
+            self._entries.pop(session_id, None)
+            return None
+        self._entries.move_to_end(session_id)
+        return entry.user
+
+    def put(self, session_id: int, user: User, generation: int):
+        if not self.enabled or generation != self.generation:
+            return
+        # In cache va una copia staccata, mai l'oggetto legato alla sessione DB della richiesta
+        snapshot = User(**user.model_dump())
+        make_transient_to_detached(snapshot)
+        self._entries[session_id] = _Entry(user.id, snapshot, time.monotonic() + self.ttl)
+        self._entries.move_to_end(session_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate_sessions(self, session_ids: Iterable[int]):
+        self.generation += 1
+        for session_id in session_ids:
+            self._entries.pop(session_id, None)
+
+    def invalidate_user(self, user_id: int):
+        self.generation += 1
+        for session_id in [sid for sid, e in self._entries.items() if e.user_id == user_id]:
+            self._entries.pop(session_id, None)
+
+    def clear(self):
+        self.generation += 1
+        self._entries.clear()
+
+    def apply(self, payload: str):
+        """Applica un messaggio di revoca ricevuto da un altro worker."""
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            self.clear() # Messaggio illeggibile: nel dubbio svuotiamo tutto
+            return
+        if message.get("user_id") is not None:
+            self.invalidate_user(int(message["user_id"]))
+        if message.get("session_ids"):
+            self.invalidate_sessions(int(s) for s in message["session_ids"])
+
+
+# --- CANALI DI REVOCA (pluggable) ---
+
+class LocalRevocationBus:
+    """Un solo processo: la revoca locale basta. Da usare solo con un worker."""
+
+    def __init__(self, cache: SessionCache):
+        self.cache = cache
+
+    async def publish(self, db: AsyncSession, payload: str):
+        # Nessun altro worker da avvisare, ma ripetiamo l'invalidazione dopo il COMMIT:
+        # una richiesta concorrente potrebbe aver letto la sessione ancora attiva nel frattempo
+        event.listen(db.sync_session, "after_commit", lambda _session: self.cache.apply(payload), once=True)
+
+    async def start(self):
+        self.cache.enabled = True
+
+    async def stop(self):
+        self.cache.enabled = False
+
+
+class PostgresRevocationBus:
+    """
+    Revoca multi-worker via LISTEN/NOTIFY. La NOTIFY viene eseguita nella stessa
+    transazione che spegne la sessione, quindi parte solo se il COMMIT va a buon fine.
+    """
+
+    def __init__(self, cache: SessionCache, dsn: str):
+        self.cache = cache
+        self.dsn = dsn
+        self._task: Optional[asyncio.Task] = None
+
+    async def publish(self, db: AsyncSession, payload: str):
+        await db.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": REVOCATION_CHANNEL, "payload": payload})
+
+    def _on_notify(self, connection, pid, channel, payload):
+        self.cache.apply(payload)
+
+    async def _listen_forever(self):
+        import asyncpg # Import locale: serve solo a questo backend
+
+        delay = 1.0
+        while True:
+            conn = None
+            try:
+                conn = await asyncpg.connect(self.dsn)
+                lost = asyncio.Event()
+                conn.add_termination_listener(lambda _conn: lost.set())
+                await conn.add_listener(REVOCATION_CHANNEL, self._on_notify)
+                # Durante la disconnessione potremmo aver perso delle revoche: ripartiamo da zero
+                self.cache.clear()
+                self.cache.enabled = True
+                delay = 1.0
+                await lost.wait()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Session revocation listener disconnected", extra={"error": str(e)})
+            finally:
+                self.cache.enabled = False
+                self.cache.clear()
+                if conn is not None and not conn.is_closed():
+                    await conn.close()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30.0)
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._listen_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+def _asyncpg_dsn(database_url: str) -> str:
+    # SQLAlchemy usa "postgresql+asyncpg://", asyncpg vuole il DSN puro
+    return database_url.replace("postgresql+asyncpg://", "postgresql://", 1)
+
+
+session_cache = SessionCache()
+if SESSION_REVOCATION_BACKEND == "local":
+    revocation_bus = LocalRevocationBus(session_cache)
+else:
+    revocation_bus = PostgresRevocationBus(session_cache, _asyncpg_dsn(os.getenv("DATABASE_URL", "")))
+
+
+async def revoke(db: AsyncSession, *, user_id: Optional[int] = None, session_ids: Iterable[int] = ()):
+    """
+    Da chiamare PRIMA del commit che disattiva le sessioni.
+    Invalida subito la cache locale e accoda la notifica per gli altri worker.
+    """
+    session_ids = [int(s) for s in session_ids]
+    if user_id is not None:
+        session_cache.invalidate_user(user_id)
+    if session_ids:
+        session_cache.invalidate_sessions(session_ids)
+    await revocation_bus.publish(db, json.dumps({"user_id": user_id, "session_ids": session_ids}))
@@ -1,40 +1,150 @@
 import os
+import asyncio
+import threading
 import uuid
-import boto3
 from fastapi import UploadFile
 
+from app.core.instrumentation import instrument_s3_client
+
 # Load configuration from environment variables
 S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME", "receipt-radar-bucket")
 S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") 
 AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
 AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
 
-# Initialize the S3 client
-s3_client = boto3.client(
-    "s3",
-    endpoint_url=S3_ENDPOINT_URL,
-    aws_access_key_id=AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=AWS_SECRET_ACCESS_KEY
-)
+# boto3 costa centinaia di millisecondi tra import e creazione del client: lo facciamo
+# una volta sola, al primo uso o in parallelo nel lifespan (vedi app.main), mai all'import.
+_client_lock = threading.Lock()
+_s3_client = None
+_presign_client = None
+
+def get_s3_client():
+    """Shared, thread-safe S3 client; latency is exported via app.core.metrics."""
+    global _s3_client
+    if _s3_client is None:
+        with _client_lock:
+            if _s3_client is None:
+                import boto3
+                _s3_client = instrument_s3_client(boto3.client(
+                    "s3",
+                    endpoint_url=S3_ENDPOINT_URL,
+                    aws_access_key_id=AWS_ACCESS_KEY_ID,
+                    aws_secret_access_key=AWS_SECRET_ACCESS_KEY
+                ))
+    return _s3_client
+
+def _get_presign_client():
+    # Cloudflare R2 vuole firme S3v4 con region "auto" per i link temporanei
+    global _presign_client
+    if _presign_client is None:
+        with _client_lock:
+            if _presign_client is None:
+                import boto3
+                from botocore.client import Config
+                _presign_client = boto3.client(
+                    "s3",
+                    endpoint_url=S3_ENDPOINT_URL,
+                    aws_access_key_id=AWS_ACCESS_KEY_ID,
+                    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+                    region_name="auto",
+                    config=Config(signature_version="s3v4"),
+                )
+    return _presign_client
+
+def init_clients():
+    """Crea entrambi i client (chiamata dal lifespan in un thread)."""
+    get_s3_client()
+    _get_presign_client()
+
+def key_from_url(file_url: str) -> str:
+    return file_url.split(f"/{S3_BUCKET_NAME}/")[-1]
+
+def generate_download_url(file_url: str, expires_in: int = 3600) -> str:
+    """Presigned GET URL for a stored file. Signing is local: no network call."""
+    return _get_presign_client().generate_presigned_url(
+        "get_object",
+        Params={"Bucket": S3_BUCKET_NAME, "Key": key_from_url(file_url)},
+        ExpiresIn=expires_in,
+    )
+
+def new_file_url(user_id: int, extension: str) -> str:
+    """URL di un nuovo originale. Organize files by user ID to avoid collisions."""
+    return f"{S3_ENDPOINT_URL}/{S3_BUCKET_NAME}/users/{user_id}/{uuid.uuid4()}.{extension.lstrip('.')}"
+
+def derivative_url(file_url: str, name: str) -> str:
+    """Chiave prevedibile accanto all'originale: users/1/abc.jpg -> users/1/abc.thumb.webp"""
+    return f"{file_url.rsplit('.', 1)[0]}.{name}.webp"
+
+def download_file(file_url: str) -> bytes:
+    """Blocking: call it through asyncio.to_thread."""
+    return get_s3_client().get_object(Bucket=S3_BUCKET_NAME, Key=key_from_url(file_url))["Body"].read()
+
+def upload_bytes(file_url: str, body: bytes, content_type: str, cache_control: str | None = None):
+    """Blocking: call it through asyncio.to_thread. Cache-Control viene restituito anche sui GET firmati."""
+    extra = {"CacheControl": cache_control} if cache_control else {}
+    get_s3_client().put_object(
+        Bucket=S3_BUCKET_NAME, Key=key_from_url(file_url), Body=body, ContentType=content_type, **extra
+    )
 
 async def upload_file_to_s3(file: UploadFile, user_id: int) -> str:
     """
     Uploads an image or PDF to the S3 bucket and returns the file URL.
     """
     file_extension = file.filename.split(".")[-1]
-    # Organize files by user ID to avoid collisions
-    unique_filename = f"users/{user_id}/{uuid.uuid4()}.{file_extension}"
+    file_url = new_file_url(user_id, file_extension)
     
     # Read file content asynchronously (doesn't block the main thread)
     file_content = await file.read()
     
-    # Upload to S3
-    s3_client.put_object(
-        Bucket=S3_BUCKET_NAME,
-        Key=unique_filename,
-        Body=file_content,
-        ContentType=file.content_type
-    )
+    # Upload to S3 (boto3 è bloccante: in un thread per non fermare l'event loop)
+    await asyncio.to_thread(upload_bytes, file_url, file_content, file.content_type)
     
-    # Construct and return the public or accessible URL
-    return f"{S3_ENDPOINT_URL}/{S3_BUCKET_NAME}/{unique_filename}"
\ No newline at end of file
+    return file_url
+
+# S3 accetta al massimo 1000 chiavi per singola DeleteObjects
+S3_DELETE_BATCH_SIZE = 1000
+S3_DELETE_CONCURRENCY = int(os.getenv("S3_DELETE_CONCURRENCY", 4))
+
+async def delete_prefix_from_s3(prefix: str, on_progress=None) -> int:
+    """
+    Deletes every object under `prefix` with batched DeleteObjects calls (up to 1000 keys each),
+    running up to S3_DELETE_CONCURRENCY batches in parallel. boto3 is blocking, so each call
+    runs in a worker thread. `on_progress(deleted_so_far)` is awaited after every batch.
+    Returns the number of deleted objects.
+    """
+    semaphore = asyncio.Semaphore(S3_DELETE_CONCURRENCY)
+    deleted = 0
+    failures = []
+
+    async def delete_batch(keys):
+        nonlocal deleted
+        async with semaphore:
+            response = await asyncio.to_thread(
+                get_s3_client().delete_objects,
+                Bucket=S3_BUCKET_NAME,
+                Delete={"Objects": [{"Key": k} for k in keys], "Quiet": True},
+            )
+        # In modalità Quiet la risposta contiene solo le chiavi NON cancellate
+        errors = response.get("Errors", [])
+        failures.extend(errors)
+        deleted += len(keys) - len(errors)
+        if on_progress:
+            await on_progress(deleted)
+
+    paginator = get_s3_client().get_paginator("list_objects_v2")
+    pages = paginator.paginate(Bucket=S3_BUCKET_NAME, Prefix=prefix, PaginationConfig={"PageSize": S3_DELETE_BATCH_SIZE})
+    page_iter = iter(pages)
+    tasks = []
+    while True:
+        # Anche il listing è bloccante: una pagina alla volta in un thread
+        page = await asyncio.to_thread(next, page_iter, None)
+        if page is None:
+            break
+        keys = [obj["Key"] for obj in page.get("Contents", [])]
+        if keys:
+            tasks.append(asyncio.create_task(delete_batch(keys)))
+    await asyncio.gather(*tasks)
+
+    if failures:
+        raise RuntimeError(f"{len(failures)} objects under {prefix} could not be deleted (first: {failures[0]})")
+    return deleted
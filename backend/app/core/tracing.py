@@ -0,0 +1,203 @@
+# app/core/tracing.py
+"""
+Tracing minimale compatibile W3C/OpenTelemetry, senza SDK.
+
+Lo span corrente vive in una ContextVar: i background task di FastAPI e i greenlet di SQLAlchemy
+ereditano il contesto, quindi upload → job OCR → chiamata a Gemini → INSERT finiscono nella
+stessa traccia. trace_id e span_id compaiono in ogni riga di log (vedi app.core.log).
+
+L'export è opzionale: con OTEL_EXPORTER_OTLP_ENDPOINT (es. http://localhost:4318) gli span
+chiusi vengono spediti a lotti in OTLP/HTTP JSON a un collector locale (Jaeger, Tempo,
+otel-collector). Senza variabile nessuno span viene bufferizzato.
+"""
+import asyncio
+import logging
+import os
+import random
+import re
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, Optional
+
+OTLP_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT")
+SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "spendscope-api")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 1.0))
+EXPORT_INTERVAL_SECONDS = float(os.getenv("TRACE_EXPORT_INTERVAL_SECONDS", 2))
+MAX_BUFFERED_SPANS = int(os.getenv("TRACE_MAX_BUFFERED_SPANS", 10_000))
+
+# Valori OTLP di SpanKind
+KIND_INTERNAL = 1
+KIND_SERVER = 2
+KIND_CLIENT = 3
+
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+logger = logging.getLogger(__name__)
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "kind", "sampled",
+                 "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], sampled: bool, kind: int, attributes: Dict[str, Any]):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.kind = kind
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.error: Optional[str] = None
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def record_error(self, error: BaseException):
+        self.error = f"{type(error).__name__}: {error}"[:500]
+
+    def end(self):
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            if self.sampled:
+                exporter.submit(self)
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("spendscope_current_span", default=None)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def start_span(name: str, *, kind: int = KIND_INTERNAL, parent: Optional[Span] = None, traceparent: Optional[str] = None, **attributes) -> Span:
+    """Crea uno span figlio di `parent` (default: lo span corrente) SENZA renderlo corrente."""
+    parent = parent or _current_span.get()
+    if parent is not None:
+        return Span(name, parent.trace_id, parent.span_id, parent.sampled, kind, attributes)
+    match = _TRACEPARENT.match(traceparent or "")
+    if match:
+        # Traccia iniziata a monte (frontend, proxy): la continuiamo
+        trace_id, parent_id, flags = match.groups()
+        return Span(name, trace_id, parent_id, flags == "01", kind, attributes)
+    sampled = TRACE_SAMPLE_RATE >= 1.0 or random.random() < TRACE_SAMPLE_RATE
+    return Span(name, f"{random.getrandbits(128):032x}", None, sampled, kind, attributes)
+
+
+@contextmanager
+def span(name: str, *, kind: int = KIND_INTERNAL, **attributes):
+    """`with span("receipt.ocr_job", receipt_id=42) as s:` — lo span è corrente dentro il blocco."""
+    current = start_span(name, kind=kind, **attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.record_error(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end()
+
+
+def activate(current: Span):
+    """Rende `current` lo span corrente; restituisce il token per ContextVar.reset."""
+    return _current_span.set(current)
+
+
+def deactivate(token):
+    _current_span.reset(token)
+
+
+# --- EXPORT OTLP/HTTP JSON ---
+
+def _attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        encoded = {"boolValue": value}
+    elif isinstance(value, int):
+        encoded = {"intValue": str(value)}
+    elif isinstance(value, float):
+        encoded = {"doubleValue": value}
+    else:
+        encoded = {"stringValue": str(value)}
+    return {"key": key, "value": encoded}
+
+
+def _encode(span: Span) -> Dict[str, Any]:
+    encoded = {
+        "traceId": span.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": span.kind,
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.end_ns),
+        "attributes": [_attribute(key, value) for key, value in span.attributes.items() if value is not None],
+        "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+    }
+    if span.parent_id:
+        encoded["parentSpanId"] = span.parent_id
+    return encoded
+
+
+class SpanExporter:
+    """Buffer + task periodico, stesso schema del recorder delle chiamate AI."""
+
+    def __init__(self, endpoint: Optional[str] = OTLP_ENDPOINT):
+        self.endpoint = endpoint.rstrip("/") + "/v1/traces" if endpoint else None
+        # Collector giù: a buffer pieno append scarta gli span più vecchi invece di crescere all'infinito
+        self._buffer: Deque[Span] = deque(maxlen=MAX_BUFFERED_SPANS)
+        self._task: Optional[asyncio.Task] = None
+        self._client = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.endpoint is not None
+
+    def submit(self, span: Span):
+        if not self.enabled:
+            return
+        self._buffer.append(span)
+
+    async def flush(self):
+        if not self._buffer or self._client is None:
+            return
+        batch = list(self._buffer)
+        self._buffer.clear()
+        payload = {"resourceSpans": [{
+            "resource": {"attributes": [_attribute("service.name", SERVICE_NAME)]},
+            "scopeSpans": [{"scope": {"name": "spendscope"}, "spans": [_encode(s) for s in batch]}],
+        }]}
+        try:
+            response = await self._client.post(self.endpoint, json=payload)
+            response.raise_for_status()
+        except Exception as e:
+            logger.warning("Trace export failed", extra={"spans_dropped": len(batch), "error": str(e)})
+
+    async def _export_loop(self):
+        while True:
+            await asyncio.sleep(EXPORT_INTERVAL_SECONDS)
+            await self.flush()
+
+    def start(self):
+        if self.enabled and self._task is None:
+            import httpx
+
+            self._client = httpx.AsyncClient(timeout=5.0)
+            self._task = asyncio.create_task(self._export_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+            await self.flush()
+            await self._client.aclose()
+            self._client = None
+
+
+exporter = SpanExporter()
@@ -3,7 +3,7 @@ from datetime import datetime
 from typing import List, Optional
 from enum import Enum
 from sqlmodel import SQLModel, Field, Relationship
-from sqlalchemy import Column, Text
+from sqlalchemy import BigInteger, Column, Text, Index, LargeBinary, text
 
 # --- ENUMS ---
 
@@ -13,6 +13,15 @@ class ReceiptStatus(str, Enum):
     PROCESSING = "processing"
     COMPLETED = "completed"
     FAILED = "failed"
+    DUPLICATE = "duplicate" # Quasi-duplicato di un altro scontrino, OCR saltato (app.services.duplicates)
+
+class DeletionStatus(str, Enum):
+    """Tracks the background account deletion job."""
+    PENDING = "pending"
+    DELETING_FILES = "deleting_files"
+    DELETING_DATA = "deleting_data"
+    COMPLETED = "completed"
+    FAILED = "failed"
 
 class ExpenseCategory(str, Enum):
     """Standard categories for AI classification."""
@@ -34,6 +43,8 @@ class User(SQLModel, table=True):
     full_name: Optional[str] = None
     is_active: bool = Field(default=True)
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    # Incrementata a ogni scrittura su scontrini e chat dell'utente: base degli ETag (app.core.conditional)
+    data_version: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
     
     # Relazioni
     receipts: List["Receipt"] = Relationship(back_populates="user")
@@ -46,20 +57,31 @@ class User(SQLModel, table=True):
 
 class UserSession(SQLModel, table=True):
     __tablename__ = "user_sessions"
+    # Indici parziali: contengono solo le sessioni attive, quindi restano piccoli
+    # anche se la tabella accumula sessioni chiuse in attesa del reaper
+    __table_args__ = (
+        Index("ix_user_sessions_active_token", "refresh_token_hash", unique=True, postgresql_where=text("is_active")),
+        Index("ix_user_sessions_user_active", "user_id", postgresql_where=text("is_active")),
+        Index("ix_user_sessions_expires", "expires_at"),
+    )
     
     id: Optional[int] = Field(default=None, primary_key=True)
     user_id: int = Field(foreign_key="users.id")
-    refresh_token: str = Field(index=True)
+    # SHA-256 del refresh token (32 byte): il JWT in chiaro non viene mai salvato
+    refresh_token_hash: bytes = Field(sa_column=Column(LargeBinary(32), nullable=False))
     ip_address: Optional[str] = None
     user_agent: Optional[str] = None
     is_active: bool = Field(default=True)
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    expires_at: datetime = Field(nullable=False) # Scadenza del refresh token: dopo, il reaper cancella la riga
     
     # Relazione verso l'utente
     user: Optional["User"] = Relationship(back_populates="sessions")
 
 class Receipt(SQLModel, table=True):
     __tablename__ = "receipts"
+    # Lista scontrini dell'utente dal più recente (vale anche per le partizioni hash, vedi app.db.partitioning)
+    __table_args__ = (Index("ix_receipts_user_created", "user_id", "created_at"),)
     
     id: Optional[int] = Field(default=None, primary_key=True)
     user_id: int = Field(foreign_key="users.id", nullable=False)
@@ -75,8 +97,17 @@ class Receipt(SQLModel, table=True):
     
     # Cloud Storage reference
     file_url: str = Field(nullable=False) 
+    # Derivati WebP accanto all'originale (app.services.derivatives); None finché non sono pronti o per i PDF
+    thumbnail_url: Optional[str] = Field(default=None)
+    preview_url: Optional[str] = Field(default=None)
+    # dHash a 64 bit dell'immagine (salvato con segno) e scontrino di cui questo sembra una copia.
+    # duplicate_of senza FK: con le tabelle partizionate la PK di receipts è (id, user_id)
+    image_hash: Optional[int] = Field(default=None, sa_column=Column(BigInteger, nullable=True))
+    duplicate_of: Optional[int] = Field(default=None)
     
     status: ReceiptStatus = Field(default=ReceiptStatus.PENDING)
+    # Numero dell'ultima esecuzione OCR avviata: solo quella può scrivere i risultati (vedi extract_and_save_data)
+    ocr_run: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
     
@@ -89,9 +120,12 @@ class Receipt(SQLModel, table=True):
 
 class ExpenseItem(SQLModel, table=True):
     __tablename__ = "expense_items"
+    __table_args__ = (Index("ix_expense_items_user_receipt", "user_id", "receipt_id"),)
     
     id: Optional[int] = Field(default=None, primary_key=True)
     receipt_id: int = Field(foreign_key="receipts.id", nullable=False)
+    # Copia di receipts.user_id: chiave di partizione e filtro diretto senza JOIN
+    user_id: int = Field(foreign_key="users.id", nullable=False)
     
     description: str = Field(nullable=False)
     amount: float = Field(nullable=False)
@@ -105,6 +139,8 @@ class ExpenseItem(SQLModel, table=True):
 
 class ChatSession(SQLModel, table=True):
     __tablename__ = "chat_sessions"
+    # La sidebar pagina per (updated_at, id) filtrando per utente
+    __table_args__ = (Index("ix_chat_sessions_user_updated", "user_id", "updated_at", "id"),)
     
     # Usiamo UUID come stringhe per gli ID delle chat (più sicuri per URL condivisibili)
     id: str = Field(default_factory=lambda: str(uuid.uuid4()), primary_key=True, index=True)
@@ -112,6 +148,17 @@ class ChatSession(SQLModel, table=True):
     title: str = Field(default="Nuova Chat")
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+    # --- RIASSUNTO ROLLING ---
+    # Riassunto dei messaggi più vecchi della finestra inviata al modello parola per parola.
+    # Viene aggiornato in background e serve anche come "memoria globale" per le altre chat.
+    summary: Optional[str] = Field(default=None, sa_column=Column(Text, nullable=True))
+    summarized_until: Optional[datetime] = Field(default=None) # created_at dell'ultimo messaggio riassunto
+
+    # --- CONTATORI DENORMALIZZATI (aggiornati da ai_chat) ---
+    # Così la sidebar si disegna con una sola query, senza contare i messaggi
+    message_count: int = Field(default=0)
+    last_message_at: Optional[datetime] = Field(default=None)
     
     # Relazioni
     user: Optional["User"] = Relationship(back_populates="chat_sessions")
@@ -125,6 +172,8 @@ class ChatSession(SQLModel, table=True):
 
 class ChatMessage(SQLModel, table=True):
     __tablename__ = "chat_messages"
+    # Ogni turno legge "gli ultimi N messaggi di una sessione": serve l'indice composto
+    __table_args__ = (Index("ix_chat_messages_session_created", "session_id", "created_at"),)
     
     id: str = Field(default_factory=lambda: str(uuid.uuid4()), primary_key=True, index=True)
     session_id: str = Field(foreign_key="chat_sessions.id", ondelete="CASCADE", nullable=False)
@@ -136,4 +185,47 @@ class ChatMessage(SQLModel, table=True):
     created_at: datetime = Field(default_factory=datetime.utcnow)
     
     # Relazioni
-    session: Optional["ChatSession"] = Relationship(back_populates="messages")
\ No newline at end of file
+    session: Optional["ChatSession"] = Relationship(back_populates="messages")
+
+# --- TELEMETRIA DELLE CHIAMATE AI ---
+
+class ModelCall(SQLModel, table=True):
+    """Una riga per ogni tentativo di chiamata a Gemini (OCR, chat, riassunti)."""
+    __tablename__ = "model_calls"
+    __table_args__ = (Index("ix_model_calls_created", "created_at"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    # Niente foreign key: la telemetria sopravvive alla cancellazione dell'utente
+    user_id: Optional[int] = Field(default=None, index=True)
+    call_type: str = Field(nullable=False) # 'ocr', 'chat', 'summary'
+    model: str = Field(nullable=False)
+
+    prompt_tokens: int = Field(default=0)
+    completion_tokens: int = Field(default=0)
+    cached_tokens: int = Field(default=0)
+    request_bytes: int = Field(default=0)
+    latency_ms: float = Field(default=0.0)   # Durata della chiamata HTTP al modello
+    wait_ms: float = Field(default=0.0)      # Tempo passato in coda nel governatore
+    cost_usd: float = Field(default=0.0)
+    error: Optional[str] = Field(default=None)
+
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+# --- CANCELLAZIONE ACCOUNT IN BACKGROUND ---
+
+class AccountDeletionJob(SQLModel, table=True):
+    """Stato di una cancellazione account: sopravvive all'utente, per questo niente foreign key."""
+    __tablename__ = "account_deletion_jobs"
+
+    # UUID non indovinabile: è l'unica "credenziale" per leggere lo stato dopo la cancellazione
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()), primary_key=True)
+    user_id: int = Field(nullable=False, index=True)
+    status: DeletionStatus = Field(default=DeletionStatus.PENDING)
+    objects_deleted: int = Field(default=0)
+    rows_deleted: int = Field(default=0)
+    # Rilanci fatti dal reaper dopo un FAILED (app.services.account_deletion.retry_failed_deletions)
+    attempts: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
+    error: Optional[str] = Field(default=None)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
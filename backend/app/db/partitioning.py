@@ -0,0 +1,130 @@
+# app/db/partitioning.py
+"""
+Schema partizionato delle tabelle che crescono con ogni upload e ogni turno di chat.
+
+- receipts, expense_items: HASH (user_id). Ogni query calda filtra un solo utente, quindi
+  tocca una sola partizione; gli item stanno nella stessa "fetta" del loro scontrino.
+- chat_messages: RANGE (created_at), una partizione al mese. I messaggi recenti restano in
+  partizioni piccole e i mesi vecchi si possono staccare/archiviare senza DELETE di massa.
+
+PostgreSQL vuole la chiave di partizione dentro la primary key: (id, user_id) e (id, created_at).
+Per l'ORM l'identità resta `id`, che è comunque unico (sequenza / uuid).
+La conversione di un DB esistente la fa partition_tables.py; le partizioni mensili future le crea
+app.services.partition_maintenance (qui sotto ensure_chat_partitions).
+"""
+import os
+from datetime import date, datetime
+from typing import Dict, List, NamedTuple, Tuple
+
+from sqlalchemy import text
+
+HASH_PARTITIONS = int(os.getenv("PARTITION_HASH_MODULUS", 16))
+CHAT_PARTITION_MONTHS_AHEAD = int(os.getenv("CHAT_PARTITION_MONTHS_AHEAD", 3))
+
+
+class PartitionSpec(NamedTuple):
+    partition_by: str
+    primary_key: Tuple[str, ...]
+    indexes: Dict[str, str]  # nome -> colonne; gli stessi nomi di models.py / init_db.py
+
+
+# Ordine rilevante: expense_items ha una FK composta verso receipts
+PARTITIONED_TABLES: Dict[str, PartitionSpec] = {
+    "receipts": PartitionSpec(
+        "HASH (user_id)", ("id", "user_id"), {"ix_receipts_user_created": "(user_id, created_at)"},
+    ),
+    "expense_items": PartitionSpec(
+        "HASH (user_id)", ("id", "user_id"), {"ix_expense_items_user_receipt": "(user_id, receipt_id)"},
+    ),
+    "chat_messages": PartitionSpec(
+        "RANGE (created_at)", ("id", "created_at"), {"ix_chat_messages_session_created": "(session_id, created_at)"},
+    ),
+}
+
+
+def create_table_ddl(table: str, source: str, target: str, final: str,
+                     hash_partitions: int = HASH_PARTITIONS) -> List[str]:
+    """
+    Tabella partizionata `target` con le stesse colonne (default e NOT NULL compresi) di `source`.
+    Le partizioni prendono il nome della tabella definitiva `final`, così non vanno rinominate
+    allo scambio. Per chat_messages le partizioni mensili si aggiungono con month_partition_ddl.
+    """
+    spec = PARTITIONED_TABLES[table]
+    statements = [
+        f"CREATE TABLE IF NOT EXISTS {target} ("
+        f"LIKE {source} INCLUDING DEFAULTS INCLUDING CONSTRAINTS, "
+        f"CONSTRAINT {_unqualified(final)}_pkey_part PRIMARY KEY ({', '.join(spec.primary_key)})"
+        f") PARTITION BY {spec.partition_by}"
+    ]
+    if spec.partition_by.startswith("HASH"):
+        statements += [
+            f"CREATE TABLE IF NOT EXISTS {final}_p{remainder:02d} PARTITION OF {target} "
+            f"FOR VALUES WITH (MODULUS {hash_partitions}, REMAINDER {remainder})"
+            for remainder in range(hash_partitions)
+        ]
+    return statements
+
+
+def index_ddl(table: str, target: str) -> List[str]:
+    """Indici secondari, creati DOPO la copia dei dati (costruirli alla fine costa molto meno)."""
+    return [
+        f"CREATE INDEX IF NOT EXISTS {name}_part ON {target} {columns}"
+        for name, columns in PARTITIONED_TABLES[table].indexes.items()
+    ]
+
+
+def _unqualified(name: str) -> str:
+    return name.rsplit(".", 1)[-1]
+
+
+def month_start(day: date, offset: int = 0) -> date:
+    months = day.year * 12 + day.month - 1 + offset
+    return date(months // 12, months % 12 + 1, 1)
+
+
+def month_partition_ddl(parent: str, final: str, month: date) -> str:
+    month = month_start(month)
+    return (
+        f"CREATE TABLE IF NOT EXISTS {final}_y{month:%Y}m{month:%m} PARTITION OF {parent} "
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{month_start(month, 1).isoformat()}')"
+    )
+
+
+def month_range(first: date, last: date) -> List[date]:
+    months, current = [], month_start(first)
+    while current <= last:
+        months.append(current)
+        current = month_start(current, 1)
+    return months
+
+
+# Stessa chiave per tutti i worker e per partition_tables.py: una sola CREATE alla volta
+PARTITION_LOCK_KEY = 7_420_332
+
+
+async def is_partitioned(conn, table: str) -> bool:
+    query = text("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table))")
+    return bool((await conn.execute(query, {"table": table})).scalar())
+
+
+async def ensure_chat_partitions(conn, months_ahead: int = CHAT_PARTITION_MONTHS_AHEAD,
+                                 table: str = "chat_messages") -> int:
+    """
+    Crea le partizioni mensili dal mese corrente fino a `months_ahead` mesi avanti.
+    Nessuna partizione DEFAULT: un inserimento fuori range fallisce invece di finire in una tabella
+    che poi bloccherebbe la creazione del mese giusto. Restituisce quante partizioni ha creato;
+    0 se la tabella non è (ancora) partizionata o se un altro worker ci sta già lavorando.
+    `conn` è una AsyncConnection dentro una transazione (il lock si libera al commit).
+    """
+    if not await is_partitioned(conn, table):
+        return 0
+    if not (await conn.execute(text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": PARTITION_LOCK_KEY})).scalar():
+        return 0
+    today = datetime.utcnow().date() # created_at è in UTC
+    created = 0
+    for month in month_range(today, month_start(today, months_ahead)):
+        name = f"{table}_y{month:%Y}m{month:%m}"
+        if (await conn.execute(text("SELECT to_regclass(:name)"), {"name": name})).scalar() is None:
+            await conn.execute(text(month_partition_ddl(table, table, month)))
+            created += 1
+    return created
@@ -1,39 +1,119 @@
 from contextlib import asynccontextmanager
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from sqlmodel import SQLModel
 
-# Importiamo l'engine e TUTTI i modelli affinché SQLModel li "veda" prima di creare le tabelle
-from app.db.database import engine
-from app.db.models import User, Receipt, UserSession, ExpenseItem, ChatSession, ChatMessage
+# Importiamo l'engine e TUTTI i modelli affinché le relazioni tra le classi siano risolte.
+# Lo schema NON viene creato qui: lo gestisce init_db.py (idempotente), da lanciare al deploy.
+from app.db.database import engine, read_engine, warm_up_pools
+from app.db.models import User, Receipt, UserSession, ExpenseItem, ChatSession, ChatMessage, ModelCall, AccountDeletionJob
 
-from app.api import auth, receipts, chat, analytics
+from app.api import auth, receipts, chat, analytics, metrics, health
+from app.services import gemini
+from app.core import storage
+from app.services.model_metrics import recorder
+from app.core.session_cache import revocation_bus
+from app.core.security import PasswordHashingBusy, shutdown_hashing_pool
+from app.services.session_reaper import run_session_reaper
+from app.services.partition_maintenance import run_partition_maintenance
+from app.services.derivatives import shutdown_derivative_pool
+from app.services.local_ocr import shutdown_local_ocr_pool
+from app.services.email import mail_sender
+import asyncio
+import time
 # --- 1. Importa lo scudo e il gestore errori ---
 from app.core.limiter import limiter
+from app.core.log import configure_logging
+from app.core.metrics import register_gauge
+from app.core.tracing import exporter as trace_exporter
+from app.core.instrumentation import ObservabilityMiddleware, instrument_engine
+from app.core.compression import CompressionMiddleware
+import logging
 from slowapi import _rate_limit_exceeded_handler
 from slowapi.errors import RateLimitExceeded
 
+# Log JSON su stdout (con trace_id) al posto dei print
+configure_logging()
+logger = logging.getLogger("app")
+
+# Metriche: durata delle query, pool del DB e code interne lette al momento dello scrape
+instrument_engine(engine)
+if read_engine is not None:
+    instrument_engine(read_engine, pool_name="replica")
+register_gauge("spendscope_model_queue_depth", "Gemini calls waiting for a slot (OCR, chat, summaries)",
+               lambda: gemini.governor.stats()["queued"])
+register_gauge("spendscope_model_in_flight", "Gemini calls currently running",
+               lambda: gemini.governor.stats()["in_flight"])
+register_gauge("spendscope_model_background_in_flight", "Background Gemini calls (OCR, summaries) currently running",
+               lambda: gemini.governor.stats()["background_in_flight"])
+register_gauge("spendscope_mail_queue_depth", "Emails waiting to be sent", lambda: mail_sender.queue.qsize())
+
 # --- 2. Definiamo l'evento di avvio (Lifespan) ---
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Eseguito all'avvio del server:
-    print("⏳ Controllo e creazione tabelle mancanti nel database...")
-    async with engine.begin() as conn:
-        # run_sync serve per eseguire il comando sincrono 'create_all' in un contesto asincrono
-        await conn.run_sync(SQLModel.metadata.create_all)
-    print("✅ Database pronto!")
+    started = time.perf_counter()
+    # Client pesanti (google.genai, boto3) creati in thread, in parallelo al riscaldamento dei pool.
+    # Un solo client Gemini e un solo client S3 per processo, condivisi da tutte le richieste.
+    results = await asyncio.gather(
+        asyncio.to_thread(gemini.init_client),
+        asyncio.to_thread(storage.init_clients),
+        warm_up_pools(),
+        return_exceptions=True,
+    )
+    for step, result in zip(("gemini client", "s3 clients", "db pool warmup"), results):
+        if isinstance(result, BaseException):
+            # Non blocchiamo l'avvio: i client si ricreano al primo uso e /readyz controlla il DB
+            logger.warning("Startup step failed", extra={"step": step, "error": str(result)})
+
+    # Flush periodico su DB della telemetria delle chiamate AI
+    recorder.start()
+    # Canale di revoca delle sessioni: finché non è attivo, get_current_user va sempre sul DB
+    await revocation_bus.start()
+    # Pulizia periodica delle sessioni scadute/revocate (sicura con più worker)
+    reaper_task = asyncio.create_task(run_session_reaper())
+    # Partizioni mensili di chat_messages create in anticipo (no-op se la tabella non è partizionata)
+    partition_task = asyncio.create_task(run_partition_maintenance())
+    # Worker di invio email (coda + pool di connessioni SMTP)
+    await mail_sender.start()
+    # Export degli span verso un collector locale (solo se OTEL_EXPORTER_OTLP_ENDPOINT è impostato)
+    trace_exporter.start()
+
+    health.set_ready(True)
+    logger.info("Startup completed", extra={"startup_ms": round((time.perf_counter() - started) * 1000, 1)})
     
     yield # Il server ora è in esecuzione e accetta richieste
     
-    # (Codice opzionale qui verrà eseguito allo spegnimento del server)
+    # Prima di tutto: /readyz risponde 503 e il load balancer smette di mandarci traffico
+    health.set_ready(False)
+    # Fermiamo i task periodici (pulizia sessioni scadute, manutenzione partizioni)
+    reaper_task.cancel()
+    partition_task.cancel()
+    # Aspettiamo che i task escano davvero (CancelledError incluso) prima di chiudere il DB
+    await asyncio.gather(reaper_task, partition_task, return_exceptions=True)
+    await mail_sender.stop()
+    await revocation_bus.stop()
+    shutdown_hashing_pool()
+    shutdown_derivative_pool()
+    shutdown_local_ocr_pool()
+    await recorder.stop()
+    # Allo spegnimento chiudiamo le connessioni HTTP verso Gemini
+    await gemini.close_client()
+    await trace_exporter.stop()
 
 # Passiamo il lifespan a FastAPI
-app = FastAPI(title="SpendScope API", lifespan=lifespan)
+# orjson come encoder di default: più veloce di json.dumps e gestisce datetime/enum senza conversioni
+app = FastAPI(title="SpendScope API", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # --- 3. Attacca lo scudo all'app ---
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
+# Troppi hash password in coda: meglio un 503 immediato che un login che scade dopo 30 secondi
+@app.exception_handler(PasswordHashingBusy)
+async def password_hashing_busy_handler(request: Request, exc: PasswordHashingBusy):
+    return JSONResponse(status_code=503, content={"detail": "Server busy, please retry."}, headers={"Retry-After": "1"})
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:3000"], 
@@ -42,7 +122,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# gzip/brotli sopra COMPRESSION_MIN_SIZE; i 304 degli endpoint di lettura passano intatti
+app.add_middleware(CompressionMiddleware)
+
+# Aggiunto per ultimo = più esterno: misura anche CORS e rate limiter
+app.add_middleware(ObservabilityMiddleware)
+
+app.include_router(health.router)
 app.include_router(auth.router)
 app.include_router(receipts.router)
 app.include_router(chat.router)
-app.include_router(analytics.router)
\ No newline at end of file
+app.include_router(analytics.router)
+app.include_router(metrics.router)
\ No newline at end of file
@@ -0,0 +1,61 @@
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from pydantic import BaseModel
+
+from app.db.models import ExpenseCategory, ReceiptStatus
+
+
+class ExpenseItemResponse(BaseModel):
+    id: int
+    receipt_id: int
+    description: str
+    amount: float
+    category: ExpenseCategory
+
+
+class ReceiptResponse(BaseModel):
+    """
+    Contratto di GET /receipts: le colonne pubbliche di Receipt più le voci. Le colonne interne
+    (ocr_run, image_hash) restano fuori, a differenza del vecchio model_dump() dell'intera riga.
+    Serve a OpenAPI e ai client: gli endpoint caldi non lo istanziano, serializzano
+    direttamente le tuple di receipts_from_rows con orjson.
+    """
+    id: int
+    user_id: int
+    store_name: Optional[str] = None
+    receipt_date: Optional[datetime] = None
+    total_amount: float
+    currency: str
+    country: Optional[str] = None
+    file_url: str
+    thumbnail_url: Optional[str] = None
+    preview_url: Optional[str] = None
+    duplicate_of: Optional[int] = None # Scontrino di cui questo sembra una seconda foto
+    status: ReceiptStatus
+    created_at: datetime
+    updated_at: datetime
+    items: List[ExpenseItemResponse] = []
+
+
+# Ordine delle colonne nelle select(...) degli endpoint: deve coincidere con quello dei campi
+RECEIPT_FIELDS = tuple(name for name in ReceiptResponse.model_fields if name != "items")
+ITEM_FIELDS = tuple(ExpenseItemResponse.model_fields)
+
+
+def receipts_from_rows(receipt_rows: Iterable[Sequence], item_rows: Iterable[Sequence]) -> List[dict]:
+    """
+    Costruisce la risposta da tuple di colonne (RECEIPT_FIELDS / ITEM_FIELDS), senza oggetti ORM
+    né validazione pydantic. item_rows può arrivare in qualsiasi ordine: li raggruppiamo per receipt_id.
+    """
+    items_by_receipt: Dict[int, List[dict]] = {}
+    receipt_id_index = ITEM_FIELDS.index("receipt_id")
+    for row in item_rows:
+        items_by_receipt.setdefault(row[receipt_id_index], []).append(dict(zip(ITEM_FIELDS, row)))
+
+    receipts = []
+    for row in receipt_rows:
+        receipt = dict(zip(RECEIPT_FIELDS, row))
+        receipt["items"] = items_by_receipt.get(receipt["id"], [])
+        receipts.append(receipt)
+    return receipts
@@ -0,0 +1,99 @@
+# app/services/account_deletion.py
+import logging
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, update
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.db.database import engine
+from app.db.models import (
+    AccountDeletionJob, DeletionStatus, User, UserSession, Receipt, ExpenseItem, ChatSession, ChatMessage
+)
+from app.core.storage import delete_prefix_from_s3
+
+logger = logging.getLogger(__name__)
+
+# Un job FAILED lascia l'account disattivato: il reaper lo rilancia dopo un po', fino a tanti tentativi
+ACCOUNT_DELETION_MAX_ATTEMPTS = int(os.getenv("ACCOUNT_DELETION_MAX_ATTEMPTS", 5))
+ACCOUNT_DELETION_RETRY_DELAY_SECONDS = float(os.getenv("ACCOUNT_DELETION_RETRY_DELAY_SECONDS", 900))
+
+
+async def _update_job(job_id: str, **values):
+    # Ogni aggiornamento di stato è una transazione a sé: il polling lo vede subito
+    async with AsyncSession(engine) as db:
+        await db.execute(
+            update(AccountDeletionJob)
+            .where(AccountDeletionJob.id == job_id)
+            .values(updated_at=datetime.utcnow(), **values)
+        )
+        await db.commit()
+
+
+async def run_account_deletion(job_id: str, user_id: int):
+    """
+    Background task: cancella file e dati di un utente.
+    1. File nel bucket sotto users/{id}/ con DeleteObjects a lotti da 1000, in parallelo.
+    2. Righe nel DB con DELETE set-based, dai figli ai padri, in UNA transazione.
+    I file vanno prima: se il DB fallisce l'utente esiste ancora e il job si può rilanciare.
+    """
+    try:
+        await _update_job(job_id, status=DeletionStatus.DELETING_FILES)
+
+        async def on_progress(deleted_so_far: int):
+            # I lotti girano in parallelo e i commit possono arrivare fuori ordine: il contatore non torna indietro
+            await _update_job(job_id, objects_deleted=func.greatest(AccountDeletionJob.objects_deleted, deleted_so_far))
+
+        await delete_prefix_from_s3(f"users/{user_id}/", on_progress=on_progress)
+
+        await _update_job(job_id, status=DeletionStatus.DELETING_DATA)
+        async with AsyncSession(engine) as db:
+            chat_session_ids = select(ChatSession.id).where(ChatSession.user_id == user_id)
+            statements = [
+                delete(ExpenseItem).where(ExpenseItem.user_id == user_id),
+                delete(Receipt).where(Receipt.user_id == user_id),
+                delete(ChatMessage).where(ChatMessage.session_id.in_(chat_session_ids)),
+                delete(ChatSession).where(ChatSession.user_id == user_id),
+                delete(UserSession).where(UserSession.user_id == user_id),
+                delete(User).where(User.id == user_id),
+            ]
+            rows_deleted = 0
+            for statement in statements:
+                # synchronize_session=False: niente oggetti ORM in memoria da tenere allineati
+                result = await db.execute(statement.execution_options(synchronize_session=False))
+                rows_deleted += result.rowcount or 0
+            await db.commit()
+
+        await _update_job(job_id, status=DeletionStatus.COMPLETED, rows_deleted=rows_deleted)
+
+    except Exception as e:
+        logger.exception("Account deletion failed", extra={"user_id": user_id, "job_id": job_id})
+        await _update_job(job_id, status=DeletionStatus.FAILED, error=str(e)[:500])
+
+
+async def retry_failed_deletions() -> int:
+    """
+    Rilancia i job FAILED più vecchi di ACCOUNT_DELETION_RETRY_DELAY_SECONDS (chiamata dal reaper).
+    Il job è idempotente: i file già cancellati non ci sono più e le DELETE non trovano righe.
+    Restituisce il numero di job rilanciati.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=ACCOUNT_DELETION_RETRY_DELAY_SECONDS)
+    async with AsyncSession(engine) as db:
+        # Il claim (FAILED -> PENDING) è atomico: con più worker ogni job viene ripreso una volta sola
+        claimed = (await db.execute(
+            update(AccountDeletionJob)
+            .where(
+                AccountDeletionJob.status == DeletionStatus.FAILED,
+                AccountDeletionJob.attempts < ACCOUNT_DELETION_MAX_ATTEMPTS,
+                AccountDeletionJob.updated_at < cutoff,
+            )
+            .values(status=DeletionStatus.PENDING, attempts=AccountDeletionJob.attempts + 1, updated_at=datetime.utcnow())
+            .returning(AccountDeletionJob.id, AccountDeletionJob.user_id)
+        )).all()
+        await db.commit()
+
+    for job_id, user_id in claimed:
+        logger.info("Retrying account deletion", extra={"user_id": user_id, "job_id": job_id})
+        await run_account_deletion(job_id, user_id)
+    return len(claimed)
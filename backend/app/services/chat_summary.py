@@ -0,0 +1,98 @@
+# app/services/chat_summary.py
+import logging
+import os
+from typing import Set
+
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.db.database import engine
+from app.db.models import ChatSession, ChatMessage
+from app.services.gemini import get_client, governor, estimate_tokens, PRIORITY_BACKGROUND
+
+logger = logging.getLogger(__name__)
+
+# Quanti turni (domanda + risposta) mandiamo al modello parola per parola
+CHAT_HISTORY_TURNS = int(os.getenv("CHAT_HISTORY_TURNS", 10))
+HISTORY_WINDOW = CHAT_HISTORY_TURNS * 2
+# Quanti messaggi fuori dalla finestra devono accumularsi prima di rifare il riassunto
+SUMMARY_REFRESH_THRESHOLD = int(os.getenv("CHAT_SUMMARY_REFRESH_THRESHOLD", 10))
+# Messaggi non riassunti mandati al modello: la finestra più quelli in attesa del prossimo riassunto
+HISTORY_MAX = HISTORY_WINDOW + SUMMARY_REFRESH_THRESHOLD
+SUMMARY_MODEL = os.getenv("CHAT_SUMMARY_MODEL", "gemini-3-flash-preview")
+
+SUMMARY_PROMPT = """
+You maintain the running memory of a conversation between a user and SpendScope AI, a personal finance assistant.
+Merge the EXISTING SUMMARY with the NEW MESSAGES into a single updated summary.
+Keep: the user's goals and preferences, budgets, figures and conclusions that were agreed on, open questions.
+Drop: greetings, reasoning inside <thinking> tags, and anything already superseded.
+Write at most 200 words of plain text, no preamble.
+
+EXISTING SUMMARY:
+{summary}
+
+NEW MESSAGES:
+{messages}
+"""
+
+# Sessioni con un riassunto già in corso in questo processo (evita doppie chiamate al modello)
+_refreshing: Set[str] = set()
+
+
+def needs_refresh(unsummarized_count: int) -> bool:
+    """True quando fuori dalla finestra verbatim si sono accumulati abbastanza messaggi."""
+    return unsummarized_count - HISTORY_WINDOW >= SUMMARY_REFRESH_THRESHOLD
+
+
+async def refresh_session_summary(session_id: str, user_id: int):
+    """
+    Background task: riassume i messaggi usciti dalla finestra verbatim e li fonde
+    nel riassunto esistente della sessione. Usa una sessione DB propria perché
+    gira dopo la chiusura della richiesta.
+    """
+    if session_id in _refreshing:
+        return
+    _refreshing.add(session_id)
+    try:
+        async with AsyncSession(engine, expire_on_commit=False) as db:
+            chat_session = await db.get(ChatSession, session_id)
+            if not chat_session:
+                return # Sessione cancellata nel frattempo
+
+            query = select(ChatMessage).where(ChatMessage.session_id == session_id)
+            if chat_session.summarized_until:
+                query = query.where(ChatMessage.created_at > chat_session.summarized_until)
+            pending = (await db.execute(query.order_by(ChatMessage.created_at.asc()))).scalars().all()
+
+            # Gli ultimi HISTORY_WINDOW messaggi restano verbatim: riassumiamo solo quelli prima
+            to_summarize = pending[:-HISTORY_WINDOW] if len(pending) > HISTORY_WINDOW else []
+            if not to_summarize:
+                return
+
+            transcript = "\n".join(f"{m.role.upper()}: {m.content}" for m in to_summarize)
+            prompt = SUMMARY_PROMPT.format(summary=chat_session.summary or "(none)", messages=transcript)
+
+            from google.genai import types # Import pigro: vedi app.services.gemini.init_client
+            client = get_client()
+            response = await governor.run(
+                lambda: client.aio.models.generate_content(
+                    model=SUMMARY_MODEL,
+                    contents=prompt,
+                    config=types.GenerateContentConfig(temperature=0.2),
+                ),
+                user_id=user_id,
+                priority=PRIORITY_BACKGROUND,
+                estimated_tokens=estimate_tokens(prompt),
+                call_type="summary",
+                model=SUMMARY_MODEL,
+                request_bytes=len(prompt.encode()),
+            )
+
+            chat_session.summary = (response.text or "").strip() or chat_session.summary
+            chat_session.summarized_until = to_summarize[-1].created_at
+            await db.commit()
+    except Exception:
+        # Il riassunto è un'ottimizzazione: se fallisce, al prossimo turno si riprova
+        logger.exception("Chat summary refresh failed", extra={"session_id": session_id})
+    finally:
+        _refreshing.discard(session_id)
@@ -0,0 +1,105 @@
+# app/services/derivatives.py
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import update
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.conditional import bump_data_version
+from app.core.imaging import perceptual_hash, render_derivatives
+from app.core.storage import derivative_url, download_file, upload_bytes
+from app.core.tracing import span
+from app.db.database import engine
+from app.db.models import Receipt
+from app.services.duplicates import to_db_hash
+
+logger = logging.getLogger(__name__)
+
+# Decodifica e resize sono CPU pura e tengono il GIL: processi separati, non thread
+DERIVATIVE_WORKERS = int(os.getenv("DERIVATIVE_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+# I derivati non cambiano mai per una data chiave: il browser può tenerli un anno
+DERIVATIVE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Stessa durata quando li serve l'API, ma solo nella cache del browser: la risposta è per utente
+DERIVATIVE_RESPONSE_CACHE_CONTROL = "private, max-age=31536000, immutable"
+# Pillow non apre i PDF: per quelli resta solo l'originale
+SUPPORTED_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".gif", ".bmp", ".tif", ".tiff")
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # spawn e non fork: il processo padre ha thread (boto3, pool dei thread) e fork li copierebbe a metà
+                _pool = ProcessPoolExecutor(
+                    max_workers=DERIVATIVE_WORKERS, mp_context=multiprocessing.get_context("spawn")
+                )
+    return _pool
+
+
+def shutdown_derivative_pool():
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+
+
+def supports_derivatives(file_url: str) -> bool:
+    return file_url.lower().endswith(SUPPORTED_EXTENSIONS)
+
+
+async def create_derivatives(file_url: str) -> Tuple[Dict[str, str], int]:
+    """
+    Scarica l'originale, genera i WebP (e il dHash) nel pool di processi e li carica accanto.
+    Restituisce ({nome: url}, hash percettivo).
+    """
+    original = await asyncio.to_thread(download_file, file_url)
+    rendered, image_hash = await asyncio.get_running_loop().run_in_executor(_get_pool(), render_derivatives, original)
+    urls = {name: derivative_url(file_url, name) for name in rendered}
+    await asyncio.gather(*(
+        asyncio.to_thread(upload_bytes, urls[name], body, "image/webp", DERIVATIVE_CACHE_CONTROL)
+        for name, body in rendered.items()
+    ))
+    return urls, image_hash
+
+
+async def compute_image_hash(data: bytes) -> int:
+    """dHash di un originale già scaricato, nello stesso pool di processi dei derivati."""
+    return await asyncio.get_running_loop().run_in_executor(_get_pool(), perceptual_hash, data)
+
+
+async def generate_receipt_derivatives(receipt_id: int, file_url: str, user_id: int) -> bool:
+    """
+    Background task dell'upload (e del backfill): crea thumbnail e preview e li registra sullo scontrino,
+    insieme all'hash percettivo. All'upload gira accanto all'OCR, che l'hash se lo calcola da sé
+    (compute_image_hash): qui serve per i vecchi scontrini del backfill.
+    Sessione DB propria: gira dopo la risposta. Un errore qui non tocca lo stato dello scontrino,
+    il frontend ripiega sull'originale. Restituisce True se i derivati sono stati salvati.
+    """
+    if not supports_derivatives(file_url):
+        return False
+    try:
+        with span("receipt.derivatives", receipt_id=receipt_id):
+            urls, image_hash = await create_derivatives(file_url)
+            async with AsyncSession(engine) as db:
+                await db.execute(
+                    update(Receipt)
+                    .where(Receipt.id == receipt_id, Receipt.user_id == user_id)
+                    .values(
+                        thumbnail_url=urls.get("thumb"), preview_url=urls.get("preview"),
+                        image_hash=to_db_hash(image_hash),
+                    )
+                )
+                # UPDATE set-based: niente flush, l'ETag della lista va invalidato a mano
+                await bump_data_version(db, user_id)
+                await db.commit()
+        return True
+    except Exception:
+        logger.exception("Receipt derivatives failed", extra={"receipt_id": receipt_id, "user_id": user_id})
+        return False
@@ -0,0 +1,154 @@
+# app/services/duplicates.py
+"""
+Rilevamento dei quasi-duplicati: lo stesso scontrino fotografato due volte ha byte diversi ma un
+dHash (app.core.imaging) a pochi bit di distanza. Per ogni utente teniamo in memoria un BK-tree
+degli hash, ricostruito dal DB al primo uso e dopo DUPLICATE_INDEX_TTL_SECONDS (gli altri worker
+non ci avvisano dei loro upload: il TTL limita quanto a lungo possiamo non vederli).
+"""
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.db.models import Receipt, ReceiptStatus
+
+logger = logging.getLogger(__name__)
+
+# Bit diversi (su 64) entro cui due scontrini sono "lo stesso": 0-4 è quasi certo, oltre 10 arrivano falsi positivi
+DUPLICATE_MAX_DISTANCE = int(os.getenv("DUPLICATE_MAX_DISTANCE", 6))
+# Se true un duplicato probabile non va a Gemini: stato DUPLICATE e nessuna voce di spesa
+DUPLICATE_SKIP_OCR = os.getenv("DUPLICATE_SKIP_OCR", "false").lower() == "true"
+DUPLICATE_INDEX_TTL_SECONDS = float(os.getenv("DUPLICATE_INDEX_TTL_SECONDS", 300))
+DUPLICATE_INDEX_MAX_USERS = int(os.getenv("DUPLICATE_INDEX_MAX_USERS", 1_000))
+
+_UINT64 = 1 << 64
+
+
+def to_db_hash(value: int) -> int:
+    """Hash senza segno -> BIGINT di PostgreSQL (con segno)."""
+    return value - _UINT64 if value >= 1 << 63 else value
+
+
+def from_db_hash(value: int) -> int:
+    return value % _UINT64
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    """
+    BK-tree sulla distanza di Hamming. Ogni nodo è [hash, receipt_ids, {distanza: figlio}]:
+    per la disuguaglianza triangolare la ricerca entro d visita solo i figli a distanza
+    (D - d)..(D + d) dal nodo, invece di confrontare l'hash con tutti quelli dell'utente.
+    """
+
+    __slots__ = ("root", "size")
+
+    def __init__(self):
+        self.root: Optional[list] = None
+        self.size = 0
+
+    def add(self, value: int, receipt_id: int):
+        self.size += 1
+        if self.root is None:
+            self.root = [value, [receipt_id], {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].append(receipt_id) # Stesso hash esatto: un nodo solo, più scontrini
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [receipt_id], {}]
+                return
+            node = child
+
+    def search(self, value: int, max_distance: int) -> List[Tuple[int, int]]:
+        """[(distanza, receipt_id)] entro max_distance, dal più vicino."""
+        found = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= max_distance:
+                found.extend((distance, receipt_id) for receipt_id in node[1])
+            for edge, child in node[2].items():
+                if distance - max_distance <= edge <= distance + max_distance:
+                    stack.append(child)
+        found.sort()
+        return found
+
+
+class DuplicateIndex:
+    """user_id -> BK-tree, LRU con TTL. Un solo event loop per processo: niente lock."""
+
+    def __init__(self, ttl: float = DUPLICATE_INDEX_TTL_SECONDS, max_users: int = DUPLICATE_INDEX_MAX_USERS):
+        self.ttl = ttl
+        self.max_users = max_users
+        self._trees: "OrderedDict[int, Tuple[BKTree, float]]" = OrderedDict()
+
+    async def tree_for(self, db: AsyncSession, user_id: int) -> BKTree:
+        cached = self._trees.get(user_id)
+        if cached is not None and cached[1] > time.monotonic():
+            self._trees.move_to_end(user_id)
+            return cached[0]
+
+        rows = (await db.execute(
+            select(Receipt.id, Receipt.image_hash)
+            .where(Receipt.user_id == user_id, Receipt.image_hash.is_not(None))
+        )).all()
+        tree = BKTree()
+        for receipt_id, image_hash in rows:
+            tree.add(from_db_hash(image_hash), receipt_id)
+        self._trees[user_id] = (tree, time.monotonic() + self.ttl)
+        self._trees.move_to_end(user_id)
+        while len(self._trees) > self.max_users:
+            self._trees.popitem(last=False)
+        return tree
+
+    def remember(self, user_id: int, receipt_id: int, image_hash: int):
+        """Aggiunge un hash appena calcolato all'albero in cache (se non c'è, lo carica il prossimo lookup)."""
+        cached = self._trees.get(user_id)
+        if cached is not None:
+            cached[0].add(image_hash, receipt_id)
+
+    def forget(self, user_id: int):
+        self._trees.pop(user_id, None)
+
+
+duplicate_index = DuplicateIndex()
+
+
+async def find_duplicate(db: AsyncSession, receipt_id: int, user_id: int, image_hash: int) -> Optional[Dict]:
+    """
+    Scontrino più vicino (escluso questo) entro DUPLICATE_MAX_DISTANCE, o None.
+    L'hash (senza segno) lo calcola il job OCR dai byte che ha già scaricato, senza aspettare
+    i derivati: PDF e immagini che Pillow non apre non hanno hash e non vengono mai segnalati.
+    """
+    tree = await duplicate_index.tree_for(db, user_id)
+    candidates = [(d, rid) for d, rid in tree.search(image_hash, DUPLICATE_MAX_DISTANCE) if rid != receipt_id]
+    if not candidates:
+        return None
+
+    # L'albero può contenere scontrini cancellati nel frattempo: conferma sul DB e prendi il più vicino.
+    # I duplicati già marcati non contano, altrimenti una terza copia punterebbe alla seconda
+    existing = set((await db.execute(
+        select(Receipt.id).where(
+            Receipt.user_id == user_id,
+            Receipt.id.in_([rid for _, rid in candidates]),
+            Receipt.status != ReceiptStatus.DUPLICATE,
+        )
+    )).scalars().all())
+    for distance, candidate_id in candidates:
+        if candidate_id in existing:
+            return {"receipt_id": candidate_id, "distance": distance}
+    return None
+
@@ -1,37 +1,44 @@
 # app/services/email.py
-import smtplib
-from email.message import EmailMessage
+import asyncio
+import logging
 import os
-from dotenv import load_dotenv
+import random
+import time
+from email.message import EmailMessage
+from typing import List
+
+import aiosmtplib
+
+SMTP_SERVER = os.getenv("SMTP_SERVER")
+SMTP_PORT = int(os.getenv("SMTP_PORT", 465)) # Aruba usa la 465
+SMTP_USER = os.getenv("SMTP_USER")
+SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
+# "ssl" (SSL puro, porta 465), "starttls" (porta 587) o "none" (sink locale tipo aiosmtpd nei test)
+SMTP_SECURITY = os.getenv("SMTP_SECURITY", "ssl")
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", 15))
+
+MAIL_POOL_SIZE = int(os.getenv("MAIL_POOL_SIZE", 2))        # Connessioni SMTP autenticate tenute aperte
+MAIL_BATCH_SIZE = int(os.getenv("MAIL_BATCH_SIZE", 20))     # Messaggi inviati per giro sulla stessa connessione
+MAIL_QUEUE_SIZE = int(os.getenv("MAIL_QUEUE_SIZE", 1000))
+MAIL_MAX_RETRIES = int(os.getenv("MAIL_MAX_RETRIES", 5))
+MAIL_IDLE_CHECK_SECONDS = 60.0 # Dopo questo tempo di inattività verifichiamo la connessione con un NOOP
+
+logger = logging.getLogger(__name__)
 
-# Forziamo il caricamento del file .env per essere sicuri al 100%
-load_dotenv()
 
-def send_reset_password_email(to_email: str, token: str):
+def _mock_mode() -> bool:
+    return not SMTP_SERVER or not SMTP_USER
+
+
+def build_reset_password_email(to_email: str, token: str) -> EmailMessage:
     frontend_url = os.getenv("FRONTEND_URL", "http://localhost:3000")
     reset_link = f"{frontend_url}/reset-password?token={token}"
-    
-    smtp_server = os.getenv("SMTP_SERVER")
-    smtp_port = os.getenv("SMTP_PORT", 465) # Aruba usa la 465
-    smtp_user = os.getenv("SMTP_USER")
-    smtp_password = os.getenv("SMTP_PASSWORD")
-    
-    # MOCK MODE
-    if not smtp_server or not smtp_user:
-        print("\n" + "="*50)
-        print("📧 MOCK EMAIL INTERCEPTED! (Le variabili .env non sono state caricate)")
-        print(f"To: {to_email}")
-        print("Subject: Reset your SpendScope Password")
-        print(f"Click here to reset: {reset_link}")
-        print("="*50 + "\n")
-        return
-
-    # REAL MODE: Invia una vera email con Aruba (SSL Puro)
+
     msg = EmailMessage()
     msg['Subject'] = "Reset your SpendScope Password"
-    msg['From'] = f"SpendScope <{smtp_user}>" # Fa comparire il nome "SpendScope"
+    msg['From'] = f"SpendScope <{SMTP_USER}>" # Fa comparire il nome "SpendScope"
     msg['To'] = to_email
-    
+
     msg.set_content(f"""
 Hi there,
 
@@ -42,13 +49,201 @@ Click the link below to choose a new password. This link will expire in 15 minut
 
 If you did not request this, please ignore this email.
     """)
+    return msg
+
+
+# --- POOL DI CONNESSIONI SMTP ---
+
+class _PooledConnection:
+    def __init__(self, client: aiosmtplib.SMTP):
+        self.client = client
+        self.last_used = time.monotonic()
+
+
+class SMTPConnectionPool:
+    """
+    Piccolo pool di connessioni SMTP già autenticate: handshake TLS e LOGIN si pagano
+    una volta sola invece che a ogni email.
+    """
+
+    def __init__(self, size: int = MAIL_POOL_SIZE):
+        self._idle: asyncio.LifoQueue = asyncio.LifoQueue()
+        self._slots = asyncio.Semaphore(size)
+
+    async def _connect(self) -> _PooledConnection:
+        client = aiosmtplib.SMTP(
+            hostname=SMTP_SERVER,
+            port=SMTP_PORT,
+            use_tls=SMTP_SECURITY == "ssl",
+            start_tls=SMTP_SECURITY == "starttls",
+            timeout=SMTP_TIMEOUT,
+        )
+        await client.connect()
+        if SMTP_PASSWORD:
+            await client.login(SMTP_USER, SMTP_PASSWORD)
+        return _PooledConnection(client)
+
+    async def acquire(self) -> _PooledConnection:
+        await self._slots.acquire()
+        try:
+            while not self._idle.empty():
+                conn = self._idle.get_nowait()
+                if time.monotonic() - conn.last_used < MAIL_IDLE_CHECK_SECONDS:
+                    return conn
+                try:
+                    await conn.client.noop() # Il server potrebbe aver chiuso la connessione inattiva
+                    return conn
+                except aiosmtplib.SMTPException:
+                    await self._discard(conn)
+            return await self._connect()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, conn: _PooledConnection):
+        conn.last_used = time.monotonic()
+        self._idle.put_nowait(conn)
+        self._slots.release()
+
+    async def discard(self, conn: _PooledConnection):
+        await self._discard(conn)
+        self._slots.release()
+
+    async def _discard(self, conn: _PooledConnection):
+        try:
+            await conn.client.quit()
+        except Exception:
+            conn.client.close()
+
+    async def close(self):
+        while not self._idle.empty():
+            await self._discard(self._idle.get_nowait())
+
+
+# --- CODA DI INVIO ---
+
+class _Outgoing:
+    __slots__ = ("message", "attempts")
+
+    def __init__(self, message: EmailMessage, attempts: int = 0):
+        self.message = message
+        self.attempts = attempts
+
+
+class MailSender:
+    """
+    Le richieste HTTP accodano e tornano subito; i worker async svuotano la coda a lotti
+    sulle connessioni del pool, ritentando con backoff esponenziale gli invii falliti.
+    """
+
+    def __init__(self, workers: int = MAIL_POOL_SIZE):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=MAIL_QUEUE_SIZE)
+        self.pool = SMTPConnectionPool()
+        self.workers = workers
+        self._tasks: List[asyncio.Task] = []
+        self._retry_tasks: set = set()
+
+    def enqueue(self, message: EmailMessage) -> bool:
+        if _mock_mode():
+            self._print_mock(message)
+            return True
+        try:
+            self.queue.put_nowait(_Outgoing(message))
+            return True
+        except asyncio.QueueFull:
+            logger.error("Mail queue full, email dropped", extra={"to": message['To']})
+            return False
+
+    def _print_mock(self, message: EmailMessage):
+        # Le variabili SMTP del .env non sono state caricate: l'email finisce nei log
+        logger.warning(
+            "Mock email intercepted",
+            extra={"to": message['To'], "subject": message['Subject'], "body": message.get_content().strip()},
+        )
+
+    async def _next_batch(self) -> List[_Outgoing]:
+        batch = [await self.queue.get()]
+        while len(batch) < MAIL_BATCH_SIZE and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        return batch
+
+    def _schedule_retry(self, item: _Outgoing, error: Exception):
+        item.attempts += 1
+        if item.attempts > MAIL_MAX_RETRIES:
+            logger.error(
+                "Email dropped after retries",
+                extra={"to": item.message['To'], "retries": MAIL_MAX_RETRIES, "error": str(error)},
+            )
+            return
+        delay = min(300.0, 2 ** item.attempts) * random.uniform(0.5, 1.0)
+
+        async def _requeue():
+            await asyncio.sleep(delay)
+            try:
+                self.queue.put_nowait(item)
+            except asyncio.QueueFull:
+                logger.error("Mail queue full, retry dropped", extra={"to": item.message['To']})
+
+        task = asyncio.create_task(_requeue())
+        self._retry_tasks.add(task)
+        task.add_done_callback(self._retry_tasks.discard)
+
+    async def _send_batch(self, batch: List[_Outgoing]):
+        try:
+            conn = await self.pool.acquire()
+        except Exception as e:
+            for item in batch:
+                self._schedule_retry(item, e)
+            return
+
+        healthy = True
+        for index, item in enumerate(batch):
+            try:
+                await conn.client.send_message(item.message)
+            except aiosmtplib.SMTPRecipientsRefused as e:
+                # Destinatario rifiutato: ritentare non serve
+                logger.warning("Recipient refused", extra={"to": item.message['To'], "error": str(e)})
+            except Exception as e:
+                # Connessione probabilmente rotta: il resto del lotto torna in coda
+                healthy = False
+                for pending in batch[index:]:
+                    self._schedule_retry(pending, e)
+                break
+
+        if healthy:
+            self.pool.release(conn)
+        else:
+            await self.pool.discard(conn)
+
+    async def _worker(self):
+        while True:
+            batch = await self._next_batch()
+            try:
+                await self._send_batch(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, drain_timeout: float = 10.0):
+        """Allo spegnimento proviamo a svuotare la coda, poi chiudiamo le connessioni."""
+        if self._tasks and not self.queue.empty():
+            try:
+                await asyncio.wait_for(self.queue.join(), timeout=drain_timeout)
+            except asyncio.TimeoutError:
+                logger.warning("Mail queue not drained on shutdown", extra={"emails_lost": self.queue.qsize()})
+        for task in [*self._tasks, *self._retry_tasks]:
+            task.cancel()
+        self._tasks = []
+        await self.pool.close()
+
+
+mail_sender = MailSender()
+
 
-    try:
-        print("⏳ Sto contattando il server Aruba...")
-        # Usiamo SMTP_SSL per la porta 465!
-        with smtplib.SMTP_SSL(smtp_server, int(smtp_port)) as server:
-            server.login(smtp_user, smtp_password)
-            server.send_message(msg)
-        print("✅ Email inviata con successo tramite Aruba!")
-    except Exception as e:
-        print(f"❌ Failed to send email via Aruba: {e}")
\ No newline at end of file
+def send_reset_password_email(to_email: str, token: str) -> bool:
+    """Accoda l'email di reset: non blocca mai la richiesta HTTP."""
+    return mail_sender.enqueue(build_reset_password_email(to_email, token))
@@ -0,0 +1,320 @@
+# app/services/gemini.py
+import asyncio
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, Optional
+
+if TYPE_CHECKING:
+    from google import genai
+
+from app.services.model_metrics import recorder
+from app.core.tracing import span, KIND_CLIENT
+
+# --- CONFIGURAZIONE (da .env, con default prudenti) ---
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL")  # Es: http://127.0.0.1:9100 per un finto server locale
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", 8))
+GEMINI_BACKGROUND_CONCURRENCY = int(os.getenv("GEMINI_BACKGROUND_CONCURRENCY", 5))
+GEMINI_PER_USER_CONCURRENCY = int(os.getenv("GEMINI_PER_USER_CONCURRENCY", 2))  # Solo job in background (OCR, riassunti)
+GEMINI_REQUESTS_PER_MINUTE = float(os.getenv("GEMINI_REQUESTS_PER_MINUTE", 60))
+GEMINI_TOKENS_PER_MINUTE = float(os.getenv("GEMINI_TOKENS_PER_MINUTE", 250_000))
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", 4))
+
+# Priorità: numero più basso = servito prima
+PRIORITY_INTERACTIVE = 0  # Chat: l'utente sta aspettando la risposta
+PRIORITY_BACKGROUND = 1   # OCR: nessuno guarda lo spinner in tempo reale
+
+# Gemini conta circa 258 token per ogni immagine/pagina inviata
+IMAGE_TOKEN_ESTIMATE = 258
+RETRYABLE_STATUS_CODES = {429, 503}
+
+
+# --- CLIENT CONDIVISO ---
+
+# google.genai (pydantic + httpx + auth) pesa all'import: lo carichiamo solo qui, dal lifespan
+# in un thread o alla prima chiamata, così l'import di app.main resta veloce.
+_client: Optional["genai.Client"] = None
+_client_lock = threading.Lock()
+
+def init_client() -> "genai.Client":
+    """Crea l'unico client Gemini del processo (chiamato nel lifespan, anche da un thread)."""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            return _client
+        from google import genai
+        from google.genai import types
+        http_options = types.HttpOptions(base_url=GEMINI_BASE_URL) if GEMINI_BASE_URL else None
+        _client = genai.Client(http_options=http_options)
+    return _client
+
+def get_client() -> "genai.Client":
+    """Restituisce il client condiviso, creandolo al volo se il lifespan non è girato (es. script CLI)."""
+    return _client or init_client()
+
+async def close_client():
+    """Chiude le connessioni HTTP del client allo spegnimento del server."""
+    global _client
+    if _client is not None:
+        await _client.aio.aclose()
+        _client = None
+
+def _is_api_error(error: Exception) -> bool:
+    from google.genai import errors # Già importato da init_client: costa un lookup in sys.modules
+    return isinstance(error, errors.APIError)
+
+def estimate_tokens(*texts: str, images: int = 0) -> int:
+    """Stima grossolana (~4 caratteri per token) usata solo per il rate limit."""
+    return sum(len(t) for t in texts if t) // 4 + images * IMAGE_TOKEN_ESTIMATE
+
+
+# --- PRIMITIVE DEL GOVERNATORE ---
+
+class TokenBucket:
+    """Token bucket asincrono: `rate` unità al secondo, fino a `capacity` accumulabili."""
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self, amount: float = 1.0):
+        # Una richiesta più grande del bucket non deve bloccarsi per sempre
+        amount = min(amount, self.capacity)
+        # Il lock garantisce l'ordine FIFO tra chi aspetta lo stesso bucket
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def adjust(self, delta: float):
+        """Corregge la stima a posteriori (delta positivo = consumati più token del previsto)."""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - delta)
+
+    def drain(self):
+        """Svuota il bucket: usato quando il provider risponde 429."""
+        self._refill()
+        self.tokens = min(self.tokens, 0.0)
+
+
+class PrioritySlots:
+    """
+    Semaforo a priorità. Le richieste interattive passano sempre davanti a quelle in background,
+    e il background non può mai occupare più di `background_limit` slot: una parte della
+    capacità resta quindi sempre libera per la chat. Il tetto per utente (`per_user_limit`)
+    vale solo per il background: un upload di tanti file non blocca la chat dello stesso utente.
+    """
+
+    def __init__(self, limit: int, background_limit: int, per_user_limit: Optional[int] = None):
+        self.limit = limit
+        self.background_limit = min(background_limit, limit)
+        self.per_user_limit = per_user_limit
+        self.in_use = 0
+        self.background_in_use = 0
+        self.user_background: Dict[Any, int] = {}
+        self._waiters: list = []
+        self._counter = itertools.count()
+
+    def _can_grant(self, priority: int, user_id=None) -> bool:
+        if self.in_use >= self.limit:
+            return False
+        if priority == PRIORITY_INTERACTIVE:
+            return True
+        if self.background_in_use >= self.background_limit:
+            return False
+        return (
+            user_id is None or self.per_user_limit is None
+            or self.user_background.get(user_id, 0) < self.per_user_limit
+        )
+
+    def _grant(self, priority: int, user_id=None):
+        self.in_use += 1
+        if priority != PRIORITY_INTERACTIVE:
+            self.background_in_use += 1
+            if user_id is not None:
+                self.user_background[user_id] = self.user_background.get(user_id, 0) + 1
+
+    def _wake_waiters(self):
+        # Scorriamo la coda in ordine di priorità: un job in background bloccato dal suo tetto
+        # (globale o dell'utente) non deve impedire a chi sta dietro di lui di partire.
+        skipped = []
+        while self._waiters:
+            priority, seq, future, user_id = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            if not self._can_grant(priority, user_id):
+                skipped.append((priority, seq, future, user_id))
+                if self.in_use >= self.limit:
+                    break
+                continue
+            self._grant(priority, user_id)
+            future.set_result(None)
+        for entry in skipped:
+            heapq.heappush(self._waiters, entry)
+
+    async def acquire(self, priority: int, user_id=None):
+        if not self._waiters and self._can_grant(priority, user_id):
+            self._grant(priority, user_id)
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future, user_id))
+        # In coda può esserci solo chi non è servibile (es. background al suo tetto): se c'è uno slot
+        # per noi lo assegnamo subito, in ordine di priorità, invece di aspettare il prossimo release
+        self._wake_waiters()
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Se lo slot ci era già stato assegnato, lo restituiamo
+            if future.done() and not future.cancelled():
+                self.release(priority, user_id)
+            raise
+
+    def release(self, priority: int, user_id=None):
+        self.in_use -= 1
+        if priority != PRIORITY_INTERACTIVE:
+            self.background_in_use -= 1
+            if user_id is not None:
+                # Niente memory leak: via la chiave quando l'utente non ha più job in corso
+                remaining = self.user_background.get(user_id, 0) - 1
+                if remaining > 0:
+                    self.user_background[user_id] = remaining
+                else:
+                    self.user_background.pop(user_id, None)
+        self._wake_waiters()
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(1 for _, _, f, _ in self._waiters if not f.done())
+
+
+class ModelGovernor:
+    """
+    Unico punto di passaggio per tutte le chiamate a Gemini del processo.
+    Applica: concorrenza globale a priorità, concorrenza per utente (solo background),
+    token bucket su richieste/minuto e token/minuto, backoff esponenziale sui 429.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = GEMINI_MAX_CONCURRENCY,
+        background_concurrency: int = GEMINI_BACKGROUND_CONCURRENCY,
+        per_user_concurrency: int = GEMINI_PER_USER_CONCURRENCY,
+        requests_per_minute: float = GEMINI_REQUESTS_PER_MINUTE,
+        tokens_per_minute: float = GEMINI_TOKENS_PER_MINUTE,
+        max_retries: int = GEMINI_MAX_RETRIES,
+    ):
+        self.slots = PrioritySlots(max_concurrency, background_concurrency, per_user_concurrency)
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.max_retries = max_retries
+        self._cooldown_until = 0.0
+
+    @asynccontextmanager
+    async def slot(self, user_id=None, priority: int = PRIORITY_BACKGROUND, estimated_tokens: int = 0):
+        """Riserva il diritto di fare UNA chiamata al modello (tetto per utente incluso, solo background)."""
+        await self.slots.acquire(priority, user_id)
+        try:
+            # Dopo un 429 tutti aspettano la fine del cooldown, non solo chi l'ha ricevuto
+            pause = self._cooldown_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            await self.request_bucket.acquire(1)
+            await self.token_bucket.acquire(estimated_tokens)
+            yield
+        finally:
+            self.slots.release(priority, user_id)
+
+    def record_usage(self, estimated_tokens: int, response: Any):
+        """Riallinea il bucket dei token con il consumo reale riportato da Gemini."""
+        usage = getattr(response, "usage_metadata", None)
+        actual = getattr(usage, "total_token_count", None) if usage else None
+        if actual:
+            self.token_bucket.adjust(actual - estimated_tokens)
+
+    def _backoff_delay(self, attempt: int) -> float:
+        # Backoff esponenziale con "full jitter" per non far ripartire tutti insieme
+        return random.uniform(0, min(30.0, 1.0 * (2 ** attempt)))
+
+    async def run(
+        self,
+        call: Callable[[], Awaitable[Any]],
+        *,
+        user_id=None,
+        priority: int = PRIORITY_BACKGROUND,
+        estimated_tokens: int = 0,
+        call_type: str = "other",
+        model: str = "unknown",
+        request_bytes: int = 0,
+    ) -> Any:
+        """
+        Esegue `call` (una factory di coroutine, così possiamo ripeterla) rispettando i limiti.
+        I 429/503 vengono ritentati con backoff; gli altri errori risalgono al chiamante.
+        Ogni tentativo viene registrato nelle metriche (token, latenza, byte, errori).
+        """
+        # Uno span per chiamata logica (attese e retry inclusi): figlio dello span del chiamante
+        with span(f"gemini.{call_type}", kind=KIND_CLIENT, model=model, call_type=call_type) as call_span:
+            attempt = 0
+            while True:
+                queued_at = time.perf_counter()
+                started_at = None
+                try:
+                    async with self.slot(user_id, priority, estimated_tokens):
+                        started_at = time.perf_counter()
+                        response = await call()
+                        finished_at = time.perf_counter()
+                    self.record_usage(estimated_tokens, response)
+                    recorder.record(
+                        call_type=call_type, model=model, user_id=user_id, response=response,
+                        request_bytes=request_bytes,
+                        latency_ms=(finished_at - started_at) * 1000,
+                        wait_ms=(started_at - queued_at) * 1000,
+                    )
+                    call_span.set_attribute("attempts", attempt + 1)
+                    return response
+                except Exception as e:
+                    if started_at is not None:
+                        failed_at = time.perf_counter()
+                        recorder.record(
+                            call_type=call_type, model=model, user_id=user_id,
+                            request_bytes=request_bytes,
+                            latency_ms=(failed_at - started_at) * 1000,
+                            wait_ms=(started_at - queued_at) * 1000,
+                            error=f"{getattr(e, 'code', None) or type(e).__name__}",
+                        )
+                    if not _is_api_error(e):
+                        raise
+                    if e.code not in RETRYABLE_STATUS_CODES or attempt >= self.max_retries:
+                        raise
+                    delay = self._backoff_delay(attempt)
+                    self._cooldown_until = max(self._cooldown_until, time.monotonic() + delay)
+                    if e.code == 429:
+                        self.request_bucket.drain()
+                    attempt += 1
+                    await asyncio.sleep(delay)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": self.slots.in_use,
+            "background_in_flight": self.slots.background_in_use,
+            "queued": self.slots.queue_depth,
+            "users_active": len(self.slots.user_background),
+        }
+
+
+# Istanza globale condivisa da OCR e chat
+governor = ModelGovernor()
@@ -0,0 +1,120 @@
+# app/services/local_ocr.py
+import asyncio
+import logging
+import multiprocessing
+import os
+import shutil
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Optional
+
+from app.core.receipt_text import TESSERACT_CMD, extract_receipt, init_worker
+from app.core.tracing import span
+from app.services.model_router import routing_stats, validate_receipt
+
+logger = logging.getLogger(__name__)
+
+# Primo passaggio con Tesseract in locale: gli scontrini stampati e ben illuminati non arrivano a Gemini
+LOCAL_OCR_ENABLED = os.getenv("LOCAL_OCR_ENABLED", "true").lower() == "true"
+# Sotto questa confidenza (app.core.receipt_text.score_receipt) si passa comunque al modello
+LOCAL_OCR_MIN_CONFIDENCE = float(os.getenv("LOCAL_OCR_MIN_CONFIDENCE", 0.85))
+# Tesseract è CPU pura: processi separati, come i derivati
+LOCAL_OCR_WORKERS = int(os.getenv("LOCAL_OCR_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+# Oltre questo tempo il fast path non è più "fast": meglio Gemini
+LOCAL_OCR_TIMEOUT_SECONDS = float(os.getenv("LOCAL_OCR_TIMEOUT_SECONDS", 10))
+# PDF e formati che Pillow non apre vanno direttamente al modello
+SUPPORTED_MIME_TYPES = ("image/jpeg", "image/png", "image/webp")
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+_available: Optional[bool] = None
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # spawn e non fork: vedi app.services.derivatives
+                _pool = ProcessPoolExecutor(
+                    max_workers=LOCAL_OCR_WORKERS, mp_context=multiprocessing.get_context("spawn"),
+                    initializer=init_worker, initargs=(TESSERACT_CMD,),
+                )
+    return _pool
+
+
+def _discard_pool(pool: ProcessPoolExecutor):
+    """Un worker morto (OOM, crash di Tesseract) rende il pool inutilizzabile: la prossima chiamata ne crea uno nuovo."""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_local_ocr_pool():
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+
+
+def local_ocr_available() -> bool:
+    """Attivo da .env, con pytesseract installato e il binario tesseract nel PATH. Controllato una volta."""
+    global _available
+    if _available is None:
+        if not LOCAL_OCR_ENABLED:
+            _available = False
+        else:
+            try:
+                import pytesseract # noqa: F401
+                _available = shutil.which(TESSERACT_CMD) is not None
+            except ImportError:
+                _available = False
+            if not _available:
+                logger.warning("Local OCR disabled: pytesseract or the tesseract binary is missing")
+    return _available
+
+
+async def try_local_ocr(file_bytes: bytes, mime_type: str) -> Optional[Dict[str, Any]]:
+    """
+    Prova l'OCR locale. Restituisce i dati nella forma di ReceiptData se la confidenza supera
+    LOCAL_OCR_MIN_CONFIDENCE e il risultato passa la stessa validazione delle risposte di Gemini
+    (somma delle voci = totale, data, valuta ISO); altrimenti None e si va al modello.
+    """
+    if mime_type not in SUPPORTED_MIME_TYPES or not local_ocr_available():
+        return None
+    pool = _get_pool()
+    try:
+        with span("receipt.local_ocr") as current:
+            result = await asyncio.wait_for(
+                asyncio.get_running_loop().run_in_executor(pool, extract_receipt, file_bytes),
+                timeout=LOCAL_OCR_TIMEOUT_SECONDS,
+            )
+            current.set_attribute("confidence", result["confidence"])
+    except BrokenProcessPool:
+        logger.warning("Local OCR pool broken, recreating it", exc_info=True)
+        _discard_pool(pool)
+        routing_stats.record("ocr", "local_fallback:error")
+        return None
+    except Exception:
+        # Timeout: non è un errore dello scontrino, decide Gemini
+        logger.warning("Local OCR failed, falling back to the model", exc_info=True)
+        routing_stats.record("ocr", "local_fallback:error")
+        return None
+
+    if result.get("error"):
+        # Immagine illeggibile per Pillow/Tesseract o binario mancante: l'errore arriva già come testo dal worker
+        logger.warning("Local OCR failed, falling back to the model", extra={"error": result["error"]})
+        routing_stats.record("ocr", "local_fallback:error")
+        return None
+
+    receipt = result["receipt"]
+    if result["confidence"] < LOCAL_OCR_MIN_CONFIDENCE:
+        routing_stats.record("ocr", "local_fallback:low_confidence")
+        return None
+    issues = validate_receipt(receipt)
+    if issues:
+        for issue in issues:
+            routing_stats.record("ocr", f"local_fallback:{issue}")
+        return None
+    return receipt
@@ -0,0 +1,159 @@
+# app/services/model_metrics.py
+import asyncio
+import bisect
+import logging
+import os
+from collections import defaultdict, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.db.database import engine
+from app.db.models import ModelCall
+from app.core.metrics import model_request_duration
+
+# Prezzi in USD per 1M di token (input, output). Aggiornare quando cambia il listino Google.
+MODEL_PRICING: Dict[str, Tuple[float, float]] = {
+    "gemini-2.5-flash-lite": (0.10, 0.40),
+    "gemini-3-flash-preview": (0.50, 3.00),
+    "gemini-3-pro-preview": (2.00, 12.00),
+}
+DEFAULT_PRICING = (0.50, 3.00)
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL_SECONDS = float(os.getenv("MODEL_METRICS_FLUSH_SECONDS", 5))
+MAX_BUFFERED_CALLS = int(os.getenv("MODEL_METRICS_MAX_BUFFER", 5000))
+
+LATENCY_BUCKETS_MS = [100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000]
+TOKEN_BUCKETS = [100, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000, 128000]
+
+
+class Histogram:
+    """Istogramma cumulativo a bucket fissi (stesso formato di Prometheus)."""
+
+    def __init__(self, buckets: List[float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # L'ultimo è +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self) -> Dict[str, Any]:
+        cumulative, running = {}, 0
+        for bound, n in zip([*self.buckets, "+Inf"], self.counts):
+            running += n
+            cumulative[str(bound)] = running
+        return {"count": self.count, "sum": round(self.sum, 2), "buckets": cumulative}
+
+
+def compute_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    input_price, output_price = MODEL_PRICING.get(model, DEFAULT_PRICING)
+    return (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+
+
+class ModelMetricsRecorder:
+    """
+    Raccoglie le metriche di ogni chiamata al modello.
+    Gli istogrammi restano in memoria (per processo); le righe vengono salvate su DB
+    a lotti da un task periodico, così la chiamata al modello non paga mai un INSERT.
+    """
+
+    def __init__(self):
+        self.latency: Dict[Tuple[str, str], Histogram] = defaultdict(lambda: Histogram(LATENCY_BUCKETS_MS))
+        self.tokens: Dict[Tuple[str, str], Histogram] = defaultdict(lambda: Histogram(TOKEN_BUCKETS))
+        self.errors: Dict[Tuple[str, str], int] = defaultdict(int)
+        self.cache_hits: Dict[Tuple[str, str], int] = defaultdict(int)
+        # Se il DB è giù non vogliamo crescere all'infinito: a buffer pieno append scarta la riga più vecchia
+        self._buffer: Deque[ModelCall] = deque(maxlen=MAX_BUFFERED_CALLS)
+        self._task: Optional[asyncio.Task] = None
+
+    def record(
+        self,
+        *,
+        call_type: str,
+        model: str,
+        user_id: Optional[int],
+        response: Any = None,
+        request_bytes: int = 0,
+        latency_ms: float = 0.0,
+        wait_ms: float = 0.0,
+        error: Optional[str] = None,
+    ):
+        usage = getattr(response, "usage_metadata", None)
+        prompt_tokens = (getattr(usage, "prompt_token_count", None) or 0) if usage else 0
+        completion_tokens = (getattr(usage, "candidates_token_count", None) or 0) if usage else 0
+        cached_tokens = (getattr(usage, "cached_content_token_count", None) or 0) if usage else 0
+
+        key = (call_type, model)
+        self.latency[key].observe(latency_ms)
+        model_request_duration.observe(
+            latency_ms / 1000, call_type=call_type, model=model, outcome="error" if error else "ok"
+        )
+        self.tokens[key].observe(prompt_tokens + completion_tokens)
+        if error:
+            self.errors[key] += 1
+        if cached_tokens:
+            self.cache_hits[key] += 1
+
+        self._buffer.append(ModelCall(
+            user_id=user_id,
+            call_type=call_type,
+            model=model,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            cached_tokens=cached_tokens,
+            request_bytes=request_bytes,
+            latency_ms=round(latency_ms, 1),
+            wait_ms=round(wait_ms, 1),
+            cost_usd=compute_cost(model, prompt_tokens, completion_tokens),
+            error=error,
+        ))
+
+    async def flush(self):
+        if not self._buffer:
+            return
+        batch = list(self._buffer)
+        self._buffer.clear()
+        try:
+            async with AsyncSession(engine) as db:
+                db.add_all(batch)
+                await db.commit()
+        except Exception as e:
+            logger.warning("Model metrics flush failed", extra={"rows_dropped": len(batch), "error": str(e)})
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL_SECONDS)
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        return [
+            {
+                "call_type": call_type,
+                "model": model,
+                "latency_ms": self.latency[(call_type, model)].snapshot(),
+                "tokens": self.tokens[(call_type, model)].snapshot(),
+                "errors": self.errors[(call_type, model)],
+                "cache_hits": self.cache_hits[(call_type, model)],
+            }
+            for call_type, model in sorted(self.latency)
+        ]
+
+
+# Istanza globale usata dal governatore di Gemini
+recorder = ModelMetricsRecorder()
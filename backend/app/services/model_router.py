@@ -0,0 +1,137 @@
+# app/services/model_router.py
+import os
+import re
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, List
+
+# --- LIVELLI DI MODELLO (dal più economico al più potente) ---
+# L'OCR parte dal primo e sale di livello solo se il risultato non supera la validazione.
+DEFAULT_OCR_MODEL_TIERS = ["gemini-2.5-flash-lite", "gemini-3-flash-preview", "gemini-3-pro-preview"]
+# Una variabile vuota (o solo virgole) non deve lasciare l'OCR senza modelli: si torna ai default
+OCR_MODEL_TIERS: List[str] = [
+    m.strip() for m in os.getenv("OCR_MODEL_TIERS", "").split(",") if m.strip()
+] or DEFAULT_OCR_MODEL_TIERS
+CHAT_FAST_MODEL = os.getenv("CHAT_FAST_MODEL", "gemini-3-flash-preview")
+CHAT_PRO_MODEL = os.getenv("CHAT_PRO_MODEL", "gemini-3-pro-preview")
+
+# Tolleranza sulla somma degli item: arrotondamenti, sconti e mance piccole non devono far salire di livello
+TOTAL_TOLERANCE_ABS = 0.05
+TOTAL_TOLERANCE_REL = 0.02
+
+ISO_CURRENCIES = {
+    "AED", "AFN", "ALL", "AMD", "ANG", "AOA", "ARS", "AUD", "AWG", "AZN", "BAM", "BBD", "BDT", "BGN", "BHD",
+    "BIF", "BMD", "BND", "BOB", "BRL", "BSD", "BTN", "BWP", "BYN", "BZD", "CAD", "CDF", "CHF", "CLP", "CNY",
+    "COP", "CRC", "CUP", "CVE", "CZK", "DJF", "DKK", "DOP", "DZD", "EGP", "ERN", "ETB", "EUR", "FJD", "FKP",
+    "GBP", "GEL", "GHS", "GIP", "GMD", "GNF", "GTQ", "GYD", "HKD", "HNL", "HTG", "HUF", "IDR", "ILS", "INR",
+    "IQD", "IRR", "ISK", "JMD", "JOD", "JPY", "KES", "KGS", "KHR", "KMF", "KPW", "KRW", "KWD", "KYD", "KZT",
+    "LAK", "LBP", "LKR", "LRD", "LSL", "LYD", "MAD", "MDL", "MGA", "MKD", "MMK", "MNT", "MOP", "MRU", "MUR",
+    "MVR", "MWK", "MXN", "MYR", "MZN", "NAD", "NGN", "NIO", "NOK", "NPR", "NZD", "OMR", "PAB", "PEN", "PGK",
+    "PHP", "PKR", "PLN", "PYG", "QAR", "RON", "RSD", "RUB", "RWF", "SAR", "SBD", "SCR", "SDG", "SEK", "SGD",
+    "SHP", "SLE", "SOS", "SRD", "SSP", "STN", "SYP", "SZL", "THB", "TJS", "TMT", "TND", "TOP", "TRY", "TTD",
+    "TWD", "TZS", "UAH", "UGX", "USD", "UYU", "UZS", "VES", "VND", "VUV", "WST", "XAF", "XCD", "XOF", "XPF",
+    "YER", "ZAR", "ZMW", "ZWL",
+}
+
+
+# --- VALIDAZIONE OCR ---
+
+def validate_receipt(data: Dict[str, Any]) -> List[str]:
+    """
+    Controlli economici sul JSON grezzo restituito dal modello.
+    Restituisce la lista dei problemi trovati (vuota = risultato accettabile).
+    """
+    issues = []
+
+    try:
+        parsed = datetime.strptime(str(data.get("receipt_date")), "%Y-%m-%d")
+        if parsed > datetime.utcnow():
+            issues.append("date_in_future")
+    except ValueError:
+        issues.append("unparseable_date")
+
+    if str(data.get("currency", "")).upper() not in ISO_CURRENCIES:
+        issues.append("invalid_currency")
+
+    try:
+        total = float(data.get("total_amount") or 0)
+        items_sum = sum(float(i.get("amount") or 0) for i in data.get("items") or [])
+    except (TypeError, ValueError, AttributeError):
+        issues.append("malformed_amounts")
+    else:
+        if total <= 0:
+            issues.append("missing_total")
+        elif data.get("items") and abs(items_sum - total) > max(TOTAL_TOLERANCE_ABS, total * TOTAL_TOLERANCE_REL):
+            issues.append("items_total_mismatch")
+
+    return issues
+
+
+# --- ROUTING DELLA CHAT ---
+
+# Domande "da calcolatrice": totali, medie, conteggi su un periodo o un negozio
+_AGGREGATE_PATTERN = re.compile(
+    r"\b(how much|total|sum|spent|spend|average|count|how many|quanto|totale|speso|spesa|media|quanti)\b",
+    re.IGNORECASE,
+)
+# Parole che indicano ragionamento vero: qui il modello Pro vale il suo prezzo
+_REASONING_PATTERN = re.compile(
+    r"\b(why|compare|trend|plan|budget|advice|suggest|forecast|predict|analy[sz]e|strategy|"
+    r"perché|confronta|andamento|consiglio|consigli|previsione|analizza|strategia)\b",
+    re.IGNORECASE,
+)
+SIMPLE_QUESTION_MAX_CHARS = 200
+
+def is_simple_aggregate_question(message: str) -> bool:
+    message = message.strip()
+    return (
+        len(message) <= SIMPLE_QUESTION_MAX_CHARS
+        and bool(_AGGREGATE_PATTERN.search(message))
+        and not _REASONING_PATTERN.search(message)
+    )
+
+def route_chat_model(requested_model: str, message: str) -> str:
+    """
+    Sceglie il modello per un turno di chat.
+    - 'gemini-3-pro' / 'auto': Pro, tranne le domande di puro aggregato che vanno sul Flash.
+    - qualunque altro valore: Flash (comportamento storico).
+    """
+    if requested_model in ("gemini-3-pro", "auto"):
+        if is_simple_aggregate_question(message):
+            routing_stats.record("chat", "pro_downgraded_to_fast")
+            return CHAT_FAST_MODEL
+        routing_stats.record("chat", "pro")
+        return CHAT_PRO_MODEL
+    routing_stats.record("chat", "fast")
+    return CHAT_FAST_MODEL
+
+
+# --- STATISTICHE DI ROUTING ---
+
+class RoutingStats:
+    """Contatori in memoria delle decisioni di routing (esposti su /metrics/models)."""
+
+    def __init__(self):
+        self.decisions: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+
+    def record(self, call_type: str, decision: str):
+        self.decisions[call_type][decision] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        ocr = self.decisions.get("ocr", {})
+        receipts = sum(v for k, v in ocr.items() if k.startswith("resolved_at:"))
+        local = ocr.get("resolved_at:local", 0)
+        # L'escalation riguarda solo gli scontrini arrivati al modello
+        model_receipts = receipts - local
+        escalated = sum(
+            v for k, v in ocr.items()
+            if k.startswith("resolved_at:") and k not in (f"resolved_at:{OCR_MODEL_TIERS[0]}", "resolved_at:local")
+        )
+        return {
+            "decisions": {k: dict(v) for k, v in self.decisions.items()},
+            "ocr_escalation_rate": round(escalated / model_receipts, 4) if model_receipts else 0.0,
+            "ocr_local_rate": round(local / receipts, 4) if receipts else 0.0,
+        }
+
+
+routing_stats = RoutingStats()
@@ -1,11 +1,13 @@
+import asyncio
 import json
 from pydantic import BaseModel, Field, field_validator
-import boto3
 import os
 from datetime import datetime
-from typing import Dict, Any, List
-from google import genai
-from google.genai import types
+from typing import Dict, Any, List, Optional
+from app.core.storage import get_s3_client
+from app.services.gemini import get_client, governor, estimate_tokens, PRIORITY_BACKGROUND
+from app.services.model_router import OCR_MODEL_TIERS, validate_receipt, routing_stats
+from app.services.local_ocr import try_local_ocr
 
 class ExpenseItem(BaseModel):
     description: str = Field(description="Nome del prodotto o servizio")
@@ -39,25 +41,20 @@ class ReceiptData(BaseModel):
     items: List[ExpenseItem] = Field(description="La lista dei singoli prodotti acquistati")
 
 
-async def process_receipt_image(file_url: str) -> Dict[str, Any]:
+async def process_receipt_image(file_url: str, user_id: Optional[int] = None, file_bytes: Optional[bytes] = None) -> Dict[str, Any]:
     """
     Servizio OCR reale alimentato da Google Gemini.
-    Scarica l'immagine dal bucket e usa l'AI per estrarre i dati strutturati.
+    Scarica l'immagine dal bucket (se chi chiama non l'ha già fatto) e usa l'AI per estrarre i dati strutturati.
     """
-    bucket_name = os.getenv("S3_BUCKET_NAME")
-    file_key = file_url.split(f"/{bucket_name}/")[-1]
-
-    s3_client = boto3.client(
-        's3',
-        endpoint_url=os.getenv("S3_ENDPOINT_URL"),
-        aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-        aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY")
-    )
+    if file_bytes is None:
+        bucket_name = os.getenv("S3_BUCKET_NAME")
+        file_key = file_url.split(f"/{bucket_name}/")[-1]
 
-    response = s3_client.get_object(Bucket=bucket_name, Key=file_key)
-    file_bytes = response['Body'].read()
+        # Client S3 condiviso (e strumentato); boto3 è bloccante, quindi il download gira in un thread
+        def download() -> bytes:
+            return get_s3_client().get_object(Bucket=bucket_name, Key=file_key)['Body'].read()
 
-    client = genai.Client()
+        file_bytes = await asyncio.to_thread(download)
 
     mime_type = "image/jpeg"
     file_url_lower = file_url.lower()
@@ -65,6 +62,17 @@ async def process_receipt_image(file_url: str) -> Dict[str, Any]:
         mime_type = "image/png"
     elif file_url_lower.endswith(".pdf"):
         mime_type = "application/pdf"
+    elif file_url_lower.endswith(".webp"):
+        mime_type = "image/webp"
+
+    # --- FAST PATH LOCALE ---
+    # Tesseract + regole: se il risultato è sicuro e i conti tornano, Gemini non serve
+    data = await try_local_ocr(file_bytes, mime_type)
+    if data is not None:
+        routing_stats.record("ocr", "resolved_at:local")
+        return _normalize(data)
+
+    client = get_client()
 
     # --- PROMPT POTENZIATO ---
     prompt = (
@@ -79,21 +87,63 @@ async def process_receipt_image(file_url: str) -> Dict[str, Any]:
         "Fai del tuo meglio anche se l'immagine è sfocata."
     )
     
-    ai_response = await client.aio.models.generate_content(
-        model='gemini-3-flash-preview',
-        contents=[
-            types.Part.from_bytes(data=file_bytes, mime_type=mime_type),
-            prompt
-        ],
-        config=types.GenerateContentConfig(
-            response_mime_type="application/json",
-            response_schema=ReceiptData,
-            temperature=0.1,
-        )
-    )
+    from google.genai import errors, types # Import pigro: vedi app.services.gemini.init_client
+    contents = [types.Part.from_bytes(data=file_bytes, mime_type=mime_type), prompt]
 
-    data = json.loads(ai_response.text)
-    
+    # --- ROUTING ADATTIVO ---
+    # Partiamo dal modello più economico e saliamo di livello solo se il risultato
+    # non supera la validazione (somma item vs totale, data, valuta ISO).
+    data = None
+    issues = ["no_model"]
+    for tier, ocr_model in enumerate(OCR_MODEL_TIERS):
+        try:
+            # L'OCR gira in background: passa dal governatore con priorità bassa,
+            # così un batch di upload non può affamare la chat interattiva.
+            ai_response = await governor.run(
+                lambda: client.aio.models.generate_content(
+                    model=ocr_model,
+                    contents=contents,
+                    config=types.GenerateContentConfig(
+                        response_mime_type="application/json",
+                        response_schema=ReceiptData,
+                        temperature=0.1,
+                    )
+                ),
+                user_id=user_id,
+                priority=PRIORITY_BACKGROUND,
+                estimated_tokens=estimate_tokens(prompt, images=1),
+                call_type="ocr" if tier == 0 else "ocr_escalation",
+                model=ocr_model,
+                request_bytes=len(file_bytes) + len(prompt.encode()),
+            )
+            # Risposta bloccata o senza candidati: text è None, come un JSON illeggibile si sale di livello
+            if not ai_response.text:
+                raise json.JSONDecodeError("Empty model response", "", 0)
+            candidate = json.loads(ai_response.text)
+            issues = validate_receipt(candidate)
+        except json.JSONDecodeError:
+            candidate, issues = None, ["invalid_json"]
+        except errors.APIError:
+            # Il governatore ha già esaurito i retry su questo modello: proviamo il livello successivo
+            candidate, issues = None, ["api_error"]
+
+        # Teniamo comunque l'ultimo risultato leggibile: meglio dati imperfetti che nessun dato
+        if candidate is not None:
+            data = candidate
+        if not issues:
+            break
+        for issue in issues:
+            routing_stats.record("ocr", f"failed:{ocr_model}:{issue}")
+    # resolved_at solo se l'ultimo livello ha passato la validazione: altrimenti nessuno ha risolto
+    routing_stats.record("ocr", "unresolved" if issues else f"resolved_at:{ocr_model}")
+
+    if data is None:
+        raise ValueError("No model returned a readable receipt")
+    return _normalize(data)
+
+
+def _normalize(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Stessa forma in uscita dal fast path locale e da Gemini (quella di ReceiptData)."""
     try:
         parsed_date = datetime.strptime(data["receipt_date"], "%Y-%m-%d")
     except ValueError:
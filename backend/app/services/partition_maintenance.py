@@ -0,0 +1,27 @@
+# app/services/partition_maintenance.py
+import asyncio
+import logging
+import os
+
+from app.db.database import engine
+from app.db.partitioning import ensure_chat_partitions
+
+# Una volta al giorno basta: le partizioni si creano CHAT_PARTITION_MONTHS_AHEAD mesi in anticipo
+PARTITION_MAINTENANCE_INTERVAL_SECONDS = float(os.getenv("PARTITION_MAINTENANCE_INTERVAL_SECONDS", 86400))
+
+logger = logging.getLogger(__name__)
+
+
+async def run_partition_maintenance():
+    """Loop periodico avviato nel lifespan (il primo giro parte subito, all'avvio)."""
+    while True:
+        try:
+            async with engine.begin() as conn:
+                created = await ensure_chat_partitions(conn)
+            if created:
+                logger.info("Chat message partitions created", extra={"partitions_created": created})
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Partition maintenance failed")
+        await asyncio.sleep(PARTITION_MAINTENANCE_INTERVAL_SECONDS)
@@ -0,0 +1,74 @@
+# app/services/session_reaper.py
+import asyncio
+import logging
+import os
+
+from sqlalchemy import text
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.db.database import engine
+from app.core.session_cache import revoke
+from app.services.account_deletion import retry_failed_deletions
+
+REAPER_INTERVAL_SECONDS = float(os.getenv("SESSION_REAPER_INTERVAL_SECONDS", 3600))
+REAPER_BATCH_SIZE = int(os.getenv("SESSION_REAPER_BATCH_SIZE", 500))
+# Chiave fissa dell'advisory lock: un solo worker alla volta cancella un lotto
+REAPER_LOCK_KEY = 7_420_331
+
+logger = logging.getLogger(__name__)
+
+# SKIP LOCKED: se due worker arrivano qui insieme non si bloccano a vicenda sulle stesse righe.
+# Restituiamo id e is_active: le sessioni scadute ma ancora attive vanno notificate alle cache degli altri worker.
+_DELETE_BATCH = text("""
+    DELETE FROM user_sessions
+    WHERE id IN (
+        SELECT id FROM user_sessions
+        WHERE is_active = false OR expires_at < (now() AT TIME ZONE 'utc')
+        ORDER BY id
+        LIMIT :batch_size
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, is_active
+""")
+
+
+async def reap_sessions_once(batch_size: int = REAPER_BATCH_SIZE) -> int:
+    """
+    Cancella sessioni revocate o scadute a lotti, una transazione breve per lotto.
+    Restituisce il numero di righe eliminate (0 se un altro worker sta già pulendo).
+    """
+    deleted = 0
+    async with AsyncSession(engine) as db:
+        while True:
+            # Lock legato alla transazione: si libera da solo al commit, anche se la
+            # connessione torna nel pool (un lock di sessione resterebbe appeso lì)
+            got_lock = (await db.execute(text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": REAPER_LOCK_KEY})).scalar()
+            if not got_lock:
+                await db.rollback()
+                break
+            rows = (await db.execute(_DELETE_BATCH, {"batch_size": batch_size})).all()
+            still_active = [row.id for row in rows if row.is_active]
+            if still_active:
+                # Sessioni scadute ma mai chiuse: potrebbero essere in cache su qualche worker
+                await revoke(db, session_ids=still_active)
+            await db.commit()
+            deleted += len(rows)
+            if len(rows) < batch_size:
+                break
+    return deleted
+
+
+async def run_session_reaper():
+    """Loop periodico avviato nel lifespan."""
+    while True:
+        try:
+            deleted = await reap_sessions_once()
+            if deleted:
+                logger.info("Expired or revoked sessions deleted", extra={"sessions_deleted": deleted})
+            # Stesso giro: le cancellazioni account fallite non devono lasciare l'utente bloccato per sempre
+            await retry_failed_deletions()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Session reaper failed")
+        await asyncio.sleep(REAPER_INTERVAL_SECONDS)
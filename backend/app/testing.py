@@ -0,0 +1,73 @@
+# app/testing.py
+"""
+Helper pytest per tenere sotto controllo il numero di query per endpoint (app.core.query_stats).
+
+    # tests/conftest.py
+    pytest_plugins = ["app.testing"]
+
+    # tests/test_receipts.py
+    def test_list_receipts_queries(client, auth_headers, max_queries):
+        with max_queries(3, route="/receipts"):
+            client.get("/receipts", headers=auth_headers)
+
+Funziona con TestClient (l'app gira in un altro thread: i conteggi arrivano tramite gli
+osservatori di query_stats) e con httpx.AsyncClient + ASGITransport. Senza richieste HTTP nel
+blocco conta le query eseguite direttamente (es. un servizio chiamato dal test).
+Fallisce anche se una richiesta ripete la stessa forma di statement (N+1), salvo allow_repeated=True.
+"""
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
+
+import pytest
+
+from app.core import query_stats
+from app.core.query_stats import QUERY_REPEAT_THRESHOLD, QueryStats
+
+
+def _describe(stats: QueryStats) -> str:
+    return "\n".join(f"  {n}x {shape[:200]}" for shape, n in stats.shapes.most_common())
+
+
+@contextmanager
+def assert_max_queries(
+    max_queries: int,
+    route: Optional[str] = None,
+    allow_repeated: bool = False,
+    repeat_threshold: int = QUERY_REPEAT_THRESHOLD,
+):
+    """
+    Ogni richiesta completata nel blocco (solo quelle verso `route`, il template FastAPI es.
+    "/receipts/{receipt_id}/download", se indicato) deve eseguire al più `max_queries` statement.
+    Restituisce la lista [(route, QueryStats)] osservata, utile per asserzioni più fini.
+    """
+    observed: List[Tuple[str, QueryStats]] = []
+
+    def observe(request_route: str, stats: QueryStats):
+        if route is None or request_route == route:
+            observed.append((request_route, stats))
+
+    query_stats.add_observer(observe)
+    try:
+        with query_stats.collect() as direct:
+            yield observed
+    finally:
+        query_stats.remove_observer(observe)
+
+    checked = observed or ([] if route else [("<block>", direct)])
+    if not checked:
+        raise AssertionError(f"No request to {route} completed inside the block")
+    for request_route, stats in checked:
+        if stats.count > max_queries:
+            raise AssertionError(
+                f"{request_route} ran {stats.count} queries (max {max_queries}):\n{_describe(stats)}"
+            )
+        repeated = stats.repeated(repeat_threshold)
+        if repeated and not allow_repeated:
+            shape, times = repeated[0]
+            raise AssertionError(f"{request_route} repeated a statement {times} times (possible N+1):\n  {shape[:300]}")
+
+
+@pytest.fixture
+def max_queries():
+    """Fixture: `with max_queries(3, route="/receipts"): ...`."""
+    return assert_max_queries
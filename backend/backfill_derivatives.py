@@ -0,0 +1,83 @@
+# backend/backfill_derivatives.py
+"""
+Genera thumbnail, preview WebP e hash percettivo per gli scontrini caricati prima della pipeline dei derivati.
+
+    python init_db.py                                    # prima: colonne thumbnail_url / preview_url
+    python backfill_derivatives.py                       # tutti quelli senza derivati o senza hash
+    python backfill_derivatives.py --user-id 42 --force  # rigenera anche quelli esistenti
+
+Scorre gli scontrini per id a lotti (keyset), quindi si può interrompere e rilanciare: riparte
+da quelli ancora senza derivati. Il lavoro CPU va nel pool di processi di app.services.derivatives.
+"""
+import argparse
+import asyncio
+import time
+
+from sqlalchemy import or_
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.db.database import engine
+from app.db.models import Receipt
+from app.services.derivatives import (
+    DERIVATIVE_WORKERS, generate_receipt_derivatives, shutdown_derivative_pool, supports_derivatives,
+)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--user-id", type=int, default=None, help="Only this user's receipts")
+    parser.add_argument("--force", action="store_true", help="Regenerate receipts that already have derivatives")
+    parser.add_argument("--batch-size", type=int, default=500)
+    # Download e upload aspettano la rete: qualche job in più dei processi tiene il pool pieno
+    parser.add_argument("--concurrency", type=int, default=DERIVATIVE_WORKERS * 2)
+    parser.add_argument("--limit", type=int, default=None, help="Stop after N receipts")
+    return parser.parse_args()
+
+
+async def fetch_batch(last_id: int, args) -> list:
+    query = select(Receipt.id, Receipt.file_url, Receipt.user_id).where(Receipt.id > last_id)
+    if not args.force:
+        # Anche quelli con i derivati ma senza hash percettivo (caricati prima del rilevamento duplicati)
+        query = query.where(or_(Receipt.thumbnail_url.is_(None), Receipt.image_hash.is_(None)))
+    if args.user_id is not None:
+        query = query.where(Receipt.user_id == args.user_id)
+    async with AsyncSession(engine) as db:
+        return (await db.execute(query.order_by(Receipt.id).limit(args.batch_size))).all()
+
+
+async def main(args):
+    semaphore = asyncio.Semaphore(args.concurrency)
+    done = failed = skipped = 0
+    started = time.perf_counter()
+
+    async def process(receipt_id: int, file_url: str, user_id: int):
+        nonlocal done, failed
+        async with semaphore:
+            if await generate_receipt_derivatives(receipt_id, file_url, user_id):
+                done += 1
+            else:
+                failed += 1
+
+    last_id = 0
+    try:
+        while args.limit is None or done + failed + skipped < args.limit:
+            rows = await fetch_batch(last_id, args)
+            if not rows:
+                break
+            last_id = rows[-1].id
+            if args.limit is not None:
+                rows = rows[:args.limit - done - failed - skipped]
+            todo = [row for row in rows if supports_derivatives(row.file_url)]
+            skipped += len(rows) - len(todo) # PDF e formati che Pillow non apre
+            await asyncio.gather(*(process(row.id, row.file_url, row.user_id) for row in todo))
+            rate = (done + failed) / (time.perf_counter() - started)
+            print(f"  fino a id {last_id}: {done} ok, {failed} falliti, {skipped} saltati ({rate:.1f}/s)", flush=True)
+    finally:
+        shutdown_derivative_pool()
+
+    print(f"Backfill completato: {done} scontrini con derivati, {failed} falliti (vedi log), {skipped} saltati.")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,154 @@
+# backend/benchmarks/bench_local_ocr.py
+"""
+Local OCR fast path: how many receipts Tesseract + the rules parser resolve without Gemini,
+how long that takes, and how much model latency it saves. Needs pytesseract, Pillow and the
+tesseract binary with the languages in LOCAL_OCR_LANG; no database, no bucket, no API key.
+
+    cd backend
+    python -m benchmarks.bench_local_ocr --synthetic 100 --noise 0.5
+    python -m benchmarks.bench_local_ocr --dir ~/receipts --gemini-ms 3800 --min-resolved 0.3
+
+--synthetic renders clean printed receipts with known totals, so the run also checks that
+accepted results are right. --dir runs real photos (jpg/png/webp) and can only report what
+was accepted. The acceptance rule is the one of app.services.local_ocr.try_local_ocr.
+--gemini-ms is the median OCR model latency to credit per resolved receipt: take it from
+/metrics/models/report. Exits 1 if the resolved share is below --min-resolved.
+"""
+import argparse
+import io
+import random
+import statistics
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+from pathlib import Path
+
+from app.core.receipt_text import TESSERACT_CMD, extract_receipt, init_worker
+from app.services.local_ocr import LOCAL_OCR_MIN_CONFIDENCE, LOCAL_OCR_WORKERS
+from app.services.model_router import validate_receipt
+
+STORES = ["SUPERMERCATO ROSSI", "FARMACIA CENTRALE", "BAR SPORT", "CONAD CITY", "LIBRERIA MONDO"]
+PRODUCTS = ["LATTE INTERO", "PANE CASERECCIO", "PASTA BARILLA", "CAFFE MACINATO", "MELE GOLDEN",
+            "TACHIPIRINA 500", "ACQUA NATURALE", "YOGURT BIANCO", "BISCOTTI", "FORMAGGIO GRANA"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--synthetic", type=int, default=50, help="Render N synthetic receipts")
+    source.add_argument("--dir", type=Path, default=None, help="Directory of real receipt images")
+    parser.add_argument("--noise", type=float, default=0.0, help="0..1: blur and skew of synthetic receipts")
+    parser.add_argument("--workers", type=int, default=LOCAL_OCR_WORKERS)
+    parser.add_argument("--min-confidence", type=float, default=LOCAL_OCR_MIN_CONFIDENCE)
+    parser.add_argument("--gemini-ms", type=float, default=3500.0, help="Model OCR latency per receipt")
+    parser.add_argument("--min-resolved", type=float, default=None, help="Fail below this resolved share")
+    parser.add_argument("--seed", type=int, default=7)
+    return parser.parse_args()
+
+
+def render_receipt(rng: random.Random, noise: float):
+    """Scontrino stampato sintetico -> (bytes PNG, totale atteso)."""
+    from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+    try:
+        font = ImageFont.load_default(size=28)
+    except TypeError: # Pillow < 10.1: solo il font bitmap piccolo
+        font = ImageFont.load_default()
+    items = [(rng.choice(PRODUCTS), round(rng.uniform(0.5, 25), 2)) for _ in range(rng.randint(2, 12))]
+    total = round(sum(amount for _, amount in items), 2)
+    day = date(2025, 1, 1) + timedelta(days=rng.randint(0, 300))
+    lines = [rng.choice(STORES), "Via Roma 12 - Milano", "P.IVA 01234567890", ""]
+    lines += [f"{name:<24}{amount:>8.2f}".replace(".", ",") for name, amount in items]
+    lines += ["", f"{'TOTALE EUR':<24}{total:>8.2f}".replace(".", ","), f"{'CONTANTI':<24}{total + 5:>8.2f}".replace(".", ","),
+              "", day.strftime("%d/%m/%Y") + "  18:22"]
+
+    image = Image.new("L", (640, 60 + 40 * len(lines)), 255)
+    draw = ImageDraw.Draw(image)
+    for index, line in enumerate(lines):
+        draw.text((30, 30 + 40 * index), line, fill=0, font=font)
+    if noise:
+        image = image.rotate(rng.uniform(-3, 3) * noise, expand=True, fillcolor=255)
+        image = image.filter(ImageFilter.GaussianBlur(radius=1.5 * noise))
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    return buffer.getvalue(), total
+
+
+def load_inputs(args):
+    if args.dir is not None:
+        paths = sorted(p for p in args.dir.iterdir() if p.suffix.lower() in (".jpg", ".jpeg", ".png", ".webp"))
+        return [(p.read_bytes(), None) for p in paths]
+    rng = random.Random(args.seed)
+    return [render_receipt(rng, args.noise) for _ in range(args.synthetic)]
+
+
+def timed_extract(data: bytes):
+    started = time.perf_counter()
+    result = extract_receipt(data)
+    return result, time.perf_counter() - started
+
+
+def main(args) -> int:
+    inputs = load_inputs(args)
+    if not inputs:
+        print("No receipts to process")
+        return 1
+
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker, initargs=(TESSERACT_CMD,)) as pool:
+        list(pool.map(timed_extract, [inputs[0][0]] * args.workers)) # Warm-up: import di Pillow/pytesseract nei worker
+        started = time.perf_counter()
+        results = list(pool.map(timed_extract, [data for data, _ in inputs]))
+        wall = time.perf_counter() - started
+
+    resolved = wrong = 0
+    reasons = Counter()
+    errors = Counter()
+    latencies = []
+    for (result, seconds), (_, expected_total) in zip(results, inputs):
+        latencies.append(seconds * 1000)
+        if result.get("error"):
+            # Tesseract mancante, lingua non installata, immagine illeggibile: in produzione va a Gemini
+            reasons["error"] += 1
+            errors[result["error"]] += 1
+            continue
+        if result["confidence"] < args.min_confidence:
+            reasons["low_confidence"] += 1
+            continue
+        issues = validate_receipt(result["receipt"])
+        if issues:
+            reasons.update(issues)
+            continue
+        resolved += 1
+        if expected_total is not None and abs(result["receipt"]["total_amount"] - expected_total) > 0.01:
+            wrong += 1
+
+    total = len(inputs)
+    local_ms = statistics.median(latencies)
+    print(f"{total} receipts, {args.workers} workers, {total / wall:.1f} receipts/s")
+    print(f"  local OCR     median {local_ms:7.0f} ms   p95 {sorted(latencies)[int(0.95 * (total - 1))]:7.0f} ms")
+    print(f"  resolved      {resolved}/{total} ({resolved / total:.0%})" + (f", {wrong} with a wrong total" if wrong else ""))
+    for reason, count in reasons.most_common():
+        print(f"  fallback      {reason}: {count}")
+    for error, count in errors.most_common(3):
+        print(f"  error         {count}x {error}")
+
+    # Ogni scontrino paga il passaggio locale; quelli risolti risparmiano la chiamata al modello
+    saved_ms = resolved * args.gemini_ms - sum(latencies)
+    print(f"\nlatency saved: {saved_ms / total:+.0f} ms per receipt on average "
+          f"({resolved} model calls avoided at {args.gemini_ms:.0f} ms, local pass {sum(latencies) / total:.0f} ms on all)")
+
+    if reasons["error"] == total:
+        print(f"\n❌ local OCR failed on every receipt (TESSERACT_CMD={TESSERACT_CMD})")
+        return 1
+    if wrong:
+        print(f"\n❌ {wrong} accepted receipts have a wrong total")
+        return 1
+    if args.min_resolved is not None and resolved / total < args.min_resolved:
+        print(f"\n❌ resolved share {resolved / total:.0%} is below {args.min_resolved:.0%}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(parse_args()))
@@ -0,0 +1,87 @@
+# backend/benchmarks/bench_login.py
+"""
+Login throughput under concurrency: password verification inline on the event loop
+versus the bounded hashing pool in app.core.security.
+
+    cd backend
+    python -m benchmarks.bench_login --logins 64 --concurrency 16 --rounds 12
+
+Besides logins/second it reports the worst event-loop stall seen by a 10 ms heartbeat:
+that is the delay every other request on the worker would have suffered.
+"""
+import argparse
+import asyncio
+import os
+import time
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=64, help="Total login attempts per mode")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent login attempts")
+    parser.add_argument("--rounds", type=int, default=12, help="bcrypt cost factor")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2, help="Hashing pool size")
+    return parser.parse_args()
+
+
+async def heartbeat(stop: asyncio.Event, lags: list):
+    interval = 0.01
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - started - interval)
+
+
+async def run_mode(name: str, login, total: int, concurrency: int):
+    limiter = asyncio.Semaphore(concurrency)
+    latencies, lags = [], []
+    stop = asyncio.Event()
+
+    async def one():
+        async with limiter:
+            started = time.perf_counter()
+            await login()
+            latencies.append(time.perf_counter() - started)
+
+    beat = asyncio.create_task(heartbeat(stop, lags))
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(total)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await beat
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000
+    p95 = latencies[int(len(latencies) * 0.95) - 1] * 1000
+    print(
+        f"{name:<8} {total / elapsed:8.1f} logins/s   p50 {p50:8.1f} ms   p95 {p95:8.1f} ms   "
+        f"max loop stall {max(lags, default=0) * 1000:8.1f} ms"
+    )
+
+
+async def main(args):
+    from app.core import security
+
+    password = "correct horse battery staple"
+    stored_hash = security.get_password_hash(password)
+
+    async def inline_login():
+        # Vecchio comportamento: verify sincrono dentro l'handler async
+        security.verify_password(password, stored_hash)
+
+    async def pooled_login():
+        await security.verify_and_update_password(password, stored_hash)
+
+    print(f"bcrypt rounds={args.rounds}  pool workers={args.workers}  concurrency={args.concurrency}")
+    await run_mode("inline", inline_login, args.logins, args.concurrency)
+    await run_mode("pool", pooled_login, args.logins, args.concurrency)
+    security.shutdown_hashing_pool()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    # security legge la configurazione all'import: impostiamola prima
+    os.environ["BCRYPT_ROUNDS"] = str(args.rounds)
+    os.environ["PASSWORD_HASH_WORKERS"] = str(args.workers)
+    os.environ.setdefault("PASSWORD_HASH_MAX_QUEUE", str(args.logins))
+    asyncio.run(main(args))
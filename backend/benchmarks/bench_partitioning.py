@@ -0,0 +1,217 @@
+# backend/benchmarks/bench_partitioning.py
+"""
+Partitioned vs unpartitioned schema at scale: index sizes and latency of the hot queries.
+
+    cd backend
+    python -m benchmarks.bench_partitioning --receipts 20000000 --items-per-receipt 5 --messages 100000000
+    python -m benchmarks.bench_partitioning --skip-load --queries 2000     # re-measure existing data
+
+Data is generated server-side (generate_series) into two throwaway schemas of the DATABASE_URL
+database: bench_plain (single heap tables, same indexes as init_db.py) and bench_part (the layout
+of app.db.partitioning). Both hold identical rows, so the comparison isolates partitioning.
+The defaults give 100M expense items and 100M chat messages: plan for ~60 GB of disk and an hour
+of loading. Drop the schemas afterwards with --drop.
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+import asyncpg
+
+from app.db.partitioning import (
+    HASH_PARTITIONS, PARTITIONED_TABLES, create_table_ddl, index_ddl, month_partition_ddl, month_range, month_start,
+)
+from benchmarks.seed import _dsn
+
+PLAIN, PART = "bench_plain", "bench_part"
+CHUNK = 2_000_000 # Righe per INSERT ... SELECT generate_series: transazioni di qualche secondo
+EPOCH = datetime(2024, 1, 1)
+
+PLAIN_DDL = [
+    f"""CREATE TABLE {PLAIN}.receipts (
+        id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, store_name VARCHAR, receipt_date TIMESTAMP,
+        total_amount DOUBLE PRECISION NOT NULL, currency VARCHAR NOT NULL, country VARCHAR,
+        file_url VARCHAR NOT NULL, status VARCHAR NOT NULL, created_at TIMESTAMP NOT NULL, updated_at TIMESTAMP NOT NULL)""",
+    f"""CREATE TABLE {PLAIN}.expense_items (
+        id INTEGER PRIMARY KEY, receipt_id INTEGER NOT NULL, user_id INTEGER NOT NULL,
+        description VARCHAR NOT NULL, amount DOUBLE PRECISION NOT NULL, category VARCHAR NOT NULL)""",
+    f"""CREATE TABLE {PLAIN}.chat_messages (
+        id VARCHAR PRIMARY KEY, session_id VARCHAR NOT NULL, role VARCHAR NOT NULL,
+        content TEXT NOT NULL, created_at TIMESTAMP NOT NULL)""",
+]
+
+# $1, $2 = primo e ultimo valore di g del lotto. Tutto deterministico: stesse righe in entrambi gli schemi
+GENERATORS = {
+    "receipts": """
+        SELECT g, 1 + g % {users}, 'Store ' || (g % 500), {epoch} + (g % {seconds}) * INTERVAL '1 second',
+               (g % 30000) / 100.0, 'EUR', 'Italy', 'https://cdn.example/users/' || (1 + g % {users}) || '/' || g || '.jpg',
+               'COMPLETED', {epoch} + (g % {seconds}) * INTERVAL '1 second', {epoch} + (g % {seconds}) * INTERVAL '1 second'
+        FROM generate_series($1::int, $2::int) g""",
+    # L'item n appartiene allo scontrino 1 + (n-1)/k e quindi al suo stesso utente
+    "expense_items": """
+        SELECT g, 1 + (g - 1) / {items}, 1 + (1 + (g - 1) / {items}) % {users}, 'Item ' || (g % 1000),
+               (g % 8000) / 100.0, 'OTHER'
+        FROM generate_series($1::int, $2::int) g""",
+    "chat_messages": """
+        SELECT md5(g::text), 's' || (g % {sessions}), CASE WHEN g % 2 = 0 THEN 'user' ELSE 'model' END,
+               'message ' || g, {epoch} + ((g::bigint * 7919) % {seconds}) * INTERVAL '1 second'
+        FROM generate_series($1::int, $2::int) g""",
+}
+
+QUERIES = {
+    "receipts_by_user": "SELECT * FROM {schema}.receipts WHERE user_id = $1 ORDER BY created_at DESC",
+    "items_by_user": "SELECT * FROM {schema}.expense_items WHERE user_id = $1",
+    "receipt_by_id": "SELECT file_url FROM {schema}.receipts WHERE id = $1 AND user_id = $2",
+    "last_50_messages": "SELECT * FROM {schema}.chat_messages WHERE session_id = $1 ORDER BY created_at DESC LIMIT 50",
+    "messages_last_30d": (
+        "SELECT * FROM {schema}.chat_messages WHERE session_id = $1 AND created_at >= $2 ORDER BY created_at"
+    ),
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200_000)
+    parser.add_argument("--receipts", type=int, default=20_000_000)
+    parser.add_argument("--items-per-receipt", type=int, default=5)
+    parser.add_argument("--messages", type=int, default=100_000_000)
+    parser.add_argument("--sessions-per-user", type=int, default=3)
+    parser.add_argument("--months", type=int, default=24, help="Spread created_at over N months from 2024-01")
+    parser.add_argument("--hash-partitions", type=int, default=HASH_PARTITIONS)
+    parser.add_argument("--queries", type=int, default=1000, help="Timed executions per query and schema")
+    parser.add_argument("--skip-load", action="store_true", help="Reuse the schemas from a previous run")
+    parser.add_argument("--drop", action="store_true", help="Drop both schemas and exit")
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args()
+
+
+def _span_seconds(months: int) -> int:
+    return (month_start(EPOCH.date(), months) - EPOCH.date()).days * 86400
+
+
+async def create_schemas(conn, args):
+    for schema in (PLAIN, PART):
+        await conn.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+        await conn.execute(f"CREATE SCHEMA {schema}")
+    for statement in PLAIN_DDL:
+        await conn.execute(statement)
+    for table in PARTITIONED_TABLES:
+        for statement in create_table_ddl(table, f"{PLAIN}.{table}", f"{PART}.{table}", f"{PART}.{table}",
+                                          args.hash_partitions):
+            await conn.execute(statement)
+    # Fino al mese prima di EPOCH + months: i created_at generati stanno in [EPOCH, EPOCH + months)
+    for month in month_range(EPOCH.date(), month_start(EPOCH.date(), args.months - 1)):
+        await conn.execute(month_partition_ddl(f"{PART}.chat_messages", f"{PART}.chat_messages", month))
+
+
+async def load(conn, args):
+    sizes = {
+        "receipts": args.receipts,
+        "expense_items": args.receipts * args.items_per_receipt,
+        "chat_messages": args.messages,
+    }
+    params = {
+        "users": args.users, "items": args.items_per_receipt, "sessions": args.users * args.sessions_per_user,
+        "seconds": _span_seconds(args.months), "epoch": f"TIMESTAMP '{EPOCH.isoformat(sep=' ')}'",
+    }
+    for table, rows in sizes.items():
+        generator = GENERATORS[table].format(**params)
+        started = time.perf_counter()
+        for first in range(1, rows + 1, CHUNK):
+            last = min(first + CHUNK - 1, rows)
+            # Stesso lotto in entrambi gli schemi: i dati restano identici anche se si interrompe
+            async with conn.transaction():
+                await conn.execute(f"INSERT INTO {PLAIN}.{table} {generator}", first, last)
+                await conn.execute(f"INSERT INTO {PART}.{table} {generator}", first, last)
+            rate = last / (time.perf_counter() - started)
+            print(f"  {table:<14} {last:>12,} / {rows:,}  ({rate:,.0f} rows/s per schema)", flush=True)
+
+
+async def create_indexes(conn):
+    for table, spec in PARTITIONED_TABLES.items():
+        for name, columns in spec.indexes.items():
+            await conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {PLAIN}.{table} {columns}")
+        for statement in index_ddl(table, f"{PART}.{table}"):
+            await conn.execute(statement)
+        print(f"  {table}: indexes built", flush=True)
+    await conn.execute(f"ANALYZE {', '.join(f'{s}.{t}' for s in (PLAIN, PART) for t in PARTITIONED_TABLES)}")
+
+
+async def report_sizes(conn):
+    # pg_partition_tree funziona anche su una tabella normale (una sola foglia: se stessa)
+    query = """
+        SELECT count(*), sum(pg_table_size(relid)), sum(pg_indexes_size(relid)), max(pg_indexes_size(relid))
+        FROM pg_partition_tree($1::regclass) WHERE isleaf
+    """
+    print(f"\n{'table':<15}{'schema':<13}{'leaves':>7}{'heap':>12}{'indexes':>12}{'largest leaf idx':>18}")
+    for table in PARTITIONED_TABLES:
+        for schema in (PLAIN, PART):
+            leaves, heap, indexes, largest = await conn.fetchrow(query, f"{schema}.{table}")
+            print(f"{table:<15}{schema:<13}{leaves:>7}{_mb(heap):>12}{_mb(indexes):>12}{_mb(largest):>18}")
+
+
+def _mb(value) -> str:
+    return f"{(value or 0) / 1024 / 1024:,.0f} MB"
+
+
+def _query_args(name: str, args, rng: random.Random):
+    user_id = rng.randint(1, args.users)
+    session = f"s{rng.randrange(args.users * args.sessions_per_user)}"
+    if name in ("receipts_by_user", "items_by_user"):
+        return (user_id,)
+    if name == "receipt_by_id":
+        receipt_id = rng.randint(1, args.receipts)
+        return (receipt_id, 1 + receipt_id % args.users)
+    if name == "last_50_messages":
+        return (session,)
+    window_end = EPOCH + timedelta(seconds=_span_seconds(args.months))
+    return (session, window_end - timedelta(days=30))
+
+
+async def report_latency(conn, args):
+    print(f"\n{'query':<20}{'schema':<13}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'scanned':>9}")
+    for name, template in QUERIES.items():
+        for schema in (PLAIN, PART):
+            sql = template.format(schema=schema)
+            statement = await conn.prepare(sql)
+            rng = random.Random(args.seed) # Stesse chiavi per i due schemi
+            plan = await conn.fetchval(f"EXPLAIN (FORMAT JSON) {sql}", *_query_args(name, args, random.Random(args.seed)))
+            scanned = str(plan).count('"Relation Name"')
+            for _ in range(min(50, args.queries)): # Warm-up: cache e piani
+                await statement.fetch(*_query_args(name, args, rng))
+            timings = []
+            for _ in range(args.queries):
+                query_args = _query_args(name, args, rng)
+                started = time.perf_counter()
+                await statement.fetch(*query_args)
+                timings.append((time.perf_counter() - started) * 1000)
+            q = statistics.quantiles(timings, n=100)
+            print(f"{name:<20}{schema:<13}{q[49]:>9.2f}{q[94]:>9.2f}{q[98]:>9.2f}{scanned:>9}")
+
+
+async def main(args):
+    conn = await asyncpg.connect(_dsn())
+    try:
+        if args.drop:
+            for schema in (PLAIN, PART):
+                await conn.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+            print("Benchmark schemas dropped")
+            return
+        if not args.skip_load:
+            print("Creating schemas...")
+            await create_schemas(conn, args)
+            print("Loading rows...")
+            await load(conn, args)
+            print("Building indexes...")
+            await create_indexes(conn)
+        await report_sizes(conn)
+        await report_latency(conn, args)
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
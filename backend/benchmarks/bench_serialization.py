@@ -0,0 +1,150 @@
+# backend/benchmarks/bench_serialization.py
+"""
+Costo di serializzazione per scontrino della risposta di GET /receipts, senza database:
+le righe sono sintetiche, quindi si misura solo il lavoro Python dopo la query.
+
+    cd backend
+    python -m benchmarks.bench_serialization --receipts 500 --items 8 --budget-us 15
+
+Percorsi confrontati:
+  orm       oggetti Receipt/ExpenseItem + model_dump(include=...) + jsonable_encoder + json.dumps (il vecchio endpoint)
+  pydantic  tuple -> ReceiptResponse validati -> TypeAdapter.dump_json
+  rows      tuple -> receipts_from_rows -> orjson.dumps (l'endpoint attuale)
+
+Il percorso orm qui è ottimista: non conta l'idratazione degli oggetti da parte della sessione.
+Esce con 1 se `rows` supera --budget-us per scontrino.
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+from typing import List
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+from app.db.models import ExpenseCategory, ExpenseItem, Receipt, ReceiptStatus
+from app.schemas.receipt import ITEM_FIELDS, RECEIPT_FIELDS, ReceiptResponse, receipts_from_rows
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--receipts", type=int, default=500, help="Receipts per response")
+    parser.add_argument("--items", type=int, default=8, help="Items per receipt")
+    parser.add_argument("--runs", type=int, default=30)
+    parser.add_argument("--budget-us", type=float, default=None, help="Max µs per receipt for the rows path")
+    parser.add_argument("--seed", type=int, default=7)
+    return parser.parse_args()
+
+
+def make_rows(receipts: int, items: int, seed: int):
+    rng = random.Random(seed)
+    categories = list(ExpenseCategory)
+    now = datetime(2026, 1, 1, 12, 0, 0, 123456)
+    receipt_rows, item_rows = [], []
+    item_id = 0
+    for receipt_id in range(1, receipts + 1):
+        created = now - timedelta(minutes=receipt_id)
+        values = {
+            "id": receipt_id, "user_id": 1, "store_name": f"Store {rng.randint(1, 200)}",
+            "receipt_date": created - timedelta(days=1), "total_amount": round(rng.uniform(1, 300), 2),
+            "currency": "EUR", "country": "Italy", "file_url": f"https://cdn.example/receipts/1/{receipt_id}.jpg",
+            "thumbnail_url": f"https://cdn.example/receipts/1/{receipt_id}.thumb.webp",
+            "preview_url": f"https://cdn.example/receipts/1/{receipt_id}.preview.webp", "duplicate_of": None,
+            "status": ReceiptStatus.COMPLETED, "created_at": created, "updated_at": created,
+        }
+        receipt_rows.append(tuple(values[name] for name in RECEIPT_FIELDS))
+        for _ in range(items):
+            item_id += 1
+            item = {
+                "id": item_id, "receipt_id": receipt_id, "description": f"Item {rng.randint(1, 10_000)}",
+                "amount": round(rng.uniform(0.5, 40), 2), "category": rng.choice(categories),
+            }
+            item_rows.append(tuple(item[name] for name in ITEM_FIELDS))
+    return receipt_rows, item_rows
+
+
+def make_orm_objects(receipt_rows, item_rows) -> List[Receipt]:
+    by_receipt = {}
+    for row in item_rows:
+        by_receipt.setdefault(row[ITEM_FIELDS.index("receipt_id")], []).append(ExpenseItem(**dict(zip(ITEM_FIELDS, row))))
+    receipts = []
+    for row in receipt_rows:
+        receipt = Receipt(**dict(zip(RECEIPT_FIELDS, row)))
+        receipt.items = by_receipt.get(receipt.id, [])
+        receipts.append(receipt)
+    return receipts
+
+
+# Solo i campi del contratto: colonne interne (ocr_run, image_hash, user_id delle voci) non escono dall'API
+_RECEIPT_FIELD_SET = set(RECEIPT_FIELDS)
+_ITEM_FIELD_SET = set(ITEM_FIELDS)
+
+
+def orm_path(receipts: List[Receipt]) -> bytes:
+    content = [
+        {**r.model_dump(include=_RECEIPT_FIELD_SET), "items": [i.model_dump(include=_ITEM_FIELD_SET) for i in r.items]}
+        for r in receipts
+    ]
+    # Quello che fanno FastAPI (jsonable_encoder) e JSONResponse.render di Starlette
+    return json.dumps(
+        jsonable_encoder(content), ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+    ).encode("utf-8")
+
+
+_adapter = TypeAdapter(List[ReceiptResponse])
+
+
+def pydantic_path(receipt_rows, item_rows) -> bytes:
+    return _adapter.dump_json(_adapter.validate_python(receipts_from_rows(receipt_rows, item_rows)))
+
+
+def rows_path(receipt_rows, item_rows) -> bytes:
+    return orjson.dumps(receipts_from_rows(receipt_rows, item_rows), option=orjson.OPT_NON_STR_KEYS)
+
+
+def measure(fn, runs: int) -> List[float]:
+    fn() # Warm-up
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def main(args) -> int:
+    receipt_rows, item_rows = make_rows(args.receipts, args.items, args.seed)
+    orm_objects = make_orm_objects(receipt_rows, item_rows)
+
+    # Stesso JSON (a meno della formattazione) da tutti e tre i percorsi
+    reference = json.loads(orm_path(orm_objects))
+    for name, payload in (("pydantic", pydantic_path(receipt_rows, item_rows)), ("rows", rows_path(receipt_rows, item_rows))):
+        if json.loads(payload) != reference:
+            print(f"❌ {name} path produces a different payload than the ORM path")
+            return 1
+
+    paths = {
+        "orm": lambda: orm_path(orm_objects),
+        "pydantic": lambda: pydantic_path(receipt_rows, item_rows),
+        "rows": lambda: rows_path(receipt_rows, item_rows),
+    }
+    print(f"{args.receipts} receipts x {args.items} items, {args.runs} runs, {len(rows_path(receipt_rows, item_rows))} bytes")
+    per_receipt = {}
+    for name, fn in paths.items():
+        timings = measure(fn, args.runs)
+        per_receipt[name] = statistics.median(timings) / args.receipts * 1e6
+        print(f"  {name:<9} median {statistics.median(timings) * 1000:8.2f} ms   {per_receipt[name]:7.2f} µs/receipt")
+    print(f"\nrows vs orm: {per_receipt['orm'] / per_receipt['rows']:.1f}x faster")
+
+    if args.budget_us is not None and per_receipt["rows"] > args.budget_us:
+        print(f"\n❌ rows path costs {per_receipt['rows']:.2f} µs/receipt (budget {args.budget_us:.2f} µs)")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(parse_args()))
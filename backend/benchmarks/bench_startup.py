@@ -0,0 +1,106 @@
+# backend/benchmarks/bench_startup.py
+"""
+Cold start budget: time to `import app.main` and time for the lifespan to become ready,
+each measured in a fresh interpreter (median of --runs). Exits 1 when a budget is exceeded,
+so it can gate CI the same way a test would.
+
+    cd backend
+    python -m benchmarks.bench_startup --runs 5 --import-budget-ms 1500 --startup-budget-ms 3000
+
+It also fails if boto3 or google.genai are imported by `import app.main`: those clients
+must be created lazily (see app.core.storage and app.services.gemini). The startup phase
+needs the usual .env; with the database down it still completes, only slower.
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+HEAVY_MODULES = ("boto3", "botocore", "google.genai")
+
+# Eseguito in un interprete pulito: niente cache di moduli dal processo del benchmark
+_PROBE = """
+import asyncio, json, sys, time
+started = time.perf_counter()
+import app.main
+imported = time.perf_counter()
+heavy = [name for name in {heavy!r} if name in sys.modules]
+
+async def run_lifespan():
+    begin = time.perf_counter()
+    async with app.main.app.router.lifespan_context(app.main.app):
+        return time.perf_counter() - begin
+
+startup = asyncio.run(run_lifespan()) if {startup!r} else 0.0
+print(json.dumps({{"import_ms": (imported - started) * 1000, "startup_ms": startup * 1000, "heavy": heavy}}))
+"""
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--import-budget-ms", type=float, default=1500.0)
+    parser.add_argument("--startup-budget-ms", type=float, default=3000.0)
+    parser.add_argument("--skip-startup", action="store_true", help="Measure imports only (no database needed)")
+    parser.add_argument("--top", type=int, default=10, help="Show the N slowest imports (python -X importtime)")
+    return parser.parse_args()
+
+
+def probe(run_startup: bool) -> dict:
+    code = _PROBE.format(heavy=HEAVY_MODULES, startup=run_startup)
+    output = subprocess.run(
+        [sys.executable, "-c", code], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def slowest_imports(top: int) -> list:
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.main"],
+        cwd=BACKEND_DIR, capture_output=True, text=True, check=True,
+    ).stderr
+    rows = []
+    for line in stderr.splitlines():
+        # "import time:  self [us] | cumulative | imported package", l'indentazione del nome è la profondità
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((int(cumulative_us), name.strip(), depth))
+    # Solo i moduli di primo livello danno un'idea utile di "chi pesa"
+    top_level = [(us, name) for us, name, depth in rows if depth == 0]
+    return sorted(top_level or rows, reverse=True)[:top]
+
+
+def main(args) -> int:
+    results = [probe(not args.skip_startup) for _ in range(args.runs)]
+    import_ms = statistics.median(r["import_ms"] for r in results)
+    startup_ms = statistics.median(r["startup_ms"] for r in results)
+    heavy = sorted({name for r in results for name in r["heavy"]})
+
+    print(f"import app.main   median {import_ms:8.1f} ms   budget {args.import_budget_ms:8.1f} ms")
+    if not args.skip_startup:
+        print(f"lifespan startup  median {startup_ms:8.1f} ms   budget {args.startup_budget_ms:8.1f} ms")
+    print("\nslowest imports (cumulative):")
+    for us, name in slowest_imports(args.top):
+        print(f"  {us / 1000:8.1f} ms  {name}")
+
+    failures = []
+    if import_ms > args.import_budget_ms:
+        failures.append(f"import took {import_ms:.0f} ms (budget {args.import_budget_ms:.0f} ms)")
+    if not args.skip_startup and startup_ms > args.startup_budget_ms:
+        failures.append(f"startup took {startup_ms:.0f} ms (budget {args.startup_budget_ms:.0f} ms)")
+    if heavy:
+        failures.append(f"heavy modules imported eagerly: {', '.join(heavy)}")
+    if failures:
+        print("\n❌ " + "\n❌ ".join(failures))
+        return 1
+    print("\n✅ Within budget")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(parse_args()))
@@ -0,0 +1,378 @@
+# backend/benchmarks/load.py
+"""
+End-to-end load suite: the real FastAPI app on uvicorn, a real PostgreSQL, and local stubs
+for S3 (moto), Gemini (benchmarks.stubs.FakeGemini) and SMTP (aiosmtpd).
+
+    cd backend
+    pip install -r benchmarks/requirements.txt
+    python init_db.py && python -m benchmarks.seed --users 1000 --receipts 1000000
+    python -m benchmarks.load --scenarios receipts,analytics,login --concurrency 16 --duration 20
+    python -m benchmarks.load --save-baseline main        # write benchmarks/baselines/main.json
+    python -m benchmarks.load --compare main              # exit 1 if something regressed
+
+For every scenario it reports throughput, p50/p95/p99 latency, error count and SQL queries per
+request. Queries are counted server-side via SQLAlchemy cursor events, attributed to the request
+that issued them and stopped when the last body chunk is sent (background tasks excluded).
+Rate limits are switched off: we measure handlers, not the limiter.
+
+With --url the suite targets an already running server instead; query counts are then unavailable.
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import random
+import statistics
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from benchmarks.seed import BENCH_PASSWORD
+from benchmarks.stubs import FakeGemini, FakeS3, SMTPSink, free_port, _wait_for_port
+
+BASELINE_DIR = Path(__file__).parent / "baselines"
+SCENARIOS = ["login", "receipts", "analytics", "export", "upload", "chat"]
+
+# Tolleranze per --compare: oltre queste soglie lo scenario è considerato regredito
+REGRESSION_LATENCY = 0.15     # p95 più lento del 15%
+REGRESSION_THROUGHPUT = 0.15  # 15% di richieste/s in meno
+# Un 1x1 PNG valido: l'upload passa il controllo del content-type e finisce su S3 come un file vero
+TINY_PNG = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c63f8cfc0f01f0005000201a3e1f5d20000000049454e44ae426082"
+)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"Comma separated, from: {', '.join(SCENARIOS)}")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent virtual users per scenario")
+    parser.add_argument("--duration", type=float, default=20.0, help="Measured seconds per scenario")
+    parser.add_argument("--warmup", type=float, default=2.0, help="Unmeasured seconds before each scenario")
+    parser.add_argument("--users", type=int, default=50, help="Seeded bench users to log in as")
+    parser.add_argument("--gemini-latency-ms", type=float, default=800.0)
+    parser.add_argument("--gemini-jitter-ms", type=float, default=200.0)
+    parser.add_argument("--gemini-error-rate", type=float, default=0.0, help="Share of fake Gemini calls answering 503")
+    parser.add_argument("--url", help="Target an already running server (no stubs, no query counts)")
+    parser.add_argument("--save-baseline", metavar="NAME", help="Save results to benchmarks/baselines/NAME.json")
+    parser.add_argument("--compare", metavar="NAME", help="Compare against benchmarks/baselines/NAME.json")
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args()
+
+
+# --- CONTEGGIO QUERY PER RICHIESTA (lato server) ---
+
+_query_counter: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar("bench_query_counter", default=None)
+_queries_by_request: Dict[str, int] = {}
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    # SQLAlchemy copia il contesto nel greenlet che esegue il driver: il contatore è quello della richiesta
+    counter = _query_counter.get()
+    if counter is not None:
+        counter[0] += 1
+
+
+class QueryCountMiddleware:
+    """ASGI puro (niente task extra): registra le query della richiesta marcata con X-Bench-Id."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        bench_id = dict(scope["headers"]).get(b"x-bench-id", b"").decode()
+        counter = [0]
+        token = _query_counter.set(counter)
+
+        async def send_and_record(message):
+            if bench_id and message["type"] == "http.response.body" and not message.get("more_body"):
+                _queries_by_request[bench_id] = counter[0]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_and_record)
+        finally:
+            _query_counter.reset(token)
+
+
+# --- RISULTATI ---
+
+@dataclass
+class ScenarioResult:
+    name: str
+    requests: int = 0
+    errors: int = 0
+    elapsed: float = 0.0
+    latencies_ms: List[float] = field(default_factory=list, repr=False)
+    queries: List[int] = field(default_factory=list, repr=False)
+    status_codes: Dict[str, int] = field(default_factory=dict)
+
+    def percentile(self, pct: float) -> float:
+        if not self.latencies_ms:
+            return 0.0
+        ordered = sorted(self.latencies_ms)
+        return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+    def summary(self) -> dict:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "throughput_rps": round(self.requests / self.elapsed, 2) if self.elapsed else 0.0,
+            "p50_ms": round(self.percentile(50), 2),
+            "p95_ms": round(self.percentile(95), 2),
+            "p99_ms": round(self.percentile(99), 2),
+            "queries_per_request": round(statistics.mean(self.queries), 2) if self.queries else None,
+            "max_queries": max(self.queries) if self.queries else None,
+            "status_codes": self.status_codes,
+        }
+
+
+# --- SCENARI ---
+
+@dataclass
+class VirtualUser:
+    email: str
+    token: str = ""
+    chat_session_id: Optional[str] = None
+
+
+# Ogni scenario riceve gli header già pronti: Authorization + X-Bench-Id per il conteggio delle query
+
+async def _login(client, user: VirtualUser, headers: Optional[dict] = None):
+    return await client.post("/auth/login", data={"username": user.email, "password": BENCH_PASSWORD}, headers=headers)
+
+
+async def scenario_login(client, user: VirtualUser, headers: dict):
+    headers.pop("Authorization")
+    return await _login(client, user, headers)
+
+
+async def scenario_receipts(client, user: VirtualUser, headers: dict):
+    # La lista che il frontend interroga in polling mentre l'OCR lavora
+    return await client.get("/receipts", headers=headers)
+
+
+async def scenario_analytics(client, user: VirtualUser, headers: dict):
+    end = time.strftime("%Y-%m-%d")
+    start = time.strftime("%Y-%m-%d", time.gmtime(time.time() - 365 * 86400))
+    return await client.get("/api/analytics/", params={"start_date": start, "end_date": end}, headers=headers)
+
+
+async def scenario_export(client, user: VirtualUser, headers: dict):
+    return await client.get("/receipts/export", headers=headers)
+
+
+async def scenario_upload(client, user: VirtualUser, headers: dict):
+    files = {"file": (f"{uuid.uuid4().hex}.png", TINY_PNG, "image/png")}
+    return await client.post("/receipts/upload", files=files, headers=headers)
+
+
+async def scenario_chat(client, user: VirtualUser, headers: dict):
+    payload = {"message": "How much did I spend on groceries this month?", "session_id": user.chat_session_id}
+    response = await client.post("/ai/chat", json=payload, headers=headers)
+    if response.status_code == 200 and not user.chat_session_id:
+        user.chat_session_id = response.json().get("session_id")
+    return response
+
+
+SCENARIO_FUNCS: Dict[str, Callable[..., Awaitable]] = {
+    "login": scenario_login,
+    "receipts": scenario_receipts,
+    "analytics": scenario_analytics,
+    "export": scenario_export,
+    "upload": scenario_upload,
+    "chat": scenario_chat,
+}
+
+
+async def run_scenario(name: str, client, users: List[VirtualUser], args, count_queries: bool) -> ScenarioResult:
+    func = SCENARIO_FUNCS[name]
+    result = ScenarioResult(name=name)
+    measuring = False
+    stop_at = 0.0
+
+    async def worker(index: int):
+        n = index
+        while time.perf_counter() < stop_at:
+            user = users[n % len(users)]
+            n += args.concurrency
+            bench_id = uuid.uuid4().hex
+            headers = {"Authorization": f"Bearer {user.token}", "X-Bench-Id": bench_id}
+            started = time.perf_counter()
+            try:
+                response = await func(client, user, headers)
+                status_key = str(response.status_code)
+                failed = response.status_code >= 400
+            except Exception as e:
+                status_key, failed = type(e).__name__, True
+            latency = (time.perf_counter() - started) * 1000
+            queries = _queries_by_request.pop(bench_id, None)
+            if not measuring:
+                continue
+            result.requests += 1
+            result.errors += failed
+            result.latencies_ms.append(latency)
+            result.status_codes[status_key] = result.status_codes.get(status_key, 0) + 1
+            if count_queries and queries is not None:
+                result.queries.append(queries)
+
+    stop_at = time.perf_counter() + args.warmup + args.duration
+    workers = [asyncio.create_task(worker(index)) for index in range(args.concurrency)]
+    await asyncio.sleep(args.warmup)
+    measuring = True
+    measured_from = time.perf_counter()
+    await asyncio.gather(*workers)
+    result.elapsed = time.perf_counter() - measured_from
+    return result
+
+
+# --- SERVER IN-PROCESS ---
+
+def start_app_server() -> tuple:
+    """Importa l'app DOPO aver impostato l'ambiente degli stub e la serve con uvicorn in un thread."""
+    import uvicorn
+    from sqlalchemy import event
+    from app.main import app
+    from app.core.limiter import limiter
+    from app.db.database import engine
+
+    limiter.enabled = False
+    event.listen(engine.sync_engine, "before_cursor_execute", _count_query)
+    app.add_middleware(QueryCountMiddleware)
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, name="spendscope-bench", daemon=True)
+    thread.start()
+    _wait_for_port(port, timeout=60)
+    return f"http://127.0.0.1:{port}", server, thread
+
+
+async def pick_users(count: int, seed: int) -> List[VirtualUser]:
+    import asyncpg
+    from benchmarks.seed import _dsn
+
+    conn = await asyncpg.connect(_dsn())
+    try:
+        emails = [row["email"] for row in await conn.fetch(
+            "SELECT email FROM users WHERE email LIKE 'bench%@spendscope.test' AND is_active ORDER BY id"
+        )]
+    finally:
+        await conn.close()
+    if not emails:
+        raise SystemExit("No bench users found: run `python -m benchmarks.seed` first")
+    random.Random(seed).shuffle(emails)
+    return [VirtualUser(email=email) for email in emails[:count]]
+
+
+# --- BASELINE ---
+
+def compare(current: dict, baseline: dict) -> List[str]:
+    regressions = []
+    for name, now in current.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        if before["p95_ms"] and now["p95_ms"] > before["p95_ms"] * (1 + REGRESSION_LATENCY):
+            regressions.append(f"{name}: p95 {before['p95_ms']} -> {now['p95_ms']} ms")
+        if before["throughput_rps"] and now["throughput_rps"] < before["throughput_rps"] * (1 - REGRESSION_THROUGHPUT):
+            regressions.append(f"{name}: throughput {before['throughput_rps']} -> {now['throughput_rps']} req/s")
+        if before.get("queries_per_request") is not None and now.get("queries_per_request") is not None \
+                and now["queries_per_request"] > before["queries_per_request"]:
+            regressions.append(f"{name}: queries/request {before['queries_per_request']} -> {now['queries_per_request']}")
+        if now["errors"] > before["errors"]:
+            regressions.append(f"{name}: errors {before['errors']} -> {now['errors']}")
+    return regressions
+
+
+def print_table(summaries: dict):
+    print(f"\n{'scenario':<10} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'queries':>8} {'errors':>7}")
+    for name, s in summaries.items():
+        queries = "-" if s["queries_per_request"] is None else f"{s['queries_per_request']:.1f}"
+        print(
+            f"{name:<10} {s['throughput_rps']:>9.1f} {s['p50_ms']:>9.1f} {s['p95_ms']:>9.1f} "
+            f"{s['p99_ms']:>9.1f} {queries:>8} {s['errors']:>7}"
+        )
+
+
+async def main(args) -> int:
+    import httpx
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(scenarios) - set(SCENARIO_FUNCS)
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    stubs, server = [], None
+    if args.url:
+        base_url = args.url
+    else:
+        stubs = [
+            FakeS3().start(),
+            FakeGemini(args.gemini_latency_ms, args.gemini_jitter_ms, args.gemini_error_rate).start(),
+            SMTPSink().start(),
+        ]
+        for stub in stubs:
+            os.environ.update(stub.env())
+        # Il governatore deve misurare il server, non i limiti di quota del piano Gemini
+        os.environ.setdefault("GEMINI_REQUESTS_PER_MINUTE", "100000")
+        os.environ.setdefault("GEMINI_TOKENS_PER_MINUTE", "1000000000")
+        base_url, server, thread = start_app_server()
+
+    users = await pick_users(args.users, args.seed)
+    limits = httpx.Limits(max_connections=args.concurrency * 2, max_keepalive_connections=args.concurrency * 2)
+    summaries = {}
+    try:
+        async with httpx.AsyncClient(base_url=base_url, timeout=120.0, limits=limits) as client:
+            # Un access token per utente, una volta sola: solo lo scenario "login" misura il login
+            for user in users:
+                response = await _login(client, user)
+                response.raise_for_status()
+                user.token = response.json()["access_token"]
+
+            for name in scenarios:
+                print(f"▶ {name}: {args.concurrency} users for {args.duration:.0f}s (+{args.warmup:.0f}s warmup)", flush=True)
+                result = await run_scenario(name, client, users, args, count_queries=not args.url)
+                summaries[name] = result.summary()
+    finally:
+        if server:
+            server.should_exit = True
+            thread.join(timeout=10)
+        for stub in stubs:
+            stub.stop()
+
+    print_table(summaries)
+    fake_gemini = next((stub for stub in stubs if isinstance(stub, FakeGemini)), None)
+    if fake_gemini:
+        print(f"\nfake Gemini calls: {fake_gemini.calls}")
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "settings": {key: getattr(args, key) for key in ("concurrency", "duration", "users", "gemini_latency_ms")},
+        "scenarios": summaries,
+    }
+    if args.save_baseline:
+        BASELINE_DIR.mkdir(exist_ok=True)
+        path = BASELINE_DIR / f"{args.save_baseline}.json"
+        path.write_text(json.dumps(report, indent=2))
+        print(f"Baseline saved to {path}")
+    if args.compare:
+        baseline = json.loads((BASELINE_DIR / f"{args.compare}.json").read_text())
+        regressions = compare(summaries, baseline["scenarios"])
+        if regressions:
+            print("\n❌ Regressions against baseline:")
+            for line in regressions:
+                print(f"  - {line}")
+            return 1
+        print(f"\n✅ No regressions against baseline '{args.compare}'")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(asyncio.run(main(parse_args())))
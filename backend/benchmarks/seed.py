@@ -0,0 +1,218 @@
+# backend/benchmarks/seed.py
+"""
+Synthetic data generator for the load suite: users, receipts, expense items and chat history,
+written with PostgreSQL COPY (asyncpg) so a million receipts take minutes, not hours.
+
+    cd backend
+    python init_db.py                                   # schema first
+    python -m benchmarks.seed --users 1000 --receipts 1000000
+
+Every seeded user logs in with BENCH_PASSWORD as bench{n:06d}@spendscope.test. Ids are assigned
+here and the sequences are moved past them at the end, so run it on a dedicated database while
+nothing else is writing. --reset TRUNCATEs every application table first.
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+
+BENCH_PASSWORD = "benchmark-password"
+BENCH_EMAIL = "bench{:06d}@spendscope.test"
+
+STORES = [
+    ("Esselunga", "Italy", "EUR"), ("Carrefour", "France", "EUR"), ("Tesco", "United Kingdom", "GBP"),
+    ("Walmart", "United States", "USD"), ("Lidl", "Germany", "EUR"), ("Coop", "Italy", "EUR"),
+    ("Trenitalia", "Italy", "EUR"), ("Boots", "United Kingdom", "GBP"), ("Target", "United States", "USD"),
+]
+CATEGORIES = ["FOOD_AND_GROCERIES", "TRANSPORTATION", "UTILITIES", "ENTERTAINMENT", "HEALTHCARE", "OTHER"]
+# La maggior parte degli scontrini è completata, una coda piccola è ancora in lavorazione o fallita
+STATUSES = ["COMPLETED"] * 94 + ["PENDING"] * 3 + ["FAILED"] * 3
+
+APP_TABLES = [
+    "expense_items", "receipts", "chat_messages", "chat_sessions", "user_sessions",
+    "model_calls", "account_deletion_jobs", "users",
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--receipts", type=int, default=1_000_000, help="Total receipts across all users")
+    parser.add_argument("--max-items", type=int, default=6, help="Items per receipt are drawn from 1..N")
+    parser.add_argument("--chat-sessions", type=int, default=2, help="Chat sessions per user")
+    parser.add_argument("--chat-messages", type=int, default=30, help="Messages per chat session")
+    parser.add_argument("--days", type=int, default=730, help="Spread receipt dates over the last N days")
+    parser.add_argument("--batch", type=int, default=20_000, help="Receipts per COPY batch")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--reset", action="store_true", help="TRUNCATE all application tables first")
+    return parser.parse_args()
+
+
+def _dsn() -> str:
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    url = os.getenv("DATABASE_URL")
+    if not url:
+        raise SystemExit("DATABASE_URL is not set")
+    # asyncpg vuole il DSN libpq puro, senza il driver di SQLAlchemy
+    return url.replace("postgresql+asyncpg://", "postgresql://", 1)
+
+
+def _user_receipt_counts(users: int, receipts: int, rng: random.Random) -> list:
+    """Distribuzione a coda lunga: pochi utenti con tantissimi scontrini, come in produzione."""
+    weights = [rng.paretovariate(1.5) for _ in range(users)]
+    scale = receipts / sum(weights)
+    counts = [int(weight * scale) for weight in weights]
+    for index in range(receipts - sum(counts)):
+        counts[index % users] += 1
+    return counts
+
+
+async def _next_id(conn, table: str) -> int:
+    return (await conn.fetchval(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {table}"))
+
+
+async def _sync_sequence(conn, table: str):
+    await conn.execute(
+        f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT COALESCE(MAX(id), 1) FROM {table}))"
+    )
+
+
+async def seed_users(conn, args) -> list:
+    from app.core.security import get_password_hash
+
+    password_hash = get_password_hash(BENCH_PASSWORD) # Un solo hash: bcrypt è lento apposta
+    first_id = await _next_id(conn, "users")
+    now = datetime.utcnow()
+    rows = [
+        (first_id + n, BENCH_EMAIL.format(first_id + n), password_hash, f"Bench User {first_id + n}", True, now)
+        for n in range(args.users)
+    ]
+    await conn.copy_records_to_table(
+        "users", records=rows,
+        columns=["id", "email", "hashed_password", "full_name", "is_active", "created_at"],
+    )
+    await _sync_sequence(conn, "users")
+    return [row[0] for row in rows]
+
+
+async def seed_receipts(conn, args, user_ids: list, rng: random.Random):
+    from app.core.storage import S3_BUCKET_NAME, S3_ENDPOINT_URL
+
+    counts = _user_receipt_counts(len(user_ids), args.receipts, rng)
+    receipt_id = await _next_id(conn, "receipts")
+    item_id = await _next_id(conn, "expense_items")
+    now = datetime.utcnow()
+
+    receipts, items = [], []
+    written_receipts = written_items = 0
+    started = time.perf_counter()
+
+    async def flush():
+        nonlocal written_receipts, written_items
+        if not receipts:
+            return
+        await conn.copy_records_to_table(
+            "receipts", records=receipts,
+            columns=["id", "user_id", "store_name", "receipt_date", "total_amount", "currency", "country",
+                     "file_url", "status", "created_at", "updated_at"],
+        )
+        await conn.copy_records_to_table(
+            "expense_items", records=items,
+            columns=["id", "receipt_id", "user_id", "description", "amount", "category"],
+        )
+        written_receipts += len(receipts)
+        written_items += len(items)
+        receipts.clear()
+        items.clear()
+        rate = written_receipts / (time.perf_counter() - started)
+        print(f"  receipts {written_receipts:>10,}  items {written_items:>11,}  ({rate:,.0f} receipts/s)", flush=True)
+
+    for user_id, count in zip(user_ids, counts):
+        for _ in range(count):
+            store, country, currency = rng.choice(STORES)
+            status = rng.choice(STATUSES)
+            uploaded_at = now - timedelta(days=rng.uniform(0, args.days))
+            receipt_items = []
+            if status == "COMPLETED":
+                for n in range(rng.randint(1, args.max_items)):
+                    receipt_items.append(
+                        (item_id, receipt_id, user_id, f"Item {n + 1}", round(rng.uniform(0.5, 80.0), 2), rng.choice(CATEGORIES))
+                    )
+                    item_id += 1
+            completed = status == "COMPLETED"
+            receipts.append((
+                receipt_id, user_id,
+                store if completed else None,
+                uploaded_at - timedelta(hours=rng.uniform(0, 48)) if completed else None,
+                round(sum(item[4] for item in receipt_items), 2),
+                currency, country if completed else None,
+                f"{S3_ENDPOINT_URL}/{S3_BUCKET_NAME}/users/{user_id}/seed-{receipt_id}.jpg",
+                status, uploaded_at, uploaded_at,
+            ))
+            items.extend(receipt_items)
+            receipt_id += 1
+            if len(receipts) >= args.batch:
+                await flush()
+    await flush()
+    await _sync_sequence(conn, "receipts")
+    await _sync_sequence(conn, "expense_items")
+
+
+async def seed_chats(conn, args, user_ids: list, rng: random.Random):
+    if not args.chat_sessions:
+        return
+    now = datetime.utcnow()
+    sessions, messages = [], []
+    for user_id in user_ids:
+        for n in range(args.chat_sessions):
+            session_id = str(uuid.uuid4())
+            started_at = now - timedelta(days=rng.uniform(1, 60))
+            last_at = started_at
+            for m in range(args.chat_messages):
+                last_at = started_at + timedelta(minutes=m)
+                role = "user" if m % 2 == 0 else "model"
+                content = "How much did I spend on groceries?" if role == "user" else "You spent 42.00 EUR on groceries."
+                messages.append((str(uuid.uuid4()), session_id, role, content, last_at))
+            sessions.append((
+                session_id, user_id, f"Bench chat {n + 1}", started_at, last_at,
+                args.chat_messages, last_at if args.chat_messages else None,
+            ))
+    await conn.copy_records_to_table(
+        "chat_sessions", records=sessions,
+        columns=["id", "user_id", "title", "created_at", "updated_at", "message_count", "last_message_at"],
+    )
+    await conn.copy_records_to_table(
+        "chat_messages", records=messages,
+        columns=["id", "session_id", "role", "content", "created_at"],
+    )
+    print(f"  chat sessions {len(sessions):,}  messages {len(messages):,}")
+
+
+async def main(args):
+    import asyncpg
+
+    rng = random.Random(args.seed)
+    conn = await asyncpg.connect(_dsn())
+    try:
+        if args.reset:
+            await conn.execute(f"TRUNCATE {', '.join(APP_TABLES)} RESTART IDENTITY CASCADE")
+            print("Tables truncated")
+        started = time.perf_counter()
+        user_ids = await seed_users(conn, args)
+        print(f"Users: {len(user_ids):,} (password: {BENCH_PASSWORD})")
+        await seed_receipts(conn, args, user_ids, rng)
+        await seed_chats(conn, args, user_ids, rng)
+        # Statistiche fresche: senza ANALYZE il planner ragiona su tabelle "vuote"
+        await conn.execute("ANALYZE")
+        print(f"Done in {time.perf_counter() - started:.1f}s")
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,206 @@
+# backend/benchmarks/stubs.py
+"""
+Local stand-ins for the external services, so the load suite never touches R2, Gemini or Aruba:
+
+- FakeS3:      moto's S3 server on localhost (same boto3 calls, objects kept in memory)
+- FakeGemini:  tiny HTTP server speaking the generateContent REST API, with configurable latency
+- SMTPSink:    aiosmtpd server that accepts and counts every message
+
+Each stub exposes `env()`: the variables to set BEFORE importing `app`, because storage, gemini
+and email read their configuration at import time.
+"""
+import asyncio
+import json
+import random
+import socket
+import threading
+import time
+
+RECEIPT_STORES = ["Esselunga", "Carrefour", "Coop", "Lidl", "Conad", "IKEA", "Trenitalia", "Farmacia Centrale"]
+RECEIPT_CATEGORIES = ["FOOD_AND_GROCERIES", "TRANSPORTATION", "UTILITIES", "ENTERTAINMENT", "HEALTHCARE", "OTHER"]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class FakeS3:
+    """moto in server mode: boto3 parla HTTP vero, quindi i costi di serializzazione restano nel conto."""
+
+    def __init__(self, bucket: str = "spendscope-bench"):
+        self.bucket = bucket
+        self.port = free_port()
+        self._server = None
+
+    def start(self):
+        import boto3
+        from moto.server import ThreadedMotoServer
+
+        self._server = ThreadedMotoServer(ip_address="127.0.0.1", port=self.port, verbose=False)
+        self._server.start()
+        boto3.client("s3", **self._client_kwargs()).create_bucket(Bucket=self.bucket)
+        return self
+
+    def _client_kwargs(self) -> dict:
+        return {
+            "endpoint_url": self.url,
+            "aws_access_key_id": "bench",
+            "aws_secret_access_key": "bench",
+            "region_name": "us-east-1",
+        }
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def env(self) -> dict:
+        return {
+            "S3_ENDPOINT_URL": self.url,
+            "S3_BUCKET_NAME": self.bucket,
+            "AWS_ACCESS_KEY_ID": "bench",
+            "AWS_SECRET_ACCESS_KEY": "bench",
+            "AWS_DEFAULT_REGION": "us-east-1",
+        }
+
+    def stop(self):
+        if self._server:
+            self._server.stop()
+
+
+class FakeGemini:
+    """
+    Risponde a POST /v1beta/models/{model}:generateContent dopo `latency_ms` (± jitter).
+    Se la richiesta chiede JSON (OCR) restituisce uno scontrino plausibile, altrimenti testo (chat, riassunti).
+    """
+
+    def __init__(self, latency_ms: float = 800.0, jitter_ms: float = 200.0, error_rate: float = 0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.port = free_port()
+        self.calls = 0
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def env(self) -> dict:
+        return {"GEMINI_BASE_URL": self.url, "GEMINI_API_KEY": "bench", "GOOGLE_API_KEY": "bench"}
+
+    def _receipt(self) -> dict:
+        items = [
+            {
+                "description": f"Item {index + 1}",
+                "amount": round(random.uniform(0.5, 40.0), 2),
+                "category": random.choice(RECEIPT_CATEGORIES),
+            }
+            for index in range(random.randint(1, 6))
+        ]
+        return {
+            "store_name": random.choice(RECEIPT_STORES),
+            "receipt_date": time.strftime("%Y-%m-%d"),
+            "total_amount": round(sum(item["amount"] for item in items), 2),
+            "currency": "EUR",
+            "country": "Italy",
+            "items": items,
+        }
+
+    def _response(self, request_body: dict, model: str) -> dict:
+        config = request_body.get("generationConfig") or {}
+        if config.get("responseMimeType") == "application/json":
+            text = json.dumps(self._receipt())
+        else:
+            text = "<thinking>Sum the matching receipts.</thinking>You spent 42.00 EUR on groceries this month."
+        prompt_tokens = max(1, len(json.dumps(request_body)) // 4)
+        completion_tokens = max(1, len(text) // 4)
+        return {
+            "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP", "index": 0}],
+            "usageMetadata": {
+                "promptTokenCount": prompt_tokens,
+                "candidatesTokenCount": completion_tokens,
+                "totalTokenCount": prompt_tokens + completion_tokens,
+            },
+            "modelVersion": model,
+        }
+
+    def start(self):
+        import uvicorn
+        from fastapi import FastAPI, Request
+        from fastapi.responses import JSONResponse
+
+        api = FastAPI()
+
+        @api.post("/{version}/models/{model_action:path}")
+        async def generate_content(version: str, model_action: str, request: Request):
+            self.calls += 1
+            delay = max(0.0, self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+            await asyncio.sleep(delay)
+            if self.error_rate and random.random() < self.error_rate:
+                return JSONResponse(
+                    {"error": {"code": 503, "message": "overloaded", "status": "UNAVAILABLE"}}, status_code=503
+                )
+            model = model_action.split(":", 1)[0]
+            return self._response(await request.json(), model)
+
+        config = uvicorn.Config(api, host="127.0.0.1", port=self.port, log_level="warning", lifespan="off")
+        self._server = uvicorn.Server(config)
+        self._thread = threading.Thread(target=self._server.run, name="fake-gemini", daemon=True)
+        self._thread.start()
+        _wait_for_port(self.port)
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.should_exit = True
+            self._thread.join(timeout=5)
+
+
+class SMTPSink:
+    """Accetta qualsiasi messaggio senza autenticazione (SMTP_SECURITY=none) e lo scarta."""
+
+    def __init__(self):
+        self.port = free_port()
+        self.received = 0
+        self._controller = None
+
+    def env(self) -> dict:
+        return {
+            "SMTP_SERVER": "127.0.0.1",
+            "SMTP_PORT": str(self.port),
+            "SMTP_USER": "bench@spendscope.test",
+            "SMTP_PASSWORD": "",
+            "SMTP_SECURITY": "none",
+        }
+
+    def start(self):
+        from aiosmtpd.controller import Controller
+
+        sink = self
+
+        class _Handler:
+            async def handle_DATA(self, server, session, envelope):
+                sink.received += 1
+                return "250 OK"
+
+        self._controller = Controller(_Handler(), hostname="127.0.0.1", port=self.port)
+        self._controller.start()
+        return self
+
+    def stop(self):
+        if self._controller:
+            self._controller.stop()
+
+
+def _wait_for_port(port: int, timeout: float = 10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"Stub on port {port} did not start within {timeout}s")
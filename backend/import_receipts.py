@@ -0,0 +1,362 @@
+# backend/import_receipts.py
+"""
+Import massivo per l'onboarding: anni di scontrini cartacei o di fogli di calcolo in un colpo solo.
+
+    python import_receipts.py images ./scansioni --email mario@example.com --concurrency 4
+    python import_receipts.py csv spese.csv --user-id 42
+
+images  Ogni immagine/PDF della cartella (ricorsiva) fa lo stesso giro di /receipts/upload:
+        storage, scontrino PENDING, thumbnail/preview e OCR. Al massimo --concurrency file in volo;
+        l'OCR passa comunque dal governatore di Gemini con priorità bassa. Lo stato di ogni file
+        finisce in un file JSONL (default <cartella>/.spendscope-import.jsonl): se lo script si
+        interrompe basta rilanciarlo, i file completati vengono saltati e quelli già caricati
+        ripetono solo l'OCR. --retry-failed riprova anche quelli falliti.
+
+csv     Dati già strutturati, una riga per voce di spesa:
+            receipt_ref,date,store_name,currency,country,description,amount,category[,total_amount]
+        Le righe con lo stesso receipt_ref formano uno scontrino (total_amount, se manca, è la somma
+        delle voci). date è YYYY-MM-DD o DD/MM/YYYY, category è una di ExpenseCategory (nome o valore).
+        Tutto va in una transazione con COPY: o entra l'intero file o niente. Lo stesso file non
+        viene importato due volte per lo stesso utente, a meno di --force.
+"""
+import argparse
+import asyncio
+import csv
+import hashlib
+import json
+import mimetypes
+import time
+from datetime import datetime
+from pathlib import Path
+
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.db.database import engine
+from app.db.models import ExpenseCategory, Receipt, ReceiptStatus, User
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".pdf")
+STATE_FILE = ".spendscope-import.jsonl"
+CSV_COLUMNS = ("receipt_ref", "date", "store_name", "currency", "country", "description", "amount", "category")
+# Gli stessi alias che accetta l'OCR (app.services.ocr.ExpenseItem.format_category)
+CATEGORY_ALIASES = {"OTHERS": "OTHER", "HEALTH": "HEALTHCARE"}
+DATE_FORMATS = ("%Y-%m-%d", "%d/%m/%Y")
+# file_url degli scontrini importati da CSV: non c'è un originale, ma la colonna è NOT NULL
+CSV_URL_PREFIX = "import://"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="mode", required=True)
+
+    images = subparsers.add_parser("images", help="Upload and OCR a directory of images/PDFs")
+    images.add_argument("directory", type=Path)
+    images.add_argument("--concurrency", type=int, default=4, help="Files in flight at the same time")
+    images.add_argument("--state-file", type=Path, default=None, help=f"Resume log (default: <directory>/{STATE_FILE})")
+    images.add_argument("--retry-failed", action="store_true", help="Retry files that failed in a previous run")
+    images.add_argument("--limit", type=int, default=None, help="Stop after N files")
+
+    rows = subparsers.add_parser("csv", help="Load structured receipts with COPY")
+    rows.add_argument("path", type=Path)
+    rows.add_argument("--batch-size", type=int, default=5_000, help="Receipts per COPY batch")
+    rows.add_argument("--skip-invalid", action="store_true", help="Skip invalid rows instead of aborting")
+    rows.add_argument("--force", action="store_true", help="Import even if this file was already imported")
+
+    for sub in (images, rows):
+        owner = sub.add_mutually_exclusive_group(required=True)
+        owner.add_argument("--user-id", type=int)
+        owner.add_argument("--email")
+    return parser.parse_args()
+
+
+async def resolve_user(args) -> int:
+    async with AsyncSession(engine) as db:
+        if args.user_id is not None:
+            user_id = (await db.execute(select(User.id).where(User.id == args.user_id))).scalar_one_or_none()
+        else:
+            user_id = (await db.execute(select(User.id).where(User.email == args.email))).scalar_one_or_none()
+    if user_id is None:
+        raise SystemExit(f"Utente non trovato: {args.user_id or args.email}")
+    return user_id
+
+
+class Progress:
+    """Contatori e stampa periodica di avanzamento e throughput."""
+
+    def __init__(self, total: int, unit: str, every: float = 5.0):
+        self.total, self.unit, self.every = total, unit, every
+        self.ok = self.failed = self.skipped = 0
+        self.bytes = 0
+        self.started = self.last_print = time.perf_counter()
+
+    def report(self, force: bool = False):
+        now = time.perf_counter()
+        if not force and now - self.last_print < self.every:
+            return
+        self.last_print = now
+        elapsed = max(now - self.started, 1e-9)
+        done = self.ok + self.failed
+        print(
+            f"  {done + self.skipped}/{self.total} {self.unit}: {self.ok} ok, {self.failed} falliti, "
+            f"{self.skipped} saltati ({done / elapsed:.1f} {self.unit}/s, {self.bytes / elapsed / 1e6:.2f} MB/s)",
+            flush=True,
+        )
+
+
+# --- MODALITÀ IMAGES ---
+
+def load_state(path: Path) -> dict:
+    """Ultima riga per file vince: {percorso relativo: {"status", "receipt_id", "file_url"}}."""
+    state = {}
+    if path.exists():
+        with path.open(encoding="utf-8") as fh:
+            for line in fh:
+                if line.strip():
+                    entry = json.loads(line)
+                    state[entry["path"]] = entry
+    return state
+
+
+async def import_images(args, user_id: int):
+    from app.api.receipts import extract_and_save_data
+    from app.core.storage import new_file_url, upload_bytes
+    from app.services import gemini
+    from app.services.derivatives import generate_receipt_derivatives, shutdown_derivative_pool
+    from app.services.local_ocr import shutdown_local_ocr_pool
+    from app.services.model_metrics import recorder
+
+    directory = args.directory.resolve()
+    if not directory.is_dir():
+        raise SystemExit(f"Non è una cartella: {directory}")
+    state_path = args.state_file or directory / STATE_FILE
+    state = load_state(state_path)
+
+    files = sorted(p for p in directory.rglob("*") if p.is_file() and p.suffix.lower() in IMAGE_EXTENSIONS)
+    todo = []
+    for path in files:
+        entry = state.get(str(path.relative_to(directory)))
+        if entry and (entry["status"] == "completed" or (entry["status"] == "failed" and not args.retry_failed)):
+            continue
+        todo.append(path)
+    if args.limit is not None:
+        todo = todo[:args.limit]
+    progress = Progress(len(todo), "file")
+    print(f"{len(files)} file in {directory}, {len(files) - len(todo)} già importati, {len(todo)} da fare")
+
+    state_fh = state_path.open("a", encoding="utf-8")
+
+    def record(rel: str, **entry):
+        # Un solo event loop: le scritture non si sovrappongono
+        state[rel] = {"path": rel, **entry}
+        state_fh.write(json.dumps(state[rel]) + "\n")
+        state_fh.flush()
+
+    async def process(path: Path):
+        rel = str(path.relative_to(directory))
+        entry = state.get(rel) or {}
+        receipt_id, file_url = entry.get("receipt_id"), entry.get("file_url")
+        try:
+            if receipt_id is None:
+                body = await asyncio.to_thread(path.read_bytes)
+                file_url = new_file_url(user_id, path.suffix.lower())
+                content_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+                await asyncio.to_thread(upload_bytes, file_url, body, content_type)
+                async with AsyncSession(engine) as db:
+                    receipt = Receipt(user_id=user_id, file_url=file_url, status=ReceiptStatus.PENDING)
+                    db.add(receipt)
+                    await db.commit()
+                    await db.refresh(receipt)
+                    receipt_id = receipt.id
+                progress.bytes += len(body)
+                record(rel, status="uploaded", receipt_id=receipt_id, file_url=file_url)
+                await generate_receipt_derivatives(receipt_id, file_url, user_id)
+
+            # Stesso task dell'upload via API; gli errori li gestisce lui marcando lo scontrino FAILED
+            async with AsyncSession(engine) as db:
+                await extract_and_save_data(receipt_id, file_url, db, user_id)
+                outcome = (await db.execute(select(Receipt.status).where(Receipt.id == receipt_id))).scalar_one_or_none()
+        except Exception as e:
+            print(f"  ❌ {rel}: {e}", flush=True)
+            outcome = None
+        if outcome == ReceiptStatus.COMPLETED:
+            progress.ok += 1
+            record(rel, status="completed", receipt_id=receipt_id, file_url=file_url)
+        else:
+            progress.failed += 1
+            record(rel, status="failed", receipt_id=receipt_id, file_url=file_url)
+        progress.report()
+
+    async def worker(queue: asyncio.Queue):
+        while True:
+            path = await queue.get()
+            if path is None:
+                return
+            await process(path)
+
+    # Coda + N worker invece di un task per file: con decine di migliaia di file
+    # non creiamo decine di migliaia di coroutine in attesa
+    queue: asyncio.Queue = asyncio.Queue()
+    for path in todo:
+        queue.put_nowait(path)
+    for _ in range(args.concurrency):
+        queue.put_nowait(None)
+
+    gemini.init_client()
+    recorder.start()
+    try:
+        await asyncio.gather(*(worker(queue) for _ in range(args.concurrency)))
+    finally:
+        state_fh.close()
+        shutdown_derivative_pool()
+        shutdown_local_ocr_pool()
+        await recorder.stop()
+        await gemini.close_client()
+    progress.report(force=True)
+    print(f"Import completato: {progress.ok} scontrini, {progress.failed} falliti (stato in {state_path}).")
+
+
+# --- MODALITÀ CSV ---
+
+def parse_date(value: str) -> datetime:
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value.strip(), fmt)
+        except ValueError:
+            pass
+    raise ValueError(f"data non valida: {value!r}")
+
+
+def parse_amount(value: str) -> float:
+    value = value.strip()
+    if "," in value and "." not in value: # 12,50 dai fogli di calcolo italiani
+        value = value.replace(",", ".")
+    return round(float(value), 2)
+
+
+def parse_category(value: str) -> str:
+    """Nome dell'enum, che è l'etichetta salvata da PostgreSQL."""
+    name = value.strip().upper().replace(" ", "_")
+    name = CATEGORY_ALIASES.get(name, name or "OTHER")
+    if name not in ExpenseCategory.__members__:
+        raise ValueError(f"categoria non valida: {value!r}")
+    return name
+
+
+def read_csv(path: Path, skip_invalid: bool) -> dict:
+    """{receipt_ref: {"header": (...), "items": [...], "total": float|None}} nell'ordine del file."""
+    receipts, errors = {}, []
+    with path.open(newline="", encoding="utf-8-sig") as fh:
+        reader = csv.DictReader(fh)
+        missing = set(CSV_COLUMNS) - set(reader.fieldnames or ())
+        if missing:
+            raise SystemExit(f"Colonne mancanti nel CSV: {', '.join(sorted(missing))}")
+        for line, row in enumerate(reader, start=2):
+            try:
+                ref = row["receipt_ref"].strip()
+                if not ref:
+                    raise ValueError("receipt_ref vuoto")
+                header = (
+                    parse_date(row["date"]), row["store_name"].strip() or None,
+                    (row["currency"].strip() or "USD").upper()[:3], row["country"].strip() or None,
+                )
+                item = (row["description"].strip() or "Item", parse_amount(row["amount"]), parse_category(row["category"]))
+                total = parse_amount(row["total_amount"]) if (row.get("total_amount") or "").strip() else None
+            except (ValueError, AttributeError) as e:
+                errors.append(f"riga {line}: {e}")
+                continue
+            receipt = receipts.setdefault(ref, {"header": header, "items": [], "total": total})
+            if receipt["header"] != header:
+                errors.append(f"riga {line}: intestazione diversa dalle altre righe di {ref!r}")
+                continue
+            receipt["items"].append(item)
+    for error in errors[:20]:
+        print(f"  ⚠️  {error}")
+    if errors and not skip_invalid:
+        raise SystemExit(f"{len(errors)} righe non valide: niente importato (usa --skip-invalid per saltarle)")
+    return receipts
+
+
+def _dsn() -> str:
+    from app.core.config import settings
+
+    # asyncpg vuole il DSN libpq puro, senza il driver di SQLAlchemy
+    return settings.DATABASE_URL.replace("postgresql+asyncpg://", "postgresql://", 1)
+
+
+async def _allocate_ids(conn, table: str, count: int) -> list:
+    # Dalla sequenza vera: l'API può scrivere in parallelo senza collisioni
+    return await conn.fetch(
+        f"SELECT nextval(pg_get_serial_sequence('{table}', 'id')) FROM generate_series(1, $1)", count
+    )
+
+
+async def import_csv(args, user_id: int):
+    import asyncpg
+
+    digest = hashlib.sha256(args.path.read_bytes()).hexdigest()[:12]
+    url_prefix = f"{CSV_URL_PREFIX}{digest}/"
+    receipts = read_csv(args.path, args.skip_invalid)
+    total_items = sum(len(r["items"]) for r in receipts.values())
+    print(f"{len(receipts)} scontrini, {total_items} voci da {args.path}")
+    if not receipts:
+        return
+
+    conn = await asyncpg.connect(_dsn())
+    progress = Progress(len(receipts), "scontrini", every=0)
+    try:
+        async with conn.transaction():
+            already = await conn.fetchval(
+                "SELECT count(*) FROM receipts WHERE user_id = $1 AND file_url LIKE $2", user_id, url_prefix + "%"
+            )
+            if already and not args.force:
+                raise SystemExit(f"File già importato per l'utente {user_id} ({already} scontrini): usa --force")
+
+            now = datetime.utcnow()
+            refs = list(receipts)
+            for start in range(0, len(refs), args.batch_size):
+                batch = refs[start:start + args.batch_size]
+                receipt_ids = await _allocate_ids(conn, "receipts", len(batch))
+                item_ids = iter(await _allocate_ids(conn, "expense_items", sum(len(receipts[ref]["items"]) for ref in batch)))
+                receipt_rows, item_rows = [], []
+                for ref, (receipt_id,) in zip(batch, receipt_ids):
+                    receipt = receipts[ref]
+                    receipt_date, store_name, currency, country = receipt["header"]
+                    total = receipt["total"] if receipt["total"] is not None else round(sum(i[1] for i in receipt["items"]), 2)
+                    receipt_rows.append((
+                        receipt_id, user_id, store_name, receipt_date, total, currency, country,
+                        url_prefix + ref, ReceiptStatus.COMPLETED.name, now, now,
+                    ))
+                    for description, amount, category in receipt["items"]:
+                        item_rows.append((next(item_ids)[0], receipt_id, user_id, description, amount, category))
+                await conn.copy_records_to_table(
+                    "receipts", records=receipt_rows,
+                    columns=["id", "user_id", "store_name", "receipt_date", "total_amount", "currency", "country",
+                             "file_url", "status", "created_at", "updated_at"],
+                )
+                await conn.copy_records_to_table(
+                    "expense_items", records=item_rows,
+                    columns=["id", "receipt_id", "user_id", "description", "amount", "category"],
+                )
+                progress.ok += len(batch)
+                progress.report()
+
+            # COPY non passa dall'ORM: l'ETag della lista va invalidato a mano (app.core.conditional)
+            await conn.execute("UPDATE users SET data_version = data_version + 1 WHERE id = $1", user_id)
+    finally:
+        await conn.close()
+    print(f"Import completato: {len(receipts)} scontrini e {total_items} voci per l'utente {user_id}.")
+
+
+async def main(args):
+    user_id = await resolve_user(args)
+    try:
+        if args.mode == "images":
+            await import_images(args, user_id)
+        else:
+            await import_csv(args, user_id)
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
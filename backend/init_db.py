@@ -1,16 +1,86 @@
 # backend/init_db.py
 import asyncio
+from sqlalchemy import text
 from app.db.database import engine
 from app.db.models import SQLModel
 # Importiamo esplicitamente i modelli così SQLModel li "vede"
-from app.db.models import User, Receipt, ExpenseItem 
+from app.db.models import User, Receipt, ExpenseItem, UserSession, ChatSession, ChatMessage, ModelCall, AccountDeletionJob
+
+# create_all crea solo le tabelle mancanti: le colonne aggiunte dopo vanno applicate a mano.
+# Ogni statement è idempotente, quindi lo script si può rilanciare senza problemi.
+SCHEMA_UPGRADES = [
+    # Riassunti rolling delle sessioni di chat
+    "ALTER TABLE chat_sessions ADD COLUMN IF NOT EXISTS summary TEXT",
+    "ALTER TABLE chat_sessions ADD COLUMN IF NOT EXISTS summarized_until TIMESTAMP WITHOUT TIME ZONE",
+    "CREATE INDEX IF NOT EXISTS ix_chat_messages_session_created ON chat_messages (session_id, created_at)",
+    # Contatori denormalizzati e paginazione delle sessioni
+    "ALTER TABLE chat_sessions ADD COLUMN IF NOT EXISTS message_count INTEGER NOT NULL DEFAULT 0",
+    "ALTER TABLE chat_sessions ADD COLUMN IF NOT EXISTS last_message_at TIMESTAMP WITHOUT TIME ZONE",
+    """
+    UPDATE chat_sessions s SET
+        message_count = m.cnt,
+        last_message_at = m.last_at
+    FROM (SELECT session_id, COUNT(*) AS cnt, MAX(created_at) AS last_at FROM chat_messages GROUP BY session_id) m
+    WHERE m.session_id = s.id AND s.last_message_at IS NULL
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_chat_sessions_user_updated ON chat_sessions (user_id, updated_at, id)",
+    # Refresh token salvati come SHA-256 (32 byte) + scadenza per il reaper
+    "ALTER TABLE user_sessions ADD COLUMN IF NOT EXISTS refresh_token_hash BYTEA",
+    "ALTER TABLE user_sessions ADD COLUMN IF NOT EXISTS expires_at TIMESTAMP WITHOUT TIME ZONE",
+    """
+    DO $$ BEGIN
+        IF EXISTS (SELECT 1 FROM information_schema.columns
+                   WHERE table_name = 'user_sessions' AND column_name = 'refresh_token') THEN
+            UPDATE user_sessions SET refresh_token_hash = sha256(convert_to(refresh_token, 'UTF8'))
+            WHERE refresh_token_hash IS NULL;
+            DROP INDEX IF EXISTS ix_user_sessions_refresh_token;
+            ALTER TABLE user_sessions DROP COLUMN refresh_token;
+        END IF;
+    END $$
+    """,
+    "UPDATE user_sessions SET expires_at = created_at + INTERVAL '7 days' WHERE expires_at IS NULL",
+    "ALTER TABLE user_sessions ALTER COLUMN refresh_token_hash SET NOT NULL",
+    "ALTER TABLE user_sessions ALTER COLUMN expires_at SET NOT NULL",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_user_sessions_active_token ON user_sessions (refresh_token_hash) WHERE is_active",
+    "CREATE INDEX IF NOT EXISTS ix_user_sessions_user_active ON user_sessions (user_id) WHERE is_active",
+    "CREATE INDEX IF NOT EXISTS ix_user_sessions_expires ON user_sessions (expires_at)",
+    # Versione dei dati per utente: ETag e 304 senza rieseguire le query di lettura
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS data_version INTEGER NOT NULL DEFAULT 0",
+    # user_id sugli item (chiave delle partizioni hash) + indici per utente, vedi partition_tables.py
+    "ALTER TABLE expense_items ADD COLUMN IF NOT EXISTS user_id INTEGER REFERENCES users (id)",
+    """
+    DO $$ BEGIN
+        IF EXISTS (SELECT 1 FROM information_schema.columns
+                   WHERE table_name = 'expense_items' AND column_name = 'user_id' AND is_nullable = 'YES') THEN
+            UPDATE expense_items e SET user_id = r.user_id FROM receipts r
+            WHERE r.id = e.receipt_id AND e.user_id IS NULL;
+            ALTER TABLE expense_items ALTER COLUMN user_id SET NOT NULL;
+        END IF;
+    END $$
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_receipts_user_created ON receipts (user_id, created_at)",
+    "CREATE INDEX IF NOT EXISTS ix_expense_items_user_receipt ON expense_items (user_id, receipt_id)",
+    # Thumbnail e preview WebP (backfill: python backfill_derivatives.py)
+    "ALTER TABLE receipts ADD COLUMN IF NOT EXISTS thumbnail_url VARCHAR",
+    "ALTER TABLE receipts ADD COLUMN IF NOT EXISTS preview_url VARCHAR",
+    # Versione dell'OCR che ha scritto le voci: rielaborazioni e retry sostituiscono, non accodano
+    "ALTER TABLE receipts ADD COLUMN IF NOT EXISTS ocr_run INTEGER NOT NULL DEFAULT 0",
+    # Quasi-duplicati (hash percettivo); l'hash dei vecchi scontrini arriva con backfill_derivatives.py
+    "ALTER TYPE receiptstatus ADD VALUE IF NOT EXISTS 'DUPLICATE'",
+    "ALTER TABLE receipts ADD COLUMN IF NOT EXISTS image_hash BIGINT",
+    "ALTER TABLE receipts ADD COLUMN IF NOT EXISTS duplicate_of INTEGER",
+    # Rilanci automatici delle cancellazioni account fallite
+    "ALTER TABLE account_deletion_jobs ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0",
+]
 
 async def create_tables():
     print("Connessione al database Neon in corso...")
     async with engine.begin() as conn:
         # Questo comando legge le classi SQLModel e crea le tabelle nel DB
         await conn.run_sync(SQLModel.metadata.create_all)
+        for statement in SCHEMA_UPGRADES:
+            await conn.execute(text(statement))
     print("Tabelle create con successo! 🎉")
 
 if __name__ == "__main__":
-    asyncio.run(create_tables())
\ No newline at end of file
+    asyncio.run(create_tables())
@@ -0,0 +1,167 @@
+# backend/partition_tables.py
+"""
+Converte receipts, expense_items e chat_messages nello schema partizionato di app.db.partitioning.
+
+    python init_db.py                          # prima: aggiunge expense_items.user_id
+    python partition_tables.py                 # crea, copia, indicizza e scambia le tabelle
+    python partition_tables.py --drop-legacy   # dopo le verifiche: elimina le vecchie tabelle
+
+Da lanciare a API FERMA (finestra di manutenzione): la copia non insegue le modifiche concorrenti.
+Ogni lotto è una transazione a sé e la copia riparte da dove si era fermata, quindi se lo script
+si interrompe basta rilanciarlo. Le tabelle originali restano come <nome>_legacy fino a --drop-legacy.
+"""
+import argparse
+import asyncio
+import time
+from datetime import datetime
+
+from sqlalchemy import text
+
+from app.db.database import engine
+from app.db.partitioning import (
+    HASH_PARTITIONS, CHAT_PARTITION_MONTHS_AHEAD, PARTITIONED_TABLES,
+    create_table_ddl, index_ddl, is_partitioned, month_partition_ddl, month_range, month_start,
+)
+
+# FK ricreate sulle nuove tabelle (quelle vecchie restano sulle _legacy)
+FOREIGN_KEYS = {
+    "receipts": [
+        ("fk_receipts_user", "FOREIGN KEY (user_id) REFERENCES users (id)"),
+    ],
+    "expense_items": [
+        ("fk_expense_items_user", "FOREIGN KEY (user_id) REFERENCES users (id)"),
+        # La PK di receipts ora è (id, user_id): la FK deve essere composta
+        ("fk_expense_items_receipt", "FOREIGN KEY (receipt_id, user_id) REFERENCES receipts_part (id, user_id)"),
+    ],
+    "chat_messages": [
+        ("fk_chat_messages_session", "FOREIGN KEY (session_id) REFERENCES chat_sessions (id) ON DELETE CASCADE"),
+    ],
+}
+# Valore più piccolo di qualsiasi id, per il primo lotto della copia a keyset
+KEY_START = {"receipts": -1, "expense_items": -1, "chat_messages": ""}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hash-partitions", type=int, default=HASH_PARTITIONS)
+    parser.add_argument("--months-ahead", type=int, default=CHAT_PARTITION_MONTHS_AHEAD)
+    parser.add_argument("--batch-size", type=int, default=50_000)
+    parser.add_argument("--drop-legacy", action="store_true", help="Drop the *_legacy tables left by a previous run")
+    return parser.parse_args()
+
+
+async def create_tables(args):
+    async with engine.begin() as conn:
+        for table in PARTITIONED_TABLES:
+            for statement in create_table_ddl(table, table, f"{table}_part", table, args.hash_partitions):
+                await conn.execute(text(statement))
+
+        # Un mese per ogni mese presente nei dati, più quelli futuri
+        bounds = (await conn.execute(text("SELECT min(created_at), max(created_at) FROM chat_messages"))).one()
+        today = datetime.utcnow().date()
+        first = bounds[0].date() if bounds[0] else today
+        last = max(bounds[1].date() if bounds[1] else today, month_start(today, args.months_ahead))
+        for month in month_range(first, last):
+            await conn.execute(text(month_partition_ddl("chat_messages_part", "chat_messages", month)))
+
+
+async def copy_table(table: str, batch_size: int):
+    # CTE materializzata una volta: lo stesso lotto viene inserito e misurato
+    copy_batch = text(f"""
+        WITH batch AS (SELECT * FROM {table} WHERE id > :last ORDER BY id LIMIT :batch_size),
+             copied AS (INSERT INTO {table}_part SELECT * FROM batch)
+        SELECT max(id), count(*) FROM batch
+    """)
+    async with engine.connect() as conn:
+        last = (await conn.execute(text(f"SELECT max(id) FROM {table}_part"))).scalar()
+        total = (await conn.execute(text(
+            "SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:table)"), {"table": table})).scalar()
+    last = KEY_START[table] if last is None else last
+    copied, started = 0, time.perf_counter()
+    while True:
+        async with engine.begin() as conn:
+            batch_last, batch_count = (await conn.execute(copy_batch, {"last": last, "batch_size": batch_size})).one()
+        if not batch_count:
+            break
+        last, copied = batch_last, copied + batch_count
+        rate = copied / (time.perf_counter() - started)
+        print(f"  {table:<14} {copied:>12,} / ~{max(total or 0, copied):,} rows  ({rate:,.0f} rows/s)", flush=True)
+
+
+async def add_indexes_and_keys():
+    for table in PARTITIONED_TABLES:
+        async with engine.begin() as conn:
+            for statement in index_ddl(table, f"{table}_part"):
+                await conn.execute(text(statement))
+            for name, definition in FOREIGN_KEYS[table]:
+                exists = (await conn.execute(
+                    text("SELECT 1 FROM pg_constraint WHERE conname = :name AND conrelid = to_regclass(:table)"),
+                    {"name": name, "table": f"{table}_part"},
+                )).scalar()
+                if not exists:
+                    await conn.execute(text(f"ALTER TABLE {table}_part ADD CONSTRAINT {name} {definition}"))
+            print(f"  {table}: indexes and foreign keys ready", flush=True)
+
+
+async def _index_names(conn, table: str) -> list:
+    query = text("SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() AND tablename = :table")
+    return [row[0] for row in (await conn.execute(query, {"table": table})).all()]
+
+
+async def swap_tables():
+    """Una sola transazione: o le tre tabelle sono scambiate, o nessuna."""
+    async with engine.begin() as conn:
+        await conn.execute(text(f"LOCK TABLE {', '.join(PARTITIONED_TABLES)} IN ACCESS EXCLUSIVE MODE"))
+        for table in PARTITIONED_TABLES:
+            sequence = (await conn.execute(text("SELECT pg_get_serial_sequence(:table, 'id')"), {"table": table})).scalar()
+            # I nomi degli indici sono unici per schema: quelli vecchi si spostano per lasciare posto ai nuovi
+            for name in await _index_names(conn, table):
+                await conn.execute(text(f'ALTER INDEX "{name}" RENAME TO "{name[:56]}_legacy"'))
+            await conn.execute(text(f"ALTER TABLE {table} RENAME TO {table}_legacy"))
+            await conn.execute(text(f"ALTER TABLE {table}_part RENAME TO {table}"))
+            for name in await _index_names(conn, table):
+                if name.endswith("_part"):
+                    await conn.execute(text(f'ALTER INDEX "{name}" RENAME TO "{name[:-len("_part")]}"'))
+            if sequence:
+                # Altrimenti DROP della tabella _legacy si porterebbe via la sequenza degli id
+                await conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY {table}.id"))
+            print(f"  {table}: swapped, old table kept as {table}_legacy", flush=True)
+
+
+async def drop_legacy():
+    async with engine.begin() as conn:
+        # Prima i figli: expense_items_legacy ha la FK verso receipts_legacy
+        for table in ("expense_items", "chat_messages", "receipts"):
+            await conn.execute(text(f"DROP TABLE IF EXISTS {table}_legacy"))
+            print(f"  {table}_legacy dropped", flush=True)
+
+
+async def main(args):
+    if args.drop_legacy:
+        await drop_legacy()
+        return
+
+    async with engine.connect() as conn:
+        done = [table for table in PARTITIONED_TABLES if await is_partitioned(conn, table)]
+    if len(done) == len(PARTITIONED_TABLES):
+        print("Tabelle già partizionate: niente da fare.")
+        return
+    if done:
+        raise SystemExit(f"Stato inatteso: solo {', '.join(done)} è partizionata, controllare a mano.")
+
+    print("1/4 Creazione delle tabelle partizionate...")
+    await create_tables(args)
+    print("2/4 Copia dei dati a lotti...")
+    for table in PARTITIONED_TABLES:
+        await copy_table(table, args.batch_size)
+    print("3/4 Indici secondari e foreign key...")
+    await add_indexes_and_keys()
+    print("4/4 Scambio delle tabelle...")
+    await swap_tables()
+    async with engine.begin() as conn:
+        await conn.execute(text("ANALYZE receipts, expense_items, chat_messages"))
+    print("Partizionamento completato! 🎉 Le vecchie tabelle si eliminano con --drop-legacy.")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
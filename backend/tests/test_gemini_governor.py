@@ -0,0 +1,46 @@
+# tests/test_gemini_governor.py
+"""Semaforo a priorità del governatore Gemini: la chat non deve mai aspettare dietro l'OCR."""
+import asyncio
+
+import pytest
+
+from app.services.gemini import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, PrioritySlots
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_interactive_not_blocked_by_queued_background():
+    slots = PrioritySlots(4, 2)
+    await slots.acquire(PRIORITY_BACKGROUND)
+    await slots.acquire(PRIORITY_BACKGROUND)
+    # Terzo job OCR: fermo sul tetto del background, resta in coda
+    background = asyncio.create_task(slots.acquire(PRIORITY_BACKGROUND))
+    await asyncio.sleep(0)
+    assert not background.done()
+
+    # Ci sono slot liberi (2 su 4): la chat deve partire subito
+    await asyncio.wait_for(slots.acquire(PRIORITY_INTERACTIVE), timeout=1)
+    assert slots.in_use == 3
+    assert not background.done()
+
+    slots.release(PRIORITY_BACKGROUND)
+    await asyncio.wait_for(background, timeout=1)
+    assert slots.background_in_use == 2
+
+
+async def test_per_user_cap_applies_only_to_background():
+    slots = PrioritySlots(8, 5, per_user_limit=2)
+    await slots.acquire(PRIORITY_BACKGROUND, user_id=1)
+    await slots.acquire(PRIORITY_BACKGROUND, user_id=1)
+    third = asyncio.create_task(slots.acquire(PRIORITY_BACKGROUND, user_id=1))
+    await asyncio.sleep(0)
+    assert not third.done()
+
+    # La chat dello stesso utente e l'OCR di un altro utente non aspettano il suo upload
+    await asyncio.wait_for(slots.acquire(PRIORITY_INTERACTIVE, user_id=1), timeout=1)
+    await asyncio.wait_for(slots.acquire(PRIORITY_BACKGROUND, user_id=2), timeout=1)
+    assert not third.done()
+
+    slots.release(PRIORITY_BACKGROUND, user_id=1)
+    await asyncio.wait_for(third, timeout=1)
+    assert slots.user_background == {1: 2, 2: 1}
@@ -0,0 +1,53 @@
+# tests/test_query_budgets.py
+"""
+Budget di query degli endpoint più chiamati (app.testing.max_queries): una query in più o un N+1
+(una query per scontrino) fanno fallire il test.
+"""
+import pytest
+
+from app.db.database import async_session_factory
+from app.db.models import ExpenseItem, Receipt, ReceiptStatus
+
+pytestmark = pytest.mark.anyio
+
+
+async def _add_receipts(user_id: int, receipts: int, items: int):
+    async with async_session_factory() as db:
+        for n in range(receipts):
+            receipt = Receipt(
+                user_id=user_id, file_url=f"https://storage.test/users/{user_id}/{n}.jpg",
+                store_name=f"Store {n}", total_amount=items * 2.5, currency="EUR", status=ReceiptStatus.COMPLETED,
+            )
+            db.add(receipt)
+            await db.flush()
+            db.add_all([
+                ExpenseItem(receipt_id=receipt.id, user_id=user_id, description=f"Item {i}", amount=2.5)
+                for i in range(items)
+            ])
+        await db.commit()
+
+
+async def test_me_query_budget(client, test_user, auth_headers, max_queries):
+    # Sessione + utente. Senza lifespan il canale di revoca non parte e la cache delle sessioni
+    # resta spenta: è il caso peggiore, quello di un worker appena avviato
+    with max_queries(2, route="/auth/me"):
+        response = await client.get("/auth/me", headers=auth_headers)
+    assert response.status_code == 200
+    assert response.json()["id"] == test_user["id"]
+
+
+async def test_list_receipts_query_budget(client, test_user, auth_headers, max_queries):
+    await _add_receipts(test_user["id"], receipts=12, items=3)
+
+    # Autenticazione (2) + data_version per l'ETag (1) + scontrini (1) + voci (1), per quanti scontrini ci siano
+    with max_queries(5, route="/receipts"):
+        response = await client.get("/receipts", headers=auth_headers)
+    assert response.status_code == 200
+    receipts = response.json()
+    assert len(receipts) == 12
+    assert all(len(r["items"]) == 3 for r in receipts)
+
+    # Poll con l'ETag: 304 dopo la sola lettura di data_version, senza le query vere
+    with max_queries(3, route="/receipts"):
+        response = await client.get("/receipts", headers={**auth_headers, "If-None-Match": response.headers["etag"]})
+    assert response.status_code == 304
@@ -0,0 +1,30 @@
+# tests/test_receipt_text.py
+"""Parser a regole dell'OCR locale: date nell'ordine del paese e valuta scritta per esteso."""
+from app.core.receipt_text import AMBIGUOUS_DATE_MAX_CONFIDENCE, parse_currency, parse_date, parse_receipt_lines, score_receipt
+
+
+def test_date_order_follows_country():
+    assert parse_date("03/04/2025", month_first=True) == ("2025-03-04", False)
+    assert parse_date("03/04/2025", month_first=False) == ("2025-04-03", False)
+    # Un numero sopra 12 decide da solo, qualunque sia il paese
+    assert parse_date("03/25/2025", month_first=False) == ("2025-03-25", False)
+    assert parse_date("2025-03-04") == ("2025-03-04", False)
+
+
+def test_ambiguous_date_without_hint_falls_back_to_model():
+    assert parse_date("03/04/2025") == ("2025-04-03", True)
+    assert parse_date("04/04/2025") == ("2025-04-04", False)
+
+    receipt, ambiguous = parse_receipt_lines(["BAR SPORT", "CAFFE 1,20", "TOTALE 1,20", "03/04/2025"])
+    assert ambiguous
+    assert score_receipt(receipt, 1.0, ambiguous) <= AMBIGUOUS_DATE_MAX_CONFIDENCE
+
+
+def test_usd_receipt_reads_month_first():
+    receipt, ambiguous = parse_receipt_lines(["BAR SPORT", "COFFEE 1.20", "TOTAL USD 1.20", "03/04/2025"])
+    assert (receipt["receipt_date"], receipt["country"], ambiguous) == ("2025-03-04", "United States", False)
+
+
+def test_currency_written_in_full():
+    assert parse_currency("TOTALE EURO 12,50") == "EUR"
+    assert parse_currency("EUROSPIN") is None
@@ -0,0 +1,41 @@
+# tests/test_startup_imports.py
+"""
+Cold start sotto pytest: `import app.main` in un interprete pulito deve stare nel budget
+e non caricare i client pesanti (boto3, google-genai), che si creano al primo uso.
+Stesso probe di benchmarks/bench_startup.py, solo la fase di import (niente database).
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from benchmarks.bench_startup import BACKEND_DIR, HEAVY_MODULES, _PROBE
+
+# Su macchine CI lente si alza il budget dall'ambiente invece di toccare il test
+IMPORT_BUDGET_MS = float(os.getenv("STARTUP_IMPORT_BUDGET_MS", "1500"))
+IMPORT_RUNS = int(os.getenv("STARTUP_IMPORT_RUNS", "3"))
+
+
+def _probe_import() -> dict:
+    # Interprete pulito: nel processo di pytest altri test possono aver già importato questi moduli.
+    # Eredita l'ambiente di conftest (Settings finti), quindi non serve né il .env né il database
+    result = subprocess.run(
+        [sys.executable, "-c", _PROBE.format(heavy=HEAVY_MODULES, startup=False)],
+        cwd=BACKEND_DIR, capture_output=True, text=True,
+    )
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_app_main_import_within_budget():
+    results = [_probe_import() for _ in range(IMPORT_RUNS)]
+
+    heavy = sorted({name for r in results for name in r["heavy"]})
+    assert not heavy, f"import app.main loaded {', '.join(heavy)}"
+
+    # Mediana come nel benchmark: un singolo run lento (disco freddo) non fa fallire la suite
+    import_ms = statistics.median(r["import_ms"] for r in results)
+    assert import_ms <= IMPORT_BUDGET_MS, (
+        f"import app.main took {import_ms:.0f} ms (budget {IMPORT_BUDGET_MS:.0f} ms)"
+    )
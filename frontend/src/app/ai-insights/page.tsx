@@ -16,13 +16,16 @@ import ThinkingLoader from '@/components/ai-insights/ThinkingLoader';
 
 
 type Message = { id: string; role: 'user' | 'assistant'; content: string; };
-type ChatSession = { id: string; title: string; created_at: string; };
+type ChatSession = { id: string; title: string; created_at: string; updated_at?: string; message_count?: number; last_message_at?: string | null; };
 
 export default function AIInsightsChat() {
   // --- STATI ---
   const [sessions, setSessions] = useState<ChatSession[]>([]);
+  const [sessionsCursor, setSessionsCursor] = useState<string | null>(null); // Pagina successiva della sidebar
   const [activeSessionId, setActiveSessionId] = useState<string | null>(null);
   const [messages, setMessages] = useState<Message[]>([]);
+  const [olderCursor, setOlderCursor] = useState<string | null>(null); // Messaggi più vecchi da caricare
+  const [isLoadingOlder, setIsLoadingOlder] = useState(false);
   
   const [input, setInput] = useState('');
   const [isLoading, setIsLoading] = useState(false);
@@ -50,23 +53,48 @@ export default function AIInsightsChat() {
   const fetchSessions = async () => {
     try {
       const res = await apiClient.get('/ai/sessions');
-      setSessions(res.data);
+      setSessions(res.data.items);
+      setSessionsCursor(res.data.next_cursor);
+    } catch (error) { console.error(error); }
+  };
+
+  const fetchMoreSessions = async () => {
+    if (!sessionsCursor) return;
+    try {
+      const res = await apiClient.get('/ai/sessions', { params: { cursor: sessionsCursor } });
+      setSessions(prev => [...prev, ...res.data.items]);
+      setSessionsCursor(res.data.next_cursor);
     } catch (error) { console.error(error); }
   };
 
   const loadSession = async (sessionId: string) => {
     setActiveSessionId(sessionId);
     setMessages([]);
+    setOlderCursor(null);
     if (window.innerWidth < 768) setIsSidebarOpen(false);
     try {
+      // Solo l'ultima pagina: i messaggi più vecchi arrivano on demand
       const res = await apiClient.get(`/ai/sessions/${sessionId}`);
-      setMessages(res.data);
+      setMessages(res.data.items);
+      setOlderCursor(res.data.next_cursor);
+    } catch (error) { console.error(error); }
+  };
+
+  const loadOlderMessages = async () => {
+    if (!activeSessionId || !olderCursor || isLoadingOlder) return;
+    setIsLoadingOlder(true);
+    try {
+      const res = await apiClient.get(`/ai/sessions/${activeSessionId}`, { params: { before: olderCursor } });
+      setMessages(prev => [...res.data.items, ...prev]);
+      setOlderCursor(res.data.next_cursor);
     } catch (error) { console.error(error); }
+    finally { setIsLoadingOlder(false); }
   };
 
   const handleNewChat = () => {
     setActiveSessionId(null);
     setMessages([]);
+    setOlderCursor(null);
     if (window.innerWidth < 768) setIsSidebarOpen(false);
   };
 
@@ -209,6 +237,8 @@ export default function AIInsightsChat() {
         onLoadSession={loadSession} 
         onDeleteSession={handleDeleteSession} 
         onCloseSidebar={() => setIsSidebarOpen(false)} 
+        hasMore={!!sessionsCursor}
+        onLoadMore={fetchMoreSessions}
       />
 
       {/* MAIN CHAT AREA */}
@@ -247,6 +277,14 @@ export default function AIInsightsChat() {
               )}
             </AnimatePresence>
 
+            {olderCursor && (
+              <div className="flex justify-center">
+                <button onClick={loadOlderMessages} disabled={isLoadingOlder} className="flex items-center gap-1.5 px-3 py-1.5 text-xs font-semibold text-slate-500 hover:text-violet-600 hover:bg-violet-50 dark:hover:bg-violet-900/20 rounded-lg transition-colors">
+                  {isLoadingOlder ? <Loader2 className="w-3.5 h-3.5 animate-spin" /> : null} Load older messages
+                </button>
+              </div>
+            )}
+
             {messages.map((msg) => (
               <motion.div key={msg.id} initial={{ opacity: 0, y: 10 }} animate={{ opacity: 1, y: 0 }} className={`flex gap-3 sm:gap-4 group ${msg.role === 'user' ? 'justify-end' : 'justify-start'}`}>
                 {msg.role === 'assistant' && (
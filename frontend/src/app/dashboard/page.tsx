@@ -216,6 +216,7 @@ export default function DashboardPage() {
                     <option value="completed">Completed</option>
                     <option value="pending">Pending</option>
                     <option value="failed">Failed</option>
+                    <option value="duplicate">Duplicate</option>
                   </select>
                 </div>
 
@@ -1,5 +1,5 @@
 import { motion, AnimatePresence } from 'framer-motion';
-import { ReceiptIcon, Loader2, CheckCircle, AlertCircle, MapPin } from 'lucide-react';
+import { ReceiptIcon, Loader2, CheckCircle, AlertCircle, MapPin, Copy } from 'lucide-react';
 
 export default function ReceiptList({ receipts, onSelectReceipt }: { receipts: any[], onSelectReceipt: (r: any) => void }) {
   
@@ -56,6 +56,11 @@ export default function ReceiptList({ receipts, onSelectReceipt }: { receipts: a
                       )}
                     </div>
                   </>
+                ) : receipt.status === 'duplicate' ? (
+                  <>
+                    <h3 className="font-semibold text-slate-500 dark:text-slate-400 italic">Duplicate receipt</h3>
+                    <p className="text-sm text-slate-400 dark:text-slate-500 mt-0.5">Looks like receipt #{receipt.duplicate_of}, not analyzed again</p>
+                  </>
                 ) : (
                   <>
                     <h3 className="font-semibold text-slate-500 dark:text-slate-400 italic">Processing...</h3>
@@ -85,6 +90,12 @@ export default function ReceiptList({ receipts, onSelectReceipt }: { receipts: a
                 </span>
               )}
 
+              {(receipt.status === 'duplicate' || (receipt.status === 'completed' && receipt.duplicate_of)) && (
+                <span className="flex items-center text-xs font-medium text-amber-700 dark:text-amber-400 bg-amber-50 dark:bg-amber-900/20 border border-amber-200 dark:border-amber-900/50 px-2.5 py-1 rounded-full">
+                  <Copy size={12} className="mr-1.5" /> {receipt.status === 'duplicate' ? 'Duplicate' : 'Possible duplicate'}
+                </span>
+              )}
+
               {receipt.status === 'failed' && (
                 <span className="flex items-center text-xs font-medium text-red-700 dark:text-red-400 bg-red-50 dark:bg-red-900/20 border border-red-200 dark:border-red-900/50 px-2.5 py-1 rounded-full">
                   <AlertCircle size={12} className="mr-1.5" /> Failed
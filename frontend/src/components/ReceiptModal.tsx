@@ -1,10 +1,26 @@
 import { motion } from 'framer-motion';
 import { X, Download, Loader2, MapPin } from 'lucide-react';
-import { useState } from 'react';
+import { useEffect, useState } from 'react';
 import { apiClient } from '@/lib/api';
 
 export default function ReceiptModal({ receipt, onClose }: { receipt: any, onClose: () => void }) {
   const [isDownloading, setIsDownloading] = useState(false);
+  const [previewSrc, setPreviewSrc] = useState<string | null>(null);
+
+  // Preview WebP (qualche decina di KB) invece dell'originale: il browser la tiene in cache un anno
+  useEffect(() => {
+    if (!receipt.preview_url) return;
+    let objectUrl: string | null = null;
+    apiClient.get(`/receipts/${receipt.id}/image/preview`, { responseType: 'blob' })
+      .then((res) => {
+        objectUrl = URL.createObjectURL(res.data);
+        setPreviewSrc(objectUrl);
+      })
+      .catch(() => setPreviewSrc(null));
+    return () => {
+      if (objectUrl) URL.revokeObjectURL(objectUrl);
+    };
+  }, [receipt.id, receipt.preview_url]);
 
   const handleSecureDownload = async () => {
     try {
@@ -64,6 +80,13 @@ export default function ReceiptModal({ receipt, onClose }: { receipt: any, onClo
         </div>
 
         <div className="p-6 overflow-y-auto custom-scrollbar flex-1 bg-white dark:bg-slate-900">
+          {previewSrc && (
+            <img
+              src={previewSrc}
+              alt={`Receipt from ${receipt.store_name || 'unknown store'}`}
+              className="w-full max-h-72 object-contain rounded-2xl mb-6 bg-slate-50 dark:bg-slate-950 border border-slate-100 dark:border-slate-800"
+            />
+          )}
           <h3 className="text-xs font-bold text-slate-400 dark:text-slate-500 uppercase tracking-widest mb-4">Purchased Items</h3>
           <div className="space-y-4">
             {receipt.items && receipt.items.length > 0 ? (
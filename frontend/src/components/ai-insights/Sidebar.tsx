@@ -1,7 +1,7 @@
 import { Plus, MessageSquare, Trash2 } from 'lucide-react';
 import { motion } from 'framer-motion';
 
-type ChatSession = { id: string; title: string; created_at: string; };
+type ChatSession = { id: string; title: string; created_at: string; message_count?: number; };
 
 interface SidebarProps {
   sessions: ChatSession[];
@@ -11,10 +11,12 @@ interface SidebarProps {
   onLoadSession: (id: string) => void;
   onDeleteSession: (e: React.MouseEvent, id: string) => void;
   onCloseSidebar: () => void;
+  hasMore?: boolean;
+  onLoadMore?: () => void;
 }
 
 export default function Sidebar({
-  sessions, activeSessionId, isSidebarOpen, onNewChat, onLoadSession, onDeleteSession, onCloseSidebar
+  sessions, activeSessionId, isSidebarOpen, onNewChat, onLoadSession, onDeleteSession, onCloseSidebar, hasMore, onLoadMore
 }: SidebarProps) {
   return (
     <>
@@ -41,6 +43,11 @@ export default function Sidebar({
               </button>
             </motion.div>
           ))}
+          {hasMore && (
+            <button onClick={onLoadMore} className="w-full px-3 py-2 text-xs font-semibold text-slate-500 hover:text-violet-600 rounded-lg transition-colors">
+              Load more
+            </button>
+          )}
         </div>
       </div>
       {isSidebarOpen && <div className="fixed inset-0 bg-slate-900/50 z-30 md:hidden backdrop-blur-sm" onClick={onCloseSidebar} />}